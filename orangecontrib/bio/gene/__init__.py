@@ -72,6 +72,159 @@ class GeneInfo(object):
     def __str__(self):
         return repr(self)
 
+def _native(value):
+    return value if six.PY2 else value.decode("utf-8")
+
+class GeneInfoTable(object):
+    """
+    A columnar table of NCBI gene info. Values of each column (see
+    GeneInfo.NCBI_GENEINFO_TAGS) are stored in a byte string table and
+    gene ids are indexed with an :obj:`AliasIndex`. A table opened with
+    :obj:`open` is saved next to the gene info file and memory mapped, so
+    only the columns and rows that are used are read from disk.
+    """
+
+    VERSION = 1
+
+    TAGS = GeneInfo.NCBI_GENEINFO_TAGS
+
+    def __init__(self, rows, columns=None, ids=None, path=None):
+        self.rows = rows
+        self.path = path
+        self._columns = columns if columns is not None else {}
+        self._ids = ids
+        self._names = None
+        self._keys = None
+
+    @classmethod
+    def from_lines(cls, lines):
+        """ Build a table from lines of a gene info file. """
+        values = [ [] for _ in cls.TAGS ]
+        for line in lines:
+            line = line.rstrip(b"\r\n")
+            if not line.strip() or line.startswith(b"#"):
+                continue
+            fields = line.split(b"\t", len(cls.TAGS))[:len(cls.TAGS)]
+            fields += [b"-"] * (len(cls.TAGS) - len(fields))
+            for col, value in zip(values, fields):
+                col.append(value)
+        columns = {}
+        for tag, col in zip(cls.TAGS, values):
+            strings = numpy.frombuffer(b"".join(v + b"\n" for v in col),
+                                       dtype=numpy.uint8)
+            offsets = _indptr([ len(v) + 1 for v in col ])
+            columns[tag] = (strings, offsets)
+        ids = [ [_native(id)] for id in values[cls.TAGS.index("gene_id")] ]
+        return cls(len(ids), columns, AliasIndex.from_groups(ids))
+
+    @classmethod
+    def open(cls, filename):
+        """
+        Open a table of the gene info file filename. The table is saved
+        into filename + ".table" and rebuilt when the file changes.
+        """
+        path = filename + ".table"
+        stat = os.stat(filename)
+        source = {"size": stat.st_size, "mtime": stat.st_mtime}
+        try:
+            with open(os.path.join(path, "table.json")) as f:
+                desc = json.load(f)
+            if desc["version"] == cls.VERSION and desc["source"] == source:
+                return cls(desc["rows"], path=path)
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        with open(filename, "rb") as f:
+            table = cls.from_lines(f)
+        try:
+            table.save(path, source)
+        except (IOError, OSError):
+            pass # the table is optional
+        return table
+
+    def save(self, path, source=None):
+        parent = os.path.dirname(os.path.abspath(path))
+        tmp = tempfile.mkdtemp(dir=parent)
+        for tag in self.TAGS:
+            strings, offsets = self.column_arrays(tag)
+            numpy.save(os.path.join(tmp, tag + ".strings.npy"), strings)
+            numpy.save(os.path.join(tmp, tag + ".offsets.npy"), offsets)
+        self.ids_index().save(os.path.join(tmp, "ids"))
+        with open(os.path.join(tmp, "table.json"), "w") as f:
+            json.dump({"version": self.VERSION, "source": source,
+                       "rows": self.rows}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+        self.path = path
+
+    def __len__(self):
+        return self.rows
+
+    def column_arrays(self, tag):
+        """ Return (strings, offsets) of a column; load it if needed. """
+        if tag not in self._columns:
+            self._columns[tag] = tuple(
+                numpy.load(os.path.join(self.path, tag + ext), mmap_mode="r")
+                for ext in [".strings.npy", ".offsets.npy"])
+        return self._columns[tag]
+
+    def column(self, tag):
+        """ Return a list of all values of a column (unparsed). """
+        strings, _ = self.column_arrays(tag)
+        return _native(strings.tobytes()).split("\n")[:-1]
+
+    def value(self, tag, row):
+        strings, offsets = self.column_arrays(tag)
+        return _native(strings[offsets[row]:offsets[row + 1] - 1].tobytes())
+
+    def line(self, row):
+        """ Return a row as a line of the gene info file. """
+        return "\t".join(self.value(tag, row) for tag in self.TAGS)
+
+    def ids_index(self):
+        if self._ids is None:
+            self._ids, _ = AliasIndex.load(os.path.join(self.path, "ids"))
+        return self._ids
+
+    def ids(self):
+        """ Return a list of gene ids. """
+        if self._keys is None:
+            self._keys = self.column("gene_id")
+        return self._keys
+
+    def find(self, gene_id):
+        """ Return the row of gene_id or -1. """
+        if not isinstance(gene_id, basestring):
+            return -1
+        rows = self.ids_index()[gene_id]
+        return max(rows) if rows else -1
+
+    def names_index(self):
+        """
+        Return an :obj:`AliasIndex` of gene symbols, locus tags and synonyms
+        to rows. It is built on first use and saved with the table.
+        """
+        if self._names is None and self.path is not None:
+            try:
+                self._names, _ = AliasIndex.load(
+                    os.path.join(self.path, "names"))
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+        if self._names is None:
+            groups = []
+            for symbol, locus_tag, synonyms in zip(self.column("symbol"),
+                    self.column("locus_tag"), self.column("synonyms")):
+                groups.append([ n for n in [symbol, locus_tag] + synonyms.split("|")
+                                if n and n != "-" ])
+            self._names = AliasIndex.from_groups(groups)
+            if self.path is not None:
+                try:
+                    self._names.save(os.path.join(self.path, "names"))
+                except (IOError, OSError):
+                    pass
+        return self._names
+
 class GeneHistory(object):
     NCBI_GENE_HISTORY_TAGS = ("tax_id", "gene_id", "discontinued_gene_id", "discontinued_symbol", "discontinue_date")
     __slots__ = NCBI_GENE_HISTORY_TAGS
@@ -101,18 +254,31 @@ class NCBIGeneInfo(dict):
 
 
         fname = serverfiles.localpath_download("NCBI_geneinfo", "gene_info.%s.db" % self.taxid)
-        file = open(fname, "rt")
-        self.update(dict([(line.split("\t", 3)[1], line) for line in file.read().splitlines() if line.strip() and not line.startswith("#")]))
+        #rows are read from a memory mapped columnar table when accessed
+        self.table = GeneInfoTable.open(fname)
 
+        #the matcher is built and given target names on first use
         self.matcher = genematcher
-        if self.matcher == None:
+
+    @property
+    def matcher(self):
+        if self._matcher == None:
             if self.taxid == '352472':
-                self.matcher = matcher([GMNCBI(self.taxid), GMDicty(), [GMNCBI(self.taxid), GMDicty()]])
+                self._matcher = matcher([GMNCBI(self.taxid), GMDicty(), [GMNCBI(self.taxid), GMDicty()]])
             else:
-                self.matcher = matcher([GMNCBI(self.taxid)])
-
-        #if this is done with a gene matcher, pool target names
-        self.matcher.set_targets(self.keys())
+                self._matcher = matcher([GMNCBI(self.taxid)])
+            self._matcher_targets = False
+
+        if not self._matcher_targets:
+            #if this is done with a gene matcher, pool target names
+            self._matcher.set_targets(self.keys())
+            self._matcher_targets = True
+        return self._matcher
+
+    @matcher.setter
+    def matcher(self, genematcher):
+        self._matcher = genematcher
+        self._matcher_targets = False
         
     def history(self):
         if getattr(self, "_history", None) is None:
@@ -151,12 +317,17 @@ class NCBIGeneInfo(dict):
         return cls.TAX_MAP.get(taxid, taxid)
 
     @classmethod    
-    def load(cls, file):
+    def load(cls, file, genematcher=None):
         """ A class method that loads gene info from file
         """
-        if type(file) in [str, unicode]:
-            file = open(file, "rb")
-        return cls((line.split("\t", 3)[1], line) for line in file.read().splitlines() if line.strip() and not line.startswith("#"))
+        self = cls.__new__(cls)
+        self.taxid = None
+        if isinstance(file, basestring):
+            self.table = GeneInfoTable.open(file)
+        else:
+            self.table = GeneInfoTable.from_lines(file)
+        self.matcher = genematcher if genematcher != None else GMDirect()
+        return self
         
     def get_info(self, gene_id, def_=None):
         """ Search and return the GeneInfo object for gene_id
@@ -174,9 +345,45 @@ class NCBIGeneInfo(dict):
         id = self.matcher.umatch(name)
         return self[id]
 
+    def search(self, name):
+        """ Return a sorted list of ids of genes with the given symbol,
+        locus tag or synonym (case sensitive). A gene matcher is not used.
+        """
+        rows = self.table.names_index()[name]
+        return sorted(set(self.table.value("gene_id", row) for row in rows))
+
     def __getitem__(self, key):
 #        return self.get(gene_id, self.matcher[gene_id])
-        return GeneInfo(dict.__getitem__(self, key))
+        if dict.__contains__(self, key):
+            return GeneInfo(dict.__getitem__(self, key))
+        row = self.table.find(key)
+        if row < 0:
+            raise KeyError(key)
+        return GeneInfo(self.table.line(row))
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self.table.find(key) >= 0
+
+    has_key = __contains__
+
+    def _added_keys(self):
+        """ Keys set with __setitem__ that are not in the table. """
+        return [ key for key in dict.keys(self) if self.table.find(key) < 0 ]
+
+    def __len__(self):
+        return len(self.table) + len(self._added_keys())
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterkeys(self):
+        for key in self.table.ids():
+            yield key
+        for key in self._added_keys():
+            yield key
+
+    def keys(self):
+        return list(self.iterkeys())
 
     def __setitem__(self, key, value):
         if type(value) == str:
@@ -191,8 +398,8 @@ class NCBIGeneInfo(dict):
             return def_
 
     def itervalues(self):
-        for val in dict.itervalues(self):
-            yield GeneInfo(val)
+        for key in self.iterkeys():
+            yield self[key]
 
     def iteritems(self):
         for key, val in zip(self.iterkeys(), self.itervalues()):
@@ -345,6 +552,13 @@ Gene matcher.
 
 from collections import defaultdict
 import os
+import json
+import shutil
+import tempfile
+import zlib
+
+import numpy
+import six
 
 gene_matcher_path = None
 
@@ -378,6 +592,171 @@ def create_mapping(groups, lower=False):
 
     return togroup
 
+def _alias_key(alias, lower=False):
+    if lower:
+        alias = alias.lower()
+    if isinstance(alias, six.text_type):
+        alias = alias.encode("utf-8")
+    return alias
+
+def _alias_hash(key):
+    """ A stable 64-bit hash of an encoded alias. """
+    return (zlib.crc32(key) & 0xffffffff) << 32 | (zlib.adler32(key) & 0xffffffff)
+
+def _indptr(counts):
+    indptr = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=indptr[1:])
+    return indptr
+
+def _ranges(starts, stops):
+    """
+    Concatenate index ranges starts[i]:stops[i]. Return a pair (indptr,
+    indices), where the i-th range is indices[indptr[i]:indptr[i+1]].
+    """
+    lengths = numpy.asarray(stops) - numpy.asarray(starts)
+    indptr = _indptr(lengths)
+    indices = numpy.arange(indptr[-1], dtype=numpy.int64) \
+        - numpy.repeat(indptr[:-1] - starts, lengths)
+    return indptr, indices
+
+def _distinct(items):
+    """
+    Return a list of distinct items (in the order of first occurrence)
+    and an array of their indices for all items.
+    """
+    codes = {}
+    inverse = [ codes.setdefault(item, len(codes)) for item in items ]
+    distinct = [None] * len(codes)
+    for item, code in codes.items():
+        distinct[code] = item
+    return distinct, numpy.array(inverse, dtype=numpy.int64)
+
+class AliasIndex(object):
+    """
+    A compiled mapping of aliases to indices of groups (as built by
+    create_mapping). UTF-8 encoded aliases, sorted by their 64-bit hashes
+    (hashes), are stored in a single string table with offsets, and group
+    indices of the i-th alias are groups[indptr[i]:indptr[i+1]]. The
+    arrays are saved into .npy files and memory mapped on load, so that
+    processes using the same index share a single copy.
+    """
+
+    VERSION = 1
+
+    def __init__(self, hashes, strings, offsets, indptr, groups):
+        self.hashes = hashes
+        self.strings = strings
+        self.offsets = offsets
+        self.indptr = indptr
+        self.groups = groups
+
+    @classmethod
+    def from_groups(cls, groups, lower=False):
+        """ Build an index from a list of sets of aliases. """
+        pairs = set()
+        for i, group in enumerate(groups):
+            for alias in group:
+                key = _alias_key(alias, lower)
+                pairs.add((_alias_hash(key), key, i))
+        pairs = sorted(pairs)
+
+        keys = []
+        hashes = []
+        indptr = [0]
+        for n, (h, key, _) in enumerate(pairs):
+            if not keys or keys[-1] != key:
+                if keys:
+                    indptr.append(n)
+                keys.append(key)
+                hashes.append(h)
+        indptr.append(len(pairs))
+
+        strings = numpy.frombuffer(b"".join(keys), dtype=numpy.uint8)
+        offsets = numpy.zeros(len(keys) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(k) for k in keys], out=offsets[1:])
+        return cls(numpy.array(hashes, dtype=numpy.uint64), strings, offsets,
+                   numpy.array(indptr, dtype=numpy.int64),
+                   numpy.array([i for _, _, i in pairs], dtype=numpy.int32))
+
+    ARRAYS = ["hashes", "strings", "offsets", "indptr", "groups"]
+
+    def save(self, path, meta=None):
+        """ Save the index into directory path. """
+        parent = os.path.dirname(os.path.abspath(path))
+        tmp = tempfile.mkdtemp(dir=parent)
+        for name in self.ARRAYS:
+            numpy.save(os.path.join(tmp, name + ".npy"), getattr(self, name))
+        with open(os.path.join(tmp, "index.json"), "w") as f:
+            json.dump({"version": self.VERSION, "meta": meta}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a saved index. Return a tuple (index, meta). """
+        with open(os.path.join(path, "index.json")) as f:
+            desc = json.load(f)
+        if desc["version"] != cls.VERSION:
+            raise ValueError("Unsupported alias index version")
+        arrays = [ numpy.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                   for name in cls.ARRAYS ]
+        return cls(*arrays), desc["meta"]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _key(self, i):
+        return self.strings[self.offsets[i]:self.offsets[i+1]].tobytes()
+
+    def _find(self, key):
+        h = numpy.uint64(_alias_hash(key))
+        i = int(self.hashes.searchsorted(h))
+        while i < len(self) and self.hashes[i] == h:
+            if self._key(i) == key:
+                return i
+            i += 1
+        return -1
+
+    def __contains__(self, alias):
+        return self._find(_alias_key(alias)) >= 0
+
+    def __getitem__(self, alias):
+        """ Return a set of group indices of an (already lower cased) alias. """
+        i = self._find(_alias_key(alias))
+        if i < 0:
+            return set()
+        return set(self.groups[self.indptr[i]:self.indptr[i+1]].tolist())
+
+    def find_many(self, aliases):
+        """ Return positions of aliases in the index (-1 if missing). """
+        keys = [_alias_key(alias) for alias in aliases]
+        hashes = numpy.array([_alias_hash(key) for key in keys],
+                             dtype=numpy.uint64)
+        pos = self.hashes.searchsorted(hashes)
+        hit = pos < len(self)
+        hit[hit] = self.hashes[pos[hit]] == hashes[hit]
+        pos[~hit] = -1
+        for n in numpy.flatnonzero(hit):
+            if self._key(pos[n]) != keys[n]: # hash collision
+                pos[n] = self._find(keys[n])
+        return pos
+
+    def groups_many(self, aliases):
+        """
+        Return group indices of many (already lower cased) aliases as
+        a pair (indptr, groups), where groups of the i-th alias are
+        groups[indptr[i]:indptr[i+1]].
+        """
+        pos = self.find_many(aliases)
+        found = pos >= 0
+        starts = numpy.zeros(len(pos), dtype=numpy.int64)
+        stops = numpy.zeros(len(pos), dtype=numpy.int64)
+        starts[found] = self.indptr[pos[found]]
+        stops[found] = self.indptr[pos[found] + 1]
+        indptr, ind = _ranges(starts, stops)
+        return indptr, numpy.asarray(self.groups[ind], dtype=numpy.int64)
+
 def join_sets(set1, set2, lower=False):
     """ 
     Joins two sets of gene set mappings. If lower is True, lower case
@@ -439,6 +818,125 @@ def join_sets_l(lsets, lower=False):
         current = join_sets(current, b, lower=lower)
     return current
 
+class AliasJoiner(object):
+    """
+    Joins groups of aliases from multiple sources (gene set mappings) with
+    a union-find structure. Groups from different sources sharing an alias
+    (compared in lower case if lower is True) end up in the same connected
+    component; groups from the same source are only joined through groups
+    of other sources. Unlike join_sets_l, the result is a transitive closure.
+
+    Sources can be added one by one. The join is saved as its union-find
+    parents (see :obj:`parents`) and restored from them and the sources
+    (see :obj:`restore`), so a new source can be joined to an existing
+    (cached) join.
+    """
+
+    def __init__(self, lower=False):
+        self.lower = lower
+        self.groups = [] #groups of aliases from all sources
+        self.parent = [] #union-find parents of groups
+        self.sizes = [] #number of groups of each source
+        #alias -> (source, group ids) while the alias was seen in a single
+        #source only, (None, [representative group id]) afterwards
+        self.keys = {}
+
+    @classmethod
+    def restore(cls, sources, parent, lower=False):
+        """ Return a joiner of sources (lists of sets of aliases) with
+        union-find parents saved by :obj:`parents`. """
+        joiner = cls(lower=lower)
+        joiner._restore(sources, parent)
+        return joiner
+
+    def _restore(self, sources, parent):
+        for groups in sources:
+            self._add(groups, join=False)
+        if len(parent) != len(self.groups):
+            raise ValueError("parents do not match the sources")
+        self.parent = [ int(p) for p in parent ]
+
+    def parents(self):
+        """ Return an array of union-find parents of groups. Groups of
+        aliases are not included; they are the groups of the sources. """
+        return numpy.array(self.parent, dtype=int)
+
+    def __getstate__(self):
+        #keys are derived from groups when loading
+        return { "lower": self.lower, "sizes": self.sizes,
+                 "groups": self.groups, "parent": self.parents() }
+
+    def __setstate__(self, state):
+        self.__init__(lower=state["lower"])
+        groups = state["groups"]
+        offsets = numpy.cumsum([0] + state["sizes"])
+        self._restore([ groups[a:b] for a, b in zip(offsets[:-1], offsets[1:]) ],
+                      state["parent"])
+
+    def _find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def _union(self, i, j):
+        i, j = self._find(i), self._find(j)
+        if i < j:
+            self.parent[j] = i
+        elif j < i:
+            self.parent[i] = j
+
+    def _add(self, groups, join=True):
+        source = len(self.sizes)
+        self.sizes.append(0)
+        for group in groups:
+            gid = len(self.groups)
+            group = set(group)
+            self.groups.append(group)
+            self.parent.append(gid)
+            self.sizes[source] += 1
+            keys = set(a.lower() for a in group) if self.lower else group
+            for key in keys:
+                entry = self.keys.get(key)
+                if entry is None:
+                    self.keys[key] = (source, [gid])
+                elif entry[0] == source:
+                    entry[1].append(gid)
+                else: #shared by multiple sources: join all its groups
+                    if join:
+                        for other in entry[1]:
+                            self._union(gid, other)
+                    if entry[0] is not None:
+                        self.keys[key] = (None, [entry[1][0]])
+
+    def add(self, groups):
+        """ Join a new source (a list of sets of aliases). """
+        self._add(groups)
+        return self
+
+    def components(self):
+        """ Return joined groups of aliases (a list of sets). """
+        components = {}
+        order = []
+        for gid, group in enumerate(self.groups):
+            root = self._find(gid)
+            if root not in components:
+                components[root] = set()
+                order.append(root)
+            components[root].update(group)
+        return [ components[root] for root in order ]
+
+def join_components(lsets, lower=False):
+    """
+    Join multiple gene set mappings into connected components of groups
+    that share aliases (see :obj:`AliasJoiner`).
+    """
+    joiner = AliasJoiner(lower=lower)
+    for sets in lsets:
+        joiner.add(sets)
+    return joiner.components()
+
 class Matcher(object):
     """
     Matches an input gene to some target gene (set in advance).
@@ -471,6 +969,19 @@ class Matcher(object):
         """
         notImplemented()
 
+    @property
+    def targets(self):
+        """ Distinct target genes; match_many and umatch_many return indices into this list. """
+        return self.matcho.targets
+
+    def match_many(self, genes):
+        """Return lists of indices of matching targets for a list of genes (see :obj:`Match.match_many`)."""
+        return self.matcho.match_many(genes)
+
+    def umatch_many(self, genes):
+        """Return an array of indices of unique matching targets for a list of genes (-1 where umatch returns None)."""
+        return self.matcho.umatch_many(genes)
+
 def buffer_path():
     """ Returns buffer path from Orange's setting folder if not 
     defined differently (in gene_matcher_path). """
@@ -484,13 +995,11 @@ def buffer_path():
     else:
         return gene_matcher_path
 
-def auto_pickle(filename, version, func, *args, **kwargs):
+def load_pickled(filename, version):
     """
-    Run function func with given arguments and save the results to
-    a file named filename. If results for a given filename AND
-    version were already saved, just read and return them.
+    Return a tuple (ok, output) with the results saved with save_pickled
+    for the given version (if version is None, any version is accepted).
     """
-
     output = None
     outputOk = False
 
@@ -500,8 +1009,8 @@ def auto_pickle(filename, version, func, *args, **kwargs):
         try:
             versionF = pickle.load(f)
             if version == None or versionF == version:
-                outputOk = True
                 output = pickle.load(f)
+                outputOk = True
         except:
             pass
         finally:
@@ -510,14 +1019,26 @@ def auto_pickle(filename, version, func, *args, **kwargs):
     except:
         pass
 
+    return outputOk, output
+
+def save_pickled(filename, version, output):
+    f = open(filename,'wb')
+    pickle.dump(version, f, -1)
+    pickle.dump(output, f, -1)
+    f.close()
+
+def auto_pickle(filename, version, func, *args, **kwargs):
+    """
+    Run function func with given arguments and save the results to
+    a file named filename. If results for a given filename AND
+    version were already saved, just read and return them.
+    """
+    outputOk, output = load_pickled(filename, version)
+
     if not outputOk:
         output = func(*args, **kwargs)
-
         #save output before returning
-        f = open(filename,'wb')
-        pickle.dump(version, f, -1)
-        pickle.dump(output, f, -1)
-        f.close()
+        save_pickled(filename, version, output)
 
     return output
 
@@ -540,11 +1061,25 @@ class MatcherAliases(Matcher):
             gene = gene.lower()
         return self.mdict[gene]
 
+    def to_ids_many(self, genes):
+        """
+        Return ids of sets of aliases of many genes as a pair (indptr, ids),
+        where ids of the i-th gene are ids[indptr[i]:indptr[i+1]].
+        """
+        if self.ignore_case:
+            genes = [ gene.lower() for gene in genes ]
+        groups = [ self.mdict.get(gene, ()) for gene in genes ]
+        indptr = _indptr([ len(g) for g in groups ])
+        ids = numpy.fromiter((id for g in groups for id in g),
+                             dtype=numpy.int64, count=indptr[-1])
+        return indptr, ids
+
     def set_targets(self, targets):
         """
         A reverse dictionary is made according to each target's membership
         in the sets of aliases.
         """
+        targets = list(targets)
         d = defaultdict(list)
         #d = id: [ targets ], where id is index of the set of aliases
         for target in targets:
@@ -552,7 +1087,7 @@ class MatcherAliases(Matcher):
             if ids != None:
                 for id in ids:
                     d[id].append(target)
-        mo = MatchAliases(d, self)
+        mo = MatchAliases(d, self, targets)
         self.matcho = mo #backward compatibility - default match object
         return mo
 
@@ -564,16 +1099,93 @@ class MatcherAliases(Matcher):
 
 class Match(object):
 
+    #: Distinct target genes in the order they were given
+    targets = []
+
     def umatch(self, gene):
         """Returns an unique (only one matching target) target or None"""
         mat = self.match(gene)
         return mat[0] if len(mat) == 1 else None
- 
+
+    def _match_distinct(self, genes):
+        """
+        Match a list of distinct genes. Return a pair (indptr, indices),
+        where indices (into targets) of matches of the i-th gene are
+        indices[indptr[i]:indptr[i+1]], sorted.
+        """
+        tindex = dict((t, i) for i, t in enumerate(self.targets))
+        matches = [ sorted(tindex[t] for t in self.match(gene))
+                    for gene in genes ]
+        indptr = _indptr([ len(m) for m in matches ])
+        indices = numpy.fromiter((i for m in matches for i in m),
+                                 dtype=numpy.int64, count=indptr[-1])
+        return indptr, indices
+
+    def match_many(self, genes):
+        """
+        Match a whole list of genes at once. Return a list with a sorted
+        list of indices of matching targets (see :obj:`targets`) for
+        each gene. Repeated genes are matched only once.
+        """
+        distinct, inverse = _distinct(genes)
+        indptr, indices = self._match_distinct(distinct)
+        matches = [ indices[a:b].tolist()
+                    for a, b in zip(indptr[:-1], indptr[1:]) ]
+        return [ list(matches[i]) for i in inverse ]
+
+    def umatch_many(self, genes):
+        """
+        Return an integer array with the index of the unique matching
+        target for each gene, or -1 if there are no or multiple matches.
+        """
+        distinct, inverse = _distinct(genes)
+        indptr, indices = self._match_distinct(distinct)
+        unique = numpy.diff(indptr) == 1
+        res = numpy.full(len(distinct), -1, dtype=numpy.int64)
+        res[unique] = indices[indptr[:-1][unique]]
+        return res[inverse]
+
 class MatchAliases(Match):
 
-    def __init__(self, to_targets, parent):
+    def __init__(self, to_targets, parent, targets=None):
         self.to_targets = to_targets
         self.parent = parent
+        if targets is None:
+            targets = [ t for id in sorted(to_targets) for t in to_targets[id] ]
+        self.targets = _distinct(targets)[0]
+        self._target_table = None
+
+    def target_table(self):
+        """
+        Return arrays (ids, indptr, indices): indices of targets of
+        the set of aliases ids[i] are indices[indptr[i]:indptr[i+1]].
+        """
+        if self._target_table is None:
+            tindex = dict((t, i) for i, t in enumerate(self.targets))
+            ids = sorted(self.to_targets)
+            groups = [ sorted(set(tindex[t] for t in self.to_targets[id]))
+                       for id in ids ]
+            indptr = _indptr([ len(g) for g in groups ])
+            indices = numpy.fromiter((i for g in groups for i in g),
+                                     dtype=numpy.int64, count=indptr[-1])
+            self._target_table = \
+                (numpy.array(ids, dtype=numpy.int64), indptr, indices)
+        return self._target_table
+
+    def _match_distinct(self, genes):
+        gindptr, gids = self.parent.to_ids_many(genes)
+        gene = numpy.repeat(numpy.arange(len(genes)), numpy.diff(gindptr))
+        ids, indptr, indices = self.target_table()
+        pos = ids.searchsorted(gids)
+        found = pos < len(ids)
+        found[found] = ids[pos[found]] == gids[found]
+        gene, pos = gene[found], pos[found]
+        tindptr, tind = _ranges(indptr[pos], indptr[pos + 1])
+        ntargets = max(len(self.targets), 1)
+        pairs = numpy.unique(numpy.repeat(gene, numpy.diff(tindptr)) * ntargets
+                             + indices[tind])
+        counts = numpy.bincount(pairs // ntargets, minlength=len(genes))
+        return _indptr(counts), pairs % ntargets
 
     def match(self, gene):
         """
@@ -625,6 +1237,67 @@ class MatcherAliasesPickled(MatcherAliases):
 
     mdict = property(get_mdict, set_mdict)
 
+    def to_ids(self, gene):
+        """ Return ids of sets of aliases the gene belongs to. The compiled
+        alias index is used instead of mdict if aliases can be pickled. """
+        index = self.alias_index()
+        if index is None:
+            return MatcherAliases.to_ids(self, gene)
+        if self.ignore_case:
+            gene = gene.lower()
+        return index[gene]
+
+    def _pickle_filename(self):
+        fn = self.filename()
+        if fn is None:
+            return None
+        if isinstance(fn, tuple): #if you pass tuple, look directly
+            return fn[0]
+        return os.path.join(buffer_path(), fn)
+
+    def alias_index(self):
+        """
+        Return an :obj:`AliasIndex` of aliases, which is saved next to the
+        pickled aliases and memory mapped. Return None if aliases can not
+        be pickled or mdict was set explicitly.
+        """
+        if self.saved_index is not None or self.saved_mdict:
+            return self.saved_index
+        filename = self._pickle_filename()
+        if filename is None:
+            return None
+        path = filename + (".ic" if self.ignore_case else "") + ".index"
+        ver = self.create_aliases_version()
+
+        def meta():
+            # the index is valid for a given state of the pickled aliases
+            stat = os.stat(filename)
+            return {"aliases_version": ver, "size": stat.st_size,
+                    "mtime": stat.st_mtime}
+
+        try:
+            index, saved_meta = AliasIndex.load(path)
+            if saved_meta != meta():
+                index = None
+        except (IOError, OSError, ValueError, KeyError):
+            index = None
+        if index is None:
+            index = AliasIndex.from_groups(self.aliases, lower=self.ignore_case)
+            try:
+                index.save(path, meta())
+            except (IOError, OSError):
+                pass
+        self.saved_index = index
+        return index
+
+    def to_ids_many(self, genes):
+        index = self.alias_index()
+        if index is None:
+            return MatcherAliases.to_ids_many(self, genes)
+        if self.ignore_case:
+            genes = [ gene.lower() for gene in genes ]
+        return index.groups_many(genes)
+
     def set_targets(self, targets):
         return MatcherAliases.set_targets(self, targets)
 
@@ -641,13 +1314,9 @@ class MatcherAliasesPickled(MatcherAliases):
         notImplemented()
 
     def load_aliases(self):
-        fn = self.filename()
+        filename = self._pickle_filename()
         ver = self.create_aliases_version() #if version == None ignore it
-        if fn != None:
-            if isinstance(fn, tuple): #if you pass tuple, look directly
-               filename = fn[0]
-            else:
-               filename = os.path.join(buffer_path(), fn)
+        if filename != None:
             return auto_pickle(filename, ver, self.create_aliases)
         else:
             #if either file version of version is None, do not pickle
@@ -656,6 +1325,7 @@ class MatcherAliasesPickled(MatcherAliases):
     def __init__(self, ignore_case=True):
         self.aliases = []
         self.mdict = {}
+        self.saved_index = None
         self.ignore_case = ignore_case
         self.filename() # test if valid filename can be built
 
@@ -761,8 +1431,11 @@ class MatcherAliasesNCBI(MatcherAliasesPickled):
     def create_aliases(self):
         ncbi = NCBIGeneInfo(self.organism, genematcher=GMDirect())
         out = []
-        for k in ncbi.keys():
-            out.append(set(filter(None, [k, ncbi[k].symbol, ncbi[k].locus_tag] + [ s for s in ncbi[k].synonyms ] )))
+        columns = [ ncbi.table.column(tag) for tag in ["gene_id", "symbol", "locus_tag"] ]
+        synonyms = ncbi.table.column("synonyms")
+        for names, syn in zip(zip(*columns), synonyms):
+            names = list(names) + (syn.split("|") if syn != "-" else [])
+            out.append(set(n for n in names if n and n != "-"))
         return out
 
     def filename(self):
@@ -851,14 +1524,65 @@ class MatcherAliasesPickledJoined(MatcherAliasesPickled):
             return None
 
     def create_aliases(self):
-        return join_sets_l([ mat.aliases for mat in self.matchers ], lower=self.ignore_case)
+        return self.joiner().components()
 
     def create_aliases_version(self):
         try:
-            return "v4_" + "__".join([ mat.create_aliases_version() for mat in self.matchers ])
+            return "v5_" + "__".join([ mat.create_aliases_version() for mat in self.matchers ])
         except:
             return None
 
+    def _joiner_pickle(self, matchers):
+        """ Return (filename, version) of the pickled joiner of matchers
+        or (None, None) if they can not be pickled. """
+        try:
+            filenames = [ mat.filename() for mat in matchers ]
+            version = "uf2_" + "__".join([ mat.create_aliases_version()
+                                           for mat in matchers ])
+            name = "__".join(filenames + [ "icj" if self.ignore_case else "j" ])
+            return os.path.join(buffer_path(), name + ".joiner"), version
+        except:
+            return None, None
+
+    def joiner(self):
+        """
+        Return an :obj:`AliasJoiner` of all matchers. The joiner of the
+        longest prefix of matchers that was already computed is restored
+        and only the remaining matchers are joined to it. Joins of all
+        longer prefixes are saved (as union-find parents only).
+        """
+        joiner = None
+        for n in range(len(self.matchers), 1, -1):
+            filename, version = self._joiner_pickle(self.matchers[:n])
+            if filename is not None:
+                ok, parent = load_pickled(filename, version)
+                if ok:
+                    joiner = AliasJoiner.restore(
+                        [ mat.aliases for mat in self.matchers[:n] ],
+                        parent, lower=self.ignore_case)
+                    break
+        else:
+            n = 0
+        if joiner is None:
+            joiner = AliasJoiner(lower=self.ignore_case)
+        for i in range(n, len(self.matchers)):
+            joiner.add(self.matchers[i].aliases)
+            if i > 0:
+                filename, version = self._joiner_pickle(self.matchers[:i+1])
+                if filename is not None:
+                    save_pickled(filename, version, joiner.parents())
+        return joiner
+
+    def add_matcher(self, matcher):
+        """ Join aliases of another matcher. The already computed join is
+        reused (see :obj:`joiner`). """
+        if matcher.ignore_case != self.ignore_case:
+            notAllMatchersHaveEqualIgnoreCase()
+        self.matchers = self.matchers + [matcher]
+        self.aliases = []
+        self.mdict = {}
+        self.saved_index = None
+
     def __init__(self, matchers):
         """ 
         Join matchers together. Groups of aliases are joined if
@@ -906,6 +1630,26 @@ class MatchSequence(Match):
 
     def __init__(self, ms):
         self.ms = ms
+        self.targets = ms[0].targets if ms else []
+
+    def _match_distinct(self, genes):
+        remaining = numpy.arange(len(genes))
+        matched, indices = [], []
+        for match in self.ms:
+            if not len(remaining):
+                break
+            indptr, ind = match._match_distinct([ genes[i] for i in remaining ])
+            counts = numpy.diff(indptr)
+            matched.append(numpy.repeat(remaining, counts))
+            indices.append(ind)
+            remaining = remaining[counts == 0]
+        if not matched:
+            return _indptr(numpy.zeros(len(genes), dtype=int)), \
+                numpy.zeros(0, dtype=numpy.int64)
+        matched = numpy.concatenate(matched)
+        order = numpy.argsort(matched, kind="mergesort")
+        indptr = _indptr(numpy.bincount(matched, minlength=len(genes)))
+        return indptr, numpy.concatenate(indices)[order]
 
     def match(self, gene):
         for match in self.ms:
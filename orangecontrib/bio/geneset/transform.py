@@ -128,14 +128,14 @@ class GeneSetTrans(object):
         the gene set with specified indices.
         """
         nm, name_ind = mat_ni(instance.domain, self.matcher)
-        genes = [ nm.umatch(gene) for gene in geneset ]
+        genes = umatch_names(nm, geneset)
         if takegenes:
             genes = [ genes[i] for i in takegenes ]
         return nm, name_ind, genes
 
     def _match_data(self, data, geneset, odic=False):
         nm, name_ind = mat_ni(data.domain, self.matcher)
-        genes = [ nm.umatch(gene) for gene in geneset ]
+        genes = umatch_names(nm, geneset)
         if odic:
             to_geneset = dict(zip(genes, geneset))
         takegenes = [ i for i,a in enumerate(genes) if a != None ]
@@ -350,8 +350,8 @@ class Assess(GeneSetTrans):
         from .. import gsea as obiGsea
         if key not in self.example_buffer:
             ex_atts = [ at.name for at in ex.domain.attributes ]
-            new_atts = [ name_ind[nm.umatch(an)] if nm.umatch(an) != None else (None if self.ignore_unmatchable_context else i)
-                for i,an in enumerate(ex_atts) ]
+            new_atts = [ name_ind[m] if m != None else (None if self.ignore_unmatchable_context else i)
+                for i,m in enumerate(umatch_names(nm, ex_atts)) ]
 
             #new_atts: indices of genes in original data for that sample 
             #POSSIBLE REVERSE IMPLEMENTATION (slightly different
@@ -468,12 +468,19 @@ def mat_ni(domain, matcher):
     name_ind = dict((n.name,i) for i,n in enumerate(domain.attributes))
     return nm, name_ind
 
+def umatch_names(nm, genes):
+    """ Return unique matches of genes (None if there are no or multiple
+    matches) with a single call to umatch_many of the gene matcher nm. """
+    targets = nm.targets
+    return [ targets[i] if i >= 0 else None
+             for i in nm.umatch_many(list(genes)) ]
+
 def select_genesets(nm, gene_sets, min_size=3, max_size=1000, min_part=0.1):
     """ Returns a list of gene sets that have sizes in limits """
 
     def ok_sizes(gs):
         """compares sizes of genesets to limitations"""
-        transl = filter(lambda x: x != None, [ nm.umatch(gene) for gene in gs.genes ])
+        transl = filter(lambda x: x != None, umatch_names(nm, gs.genes))
         if len(transl) >= min_size \
             and len(transl) <= max_size \
             and float(len(transl))/len(gs.genes) >= min_part:
@@ -4,6 +4,9 @@ import os
 import gzip
 import re
 import io
+import json
+import tempfile
+import warnings
 
 from collections import defaultdict
 
@@ -58,6 +61,71 @@ def spots_max(x):
     else:
         return max(vs)
 
+
+def _grouped_median(values, starts, sizes):
+    res = numpy.empty((len(starts), values.shape[1]))
+    for size in numpy.unique(sizes):
+        groups = numpy.flatnonzero(sizes == size)
+        rows = starts[groups][:, None] + numpy.arange(size)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all unknown
+            res[groups] = numpy.nanmedian(values[rows], axis=1)
+    return res
+
+
+def _grouped_mean(values, starts, sizes):
+    known = ~numpy.isnan(values)
+    sums = numpy.add.reduceat(numpy.where(known, values, 0.), starts, axis=0)
+    counts = numpy.add.reduceat(known.astype(int), starts, axis=0)
+    with numpy.errstate(invalid="ignore"):
+        return sums / counts
+
+
+#: Vectorized versions of the merge functions.
+_GROUPED_MERGE = {
+    spots_mean: _grouped_mean,
+    spots_median: _grouped_median,
+    spots_min: lambda values, starts, sizes:
+        numpy.fmin.reduceat(values, starts, axis=0),
+    spots_max: lambda values, starts, sizes:
+        numpy.fmax.reduceat(values, starts, axis=0),
+}
+
+
+def merge_spots(values, sizes, merge_function=spots_mean):
+    """
+    Merge consecutive groups of rows (spots) in a 2D array of values with
+    NaN as unknowns. `sizes` are the numbers of rows in the groups.
+    Return an array with a row for each group. The column values of a
+    group are merged with `merge_function`; :obj:`spots_mean`,
+    :obj:`spots_median`, :obj:`spots_min` and :obj:`spots_max` are
+    computed for all groups at once.
+    """
+    values = numpy.asarray(values, dtype=float)
+    sizes = numpy.asarray(sizes, dtype=int)
+    if len(sizes) == 0:
+        return numpy.zeros((0, values.shape[1]))
+    starts = numpy.cumsum(sizes) - sizes
+    if merge_function in _GROUPED_MERGE:
+        return _GROUPED_MERGE[merge_function](values, starts, sizes)
+
+    tounknown = lambda v: compat.unknown if numpy.isnan(v) else float(v)
+    tonan = lambda v: numpy.nan if compat.isunknown(v) else v
+    res = numpy.empty((len(sizes), values.shape[1]))
+    for i, (start, size) in enumerate(zip(starts, sizes)):
+        for j in range(values.shape[1]):
+            res[i, j] = tonan(merge_function(
+                tuple(tounknown(v) for v in values[start:start + size, j])))
+    return res
+
+
+def _compat_rows(X):
+    """Convert an array with NaN as unknowns to rows for compat.create_table."""
+    if compat.OR3:
+        return X
+    return [[compat.unknown if numpy.isnan(v) else float(v) for v in row]
+            for row in X]
+
 p_assign = re.compile(" = (.*$)")
 p_tagvalue = re.compile("![a-z]*_([a-z_]*) = (.*)$")    
 tagvalue = lambda x: p_tagvalue.search(x).groups()
@@ -69,6 +137,147 @@ FTP_DIR = "pub/geo/DATA/SOFT/GDS/"
 
 SOFT_ENCODING = "utf-8"  # Is this true?
 
+#: Version of the binary SOFT cache format (see :obj:`load_soft`).
+SOFT_CACHE_VERSION = 1
+
+
+def _native_strings(obj):
+    """Convert unicode strings (from json in Python 2) to str."""
+    if six.PY3:
+        return obj
+    if isinstance(obj, unicode):
+        return obj.encode(SOFT_ENCODING)
+    elif isinstance(obj, list):
+        return [_native_strings(a) for a in obj]
+    elif isinstance(obj, dict):
+        return dict((_native_strings(k), _native_strings(v))
+                    for k, v in obj.items())
+    return obj
+
+
+def parse_soft(filename):
+    """
+    Parse a gzipped GDS SOFT file in a single pass.
+
+    Return a tuple (info, spots, genes, values), where `info` is a
+    dictionary with the data set information (see :obj:`GDS.info`),
+    `spots` and `genes` are lists of spot ids and their genes (one
+    for each row of the data table) and `values` is a float32 array of
+    expressions with spots in rows and samples in columns. Unknown
+    values are NaN.
+    """
+    getstate = lambda x: x.split(" ")[0][1:]
+    getid = lambda x: x.rstrip().split(" ")[2]
+
+    f = gzip.open(filename, "rb")
+    if six.PY3:
+        f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
+
+    state = None; previous_state = None
+
+    info = {"subsets": []}
+    subset = None
+    spots, genes, values = [], [], []
+
+    with f:
+        for line in f:
+            if line[0] == "^":
+                if subset:
+                    info["subsets"] += [subset]
+                    subset = None
+                previous_state = state; state = getstate(line)
+                if state == "SUBSET":
+                    subset = {"id": getid(line)}
+                if state == "DATASET":
+                    info["dataset_id"] = getid(line)
+                continue
+            if state == "DATASET":
+                if previous_state == "DATABASE":
+                    tag, value = tagvalue(line)
+                    info[tag] = value
+                elif line.startswith("!dataset_table_begin"):
+                    break
+            if state == "SUBSET":
+                tag, value = tagvalue(line)
+                if tag == "description" or tag == "type":
+                    subset[tag] = value
+                if tag == "sample_id":
+                    subset[tag] = value.split(",")
+
+        if subset:
+            info["subsets"] += [subset]
+        for t, v in info.items():
+            if "count" in t:
+                info[t] = int(v)
+
+        # the data table
+        info["samples"] = f.readline().rstrip().split("\t")[2:]
+        nsamples = len(info["samples"])
+        for line in f:
+            if line.startswith("!dataset_table_end"):
+                break
+            d = line.rstrip().split("\t")
+            spots.append(d[0])
+            genes.append(d[1])
+            vals = [v if v != "null" else "nan" for v in d[2:2 + nsamples]]
+            values.extend(vals + ["nan"] * (nsamples - len(vals)))
+
+    values = numpy.array(values, dtype=float).astype(numpy.float32)
+    return info, spots, genes, values.reshape((len(spots), nsamples))
+
+
+def _soft_cache_paths(filename):
+    base = filename[:-3] if filename.endswith(".gz") else filename
+    return base + ".npy", base + ".json"
+
+
+def _replace(src, dst):
+    if os.name == "nt" and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def load_soft(filename):
+    """
+    Return (info, spots, genes, values) as :obj:`parse_soft`, but use a
+    binary cache stored next to the SOFT file: the (memory mapped)
+    values in a .npy file and the remaining data in a .json file. The
+    cache is rebuilt when the SOFT file changes.
+    """
+    npypath, jsonpath = _soft_cache_paths(filename)
+    stat = os.stat(filename)
+    source = {"size": stat.st_size, "mtime": stat.st_mtime}
+    try:
+        with io.open(jsonpath, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["version"] == SOFT_CACHE_VERSION and meta["source"] == source:
+            values = numpy.load(npypath, mmap_mode="r")
+            if values.shape == (len(meta["spots"]), len(meta["info"]["samples"])):
+                return (_native_strings(meta["info"]),
+                        _native_strings(meta["spots"]),
+                        _native_strings(meta["genes"]), values)
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    info, spots, genes, values = parse_soft(filename)
+
+    meta = {"version": SOFT_CACHE_VERSION, "source": source,
+            "info": info, "spots": spots, "genes": genes}
+    dirname = os.path.dirname(npypath)
+    try:
+        # write to temporary files first; concurrent readers should
+        # never see partial data
+        with tempfile.NamedTemporaryFile(dir=dirname, delete=False) as f:
+            numpy.save(f, values)
+        _replace(f.name, npypath)
+        with tempfile.NamedTemporaryFile("wb", dir=dirname, delete=False) as f:
+            f.write(json.dumps(meta).encode("utf-8"))
+        _replace(f.name, jsonpath)
+    except (IOError, OSError):
+        pass  # the cache is optional
+
+    return info, spots, genes, values
+
 
 class GDSInfo:
 
@@ -172,77 +381,20 @@ class GDS():
                 os.rename(targetfn + "2", targetfn)
 
     def _getinfo(self):
-        """Parse GDS data file and return a dictionary with info."""
-        getstate = lambda x: x.split(" ")[0][1:] 
-        getid = lambda x: x.rstrip().split(" ")[2]
+        """Load GDS data file (or its binary cache) and set info."""
         self._download()
-        f = gzip.open(self.filename, "rb")
-        if six.PY3:
-            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
-
-        state = None; previous_state = None
-    
-        info = {"subsets" : []}
-        subset = None
-    
-        # GDS information part
-        for line in f:
-            if line[0] == "^":
-                previous_state = state; state = getstate(line)
-                if state == "SUBSET":
-                    if subset:
-                        info["subsets"] += [subset]
-                    subset = {"id" : getid(line)}
-                if state == "DATASET":
-                    info["dataset_id"] = getid(line)
-                continue
-            if state == "DATASET":
-                if previous_state == "DATABASE":
-                    tag, value = tagvalue(line)
-                    info[tag] = value
-                else:
-                    if subset:
-                        info["subsets"] += [subset]
-                    break
-            if state == "SUBSET":
-                tag, value = tagvalue(line)
-                if tag == "description" or tag == "type":
-                    subset[tag] = value
-                if tag == "sample_id":
-                    subset[tag] = value.split(",")
-        for t,v in info.items():
-            if "count" in t:
-                info[t] = int(v)
-                
-        # sample information
-        state = None
-        for line in f:
-            if state == "header":
-                info["samples"] = line.rstrip().split("\t")[2:]
-                break
-            if line.startswith("!dataset_table_begin"):
-                state = "header"
-        self.info = info
+        self.info, self._spots, self._spot_genes, self._values = \
+            load_soft(self.filename)
 
     def _getspotmap(self, include_spots=None):
         """Return gene to spot and spot to genes mapings."""
-        f = gzip.open(self.filename, "rb")
-        if six.PY3:
-            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
-        for line in f:
-            if line.startswith("!dataset_table_begin"):
-                break
-        f.readline() # skip header
         spot2gene = {}
         gene2spots = {}
-        for line in f:
-            if line.startswith("!dataset_table_end"):
-                break
-            spot, gene = line.rstrip().split("\t")[0:2]
+        for spot, gene in zip(self._spots, self._spot_genes):
             if include_spots and (spot not in include_spots):
                 continue 
             spot2gene[spot] = gene
-            gene2spots[gene] = gene2spots.get(gene, []) + [spot]
+            gene2spots.setdefault(gene, []).append(spot)
     
         self.spot2gene = spot2gene
         self.gene2spots = gene2spots
@@ -269,29 +421,38 @@ class GDS():
     
     def _parse_soft(self, remove_unknown=None):
         """Parse GDS data, returns data dictionary."""
-        f = gzip.open(self.filename, "rb")
-        if six.PY3:
-            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
+        unknown = numpy.isnan(self._values)
+        keep = numpy.ones(len(self._spots), dtype=bool)
+        if remove_unknown and self._values.shape[1]:
+            keep = unknown.mean(axis=1) <= remove_unknown
+
+        rows = numpy.flatnonzero(keep)
+        # expressions of kept spots (NaN for unknown) and their rows
+        self._gdsvalues = values = self._values[rows].astype(float)
+        self._gdsrows = dict((self._spots[i], j) for j, i in enumerate(rows))
 
-        mfloat = lambda x: float(x) if x != 'null' else compat.unknown
-    
         data = {}
-        # find the start of the data part
-        for line in f:
-            if line.startswith("!dataset_table_begin"):
-                break
-        f.readline()
-        
-        # load data
-        for line in f:
-            if line.startswith("!dataset_table_end"):
-                break
-            d = line.rstrip().split("\t")
-            if remove_unknown and (float(d[2:].count('null')) / len(d[2:]) > remove_unknown):
-#                print "ZZZ", float(d[2:].count('null')) / len(d[2:]), d[2:]
-                continue 
-            data[d[0]] = GeneData(d[0], d[1], [mfloat(v) for v in d[2:]])
+        for j, i in enumerate(rows):
+            if compat.OR3:
+                vals = values[j].tolist()
+            else:
+                vals = [compat.unknown if u else float(v)
+                        for v, u in zip(values[j], unknown[i])]
+            data[self._spots[i]] = GeneData(self._spots[i], self._spot_genes[i], vals)
         self.gdsdata = data
+
+    def _expressions(self, report_genes=True, merge_function=spots_mean):
+        """
+        Return an array of expressions of genes (merged spots) or spots
+        (in rows) in samples (in columns), with NaN for unknown values.
+        """
+        if report_genes:
+            spots = [spot for gene in self.genes for spot in self.gene2spots[gene]]
+            sizes = [len(self.gene2spots[gene]) for gene in self.genes]
+            values = self._gdsvalues[[self._gdsrows[spot] for spot in spots]]
+            return merge_spots(values, sizes, merge_function)
+        else:
+            return self._gdsvalues[[self._gdsrows[spot] for spot in self.spots]]
     
     def _to_ExampleTable(self, report_genes=True, merge_function=spots_mean,
                                 sample_type=None, transpose=False):
@@ -320,14 +481,11 @@ class GDS():
             metasvar = [ DiscreteVariable(name=n, values=sorted(values)) 
                 for n,values in ad.items() if n != sample_type ]
 
-            X = []
+            X = _compat_rows(self._expressions(report_genes, merge_function)
+                             .reshape((len(spots), -1)).T)
             Y = []
             metas = []
-            for (i, sampleid) in enumerate(self.info["samples"]):
-                vals = [ ( (merge_function([self.gdsdata[spot].data[i] for spot in self.gene2spots[gene]]) )
-                         if report_genes else self.gdsdata[gene].data[i] ) 
-                         for gene in spots ]
-                X.append(vals)
+            for sampleid in self.info["samples"]:
                 Y.append(sample2class.get(sampleid, None))
                 metas.append([samp_ann[sampleid].get(n, None) for n,_ in ad.items() if n != sample_type ])
 
@@ -344,14 +502,7 @@ class GDS():
             metasvar = [ StringVariable(geneatname) ]
             nameval = self.genes if report_genes else self.spots
 
-            X = []
-            metas = []
-            for g in nameval:
-                if report_genes:
-                    X.append(list(map(lambda *x: merge_function(x),
-                        *[self.gdsdata[spot].data for spot in self.gene2spots[g]])))
-                else:
-                    X.append(self.gdsdata[g].data)
+            X = _compat_rows(self._expressions(report_genes, merge_function))
             metas = [ [a] for a in nameval]
             domain = compat.create_domain(atts, None, metasvar)
             return compat.create_table(domain, X, None, metas)
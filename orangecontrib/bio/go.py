@@ -7,6 +7,7 @@ Gene Ontology (:mod:`go`)
 from __future__ import absolute_import
 
 import os
+import array
 import tarfile
 import gzip
 import re
@@ -19,6 +20,7 @@ except ImportError:
     import pickle
 
 import shutil
+import tempfile
 
 try:
     from urllib2 import urlopen
@@ -29,8 +31,18 @@ import warnings
 
 from gzip import GzipFile
 from collections import defaultdict
+from contextlib import closing
+from itertools import chain
 from operator import attrgetter
 
+try:
+    from collections.abc import Mapping, MutableMapping, Sequence
+except ImportError:
+    from collections import Mapping, MutableMapping, Sequence
+
+import numpy
+import scipy.sparse
+
 from orangecontrib.bio.utils import progress_bar_milestones
 
 try:
@@ -47,6 +59,7 @@ except NameError:
 
 from orangecontrib.bio.utils import serverfiles
 from orangecontrib.bio.utils import stats
+from orangecontrib.bio.utils import parallel
 
 from orangecontrib.bio import gene as obiGene, taxonomy as obiTaxonomy
 
@@ -259,6 +272,104 @@ class Term(OBOObject):
     pass
 
 
+def _iter_stanzas(lines):
+    """
+    Split OBO file `lines` into stanzas. Yield a ("header", text) tuple
+    followed by (stanza type, text) tuples (e.g. ("Term", "[Term]\\nid...")).
+    """
+    header, stanza_type, stanza = [], None, []
+    for line in lines:
+        if not isinstance(line, str):
+            line = line.decode("utf-8")
+        if line.startswith("!"):
+            continue
+        line = line.rstrip("\r\n")
+        if line.startswith("["):
+            if stanza_type is None:
+                yield "header", "\n".join(header + [""])
+            elif stanza:
+                yield stanza_type, "\n".join(stanza)
+            stanza_type, stanza = line.strip()[1:-1], [line]
+        elif stanza_type is None:
+            header.append(line)
+        elif line.strip():
+            stanza.append(line)
+    if stanza_type is None:
+        yield "header", "\n".join(header + [""])
+    elif stanza:
+        yield stanza_type, "\n".join(stanza)
+
+
+def _scan_stanza(stanza):
+    """
+    Return the id, alternative ids and related objects (see
+    :func:`OBOObject.related_objects`) of a Term stanza without
+    constructing a :class:`Term`.
+    """
+    id, alt_ids, is_a, relationships = None, [], [], []
+    for line in stanza.splitlines():
+        tag, sep, rest = line.partition(":")
+        if not sep or tag not in ("id", "alt_id", "is_a", "relationship"):
+            continue
+        value = rest.split("!", 1)[0].split("{", 1)[0].strip()
+        if tag == "id":
+            id = intern(value)
+        elif tag == "alt_id":
+            alt_ids.append(intern(value))
+        elif tag == "is_a":
+            is_a.append((intern("is_a"), intern(value)))
+        else:
+            relationships.append(tuple(map(intern, value.split(None, 1))))
+    return id, alt_ids, is_a + relationships
+
+
+class _TermStore(MutableMapping):
+    """
+    A mapping of term ids to :class:`Term` objects which are constructed
+    from their stanzas when first accessed.
+    """
+    def __init__(self, ontology, stanzas=(), related=(), related_to=()):
+        self._ontology = ontology
+        self._stanzas = dict(stanzas)
+        self._related = dict(related)
+        self._related_to = dict(related_to)
+        self._terms = {}
+
+    def __getitem__(self, id):
+        term = self._terms.get(id)
+        if term is None:
+            term = Term(self._stanzas[id], self._ontology)
+            term.related_to = self._related_to.setdefault(id, set())
+            self._terms[id] = term
+        return term
+
+    def __setitem__(self, id, term):
+        self._terms[id] = term
+        self._stanzas[id] = None
+        self._related.pop(id, None)
+
+    def __delitem__(self, id):
+        del self._stanzas[id]
+        self._terms.pop(id, None)
+        self._related.pop(id, None)
+        self._related_to.pop(id, None)
+
+    def __contains__(self, id):
+        return id in self._stanzas
+
+    def __iter__(self):
+        return iter(self._stanzas)
+
+    def __len__(self):
+        return len(self._stanzas)
+
+    def related(self, id):
+        """ Return the related objects of term `id`. """
+        if id in self._related:
+            return self._related[id]
+        return self[id].related
+
+
 class Typedef(OBOObject):
     pass
 
@@ -297,6 +408,7 @@ class Ontology(object):
         self.alias_mapper = {}
         self.reverse_alias_mapper = defaultdict(set)
         self.header = ""
+        self._closure_index = None
 
         if filename is not None:
             self.parse_file(filename, progress_callback)
@@ -336,57 +448,171 @@ class Ontology(object):
 
     Load = load
 
+    #: Version of the parsed ontology snapshot format
+    SNAPSHOT_VERSION = 2
+
     def parse_file(self, file, progress_callback=None):
         """ Parse the file. file can be a filename string or an open filelike
         object. The optional progressCallback will be called with a single
         argument to report on the progress.
+
+        When `file` is a filename, the parsed ontology is saved into a
+        snapshot next to it, which is used instead of parsing while the
+        file (or its repository version) does not change. Terms of an
+        ontology loaded from a snapshot are constructed when accessed.
         """
         if isinstance(file, basestring):
+            snapshot = file.rstrip("/\\") + ".snapshot"
+            key = self._snapshot_key(file)
+            if self._load_snapshot(snapshot, key):
+                if progress_callback:
+                    progress_callback(100.0)
+                return
+
+            # progress is reported from the position in the file
             if os.path.isfile(file) and tarfile.is_tarfile(file):
-                f = tarfile.open(file).extractfile("gene_ontology_edit.obo")
-            elif os.path.isfile(file):
-                f = open(file)
-            elif os.path.isdir(file):
-                f = open(os.path.join(file, "gene_ontology_edit.obo"))
+                tar = tarfile.open(file)
+                member = tar.getmember("gene_ontology_edit.obo")
+                f = tar.extractfile(member)
+                position, size = f.tell, member.size
+            elif os.path.isfile(file) or os.path.isdir(file):
+                if os.path.isdir(file):
+                    file = os.path.join(file, "gene_ontology_edit.obo")
+                f = open(file, "rb")
+                position, size = f.tell, os.path.getsize(file)
             else:
                 raise ValueError("Cannot open %r for parsing" % file)
+            with closing(f):
+                self._parse_lines(f, position, size, progress_callback)
+            self._save_snapshot(snapshot, key)
         else:
-            f = file
-
-        data = f.readlines()
-        data = "".join([line for line in data if not line.startswith("!")])
-        self.header = data[: data.index("[Term]")]
-        c = re.compile("\[.+?\].*?\n\n", re.DOTALL)
-        data = c.findall(data)
-
-        milestones = progress_bar_milestones(len(data), 90)
-        for i, block in enumerate(builtinOBOObjects + data):
-            if block.startswith("[Term]"):
-                term = Term(block, self)
-                self.terms[term.id] = term
-            elif block.startswith("[Typedef]"):
-                typedef = Typedef(block, self)
+            self._parse_lines(file, None, None, progress_callback)
+
+    def _parse_lines(self, lines, position=None, size=None,
+                     progress_callback=None):
+        stanzas, related, alt_ids = {}, {}, {}
+        self.typedefs, self.instances = {}, {}
+        self.header = ""
+        builtins = [(b.strip()[1:b.strip().index("]")], b.strip())
+                    for b in builtinOBOObjects]
+        for i, (stanza_type, stanza) in enumerate(
+                chain(builtins, _iter_stanzas(lines))):
+            if stanza_type == "header":
+                self.header = stanza
+            elif stanza_type == "Term":
+                id, alt, rel = _scan_stanza(stanza)
+                stanzas[id], related[id] = stanza, rel
+                if alt:
+                    alt_ids[id] = alt
+            elif stanza_type == "Typedef":
+                typedef = Typedef(stanza, self)
                 self.typedefs[typedef.id] = typedef
-            elif block.startswith("[Instance]"):
-                instance = Instance(block, self)
+            elif stanza_type == "Instance":
+                instance = Instance(stanza, self)
                 self.instances[instance.id] = instance
-            if progress_callback and i in milestones:
-                progress_callback(90.0 * i / len(data))
+            if progress_callback and size and i % 5000 == 0:
+                progress_callback(min(100.0 * position() / size, 100.0))
+        self._set_terms(stanzas, related, alt_ids)
+        if progress_callback:
+            progress_callback(100.0)
+
+    def _set_terms(self, stanzas, related, alt_ids):
+        related_to = defaultdict(set)
+        for id, rel in six.iteritems(related):
+            for typeId, parent in rel:
+                if parent not in stanzas:
+                    raise KeyError(parent)
+                related_to[parent].add((typeId, id))
+
+        alias_mapper = {}
+        reverse_alias_mapper = defaultdict(set)
+        for id, alt in six.iteritems(alt_ids):
+            alias_mapper.update([(alt_id, id) for alt_id in alt])
+            reverse_alias_mapper[id].update(alt)
+        self._restore_terms(stanzas, related, related_to, alias_mapper,
+                            reverse_alias_mapper)
+
+    def _restore_terms(self, stanzas, related, related_to, alias_mapper,
+                       reverse_alias_mapper):
+        self.terms = _TermStore(self, stanzas, related, related_to)
+        self.alias_mapper = alias_mapper
+        self.reverse_alias_mapper = reverse_alias_mapper
+        self._closure_index = None
 
-        self.alias_mapper = {}
-        self.reverse_alias_mapper = defaultdict(set)
-        milestones = progress_bar_milestones(len(self.terms), 10)
-        for i, (id, term) in enumerate(six.iteritems(self.terms)):
-            for typeId, parent in term.related:
-                self.terms[parent].related_to.add((typeId, id))
+    @staticmethod
+    def _snapshot_key(filename):
+        """
+        Return the key of a parsed `filename`: its repository version
+        (the serverfiles info datetime), size and modification time.
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        dirname, basename = os.path.split(os.path.abspath(filename))
+        datetime = None
+        if dirname == os.path.abspath(serverfiles.localpath("GO")):
             try:
-                self.alias_mapper.update([(alt_id, id)
-                                          for alt_id in term.alt_id])
-                self.reverse_alias_mapper[id].union_update(term.alt_id)
-            except AttributeError:
+                datetime = serverfiles.info("GO", basename)["datetime"]
+            except Exception:
                 pass
-            if progress_callback and i in milestones:
-                progress_callback(90.0 + 10.0 * i / len(self.terms))
+        return [Ontology.SNAPSHOT_VERSION, datetime, stat.st_size,
+                stat.st_mtime]
+
+    def _load_snapshot(self, path, key):
+        if key is None or not os.path.isfile(path):
+            return False
+        try:
+            with open(path, "rb") as f:
+                if pickle.load(f) != key:
+                    return False
+                (header, stanzas, related, related_to, alias_mapper,
+                 reverse_alias_mapper, typedefs, instances) = pickle.load(f)
+        except Exception:
+            return False
+        self.header = header
+        self.typedefs = dict((t.id, t) for t in
+                             (Typedef(s, self) for s in typedefs))
+        self.instances = dict((t.id, t) for t in
+                              (Instance(s, self) for s in instances))
+        self._restore_terms(stanzas, related, related_to, alias_mapper,
+                            defaultdict(set, reverse_alias_mapper))
+        return True
+
+    def _save_snapshot(self, path, key):
+        if key is None:
+            return
+        try:
+            dirname = os.path.dirname(os.path.abspath(path))
+            fd, tmp = tempfile.mkstemp(dir=dirname)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump((self.header, self.terms._stanzas,
+                             self.terms._related, self.terms._related_to,
+                             self.alias_mapper,
+                             dict(self.reverse_alias_mapper),
+                             [repr(t) for t in self.typedefs.values()],
+                             [repr(t) for t in self.instances.values()]),
+                            f, pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            pass
+
+    def _term_related(self, termid):
+        """ Return the related objects of term `termid`. """
+        if isinstance(self.terms, _TermStore):
+            return self.terms.related(termid)
+        return self.terms[termid].related
+
+    def _closure(self):
+        """
+        Return the (cached) :class:`_ClosureIndex` of the ontology.
+        """
+        if getattr(self, "_closure_index", None) is None:
+            self._closure_index = _ClosureIndex(self)
+        return self._closure_index
 
     def defined_slims_subsets(self):
         """
@@ -455,15 +681,10 @@ class Ontology(object):
         :param list terms: A list of term IDs.
 
         """
-        terms = [terms] if isinstance(terms, basestring) else terms
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(set(tid for _, tid in self[term].related) -
-                         visited)
-        return visited
+        terms = [terms] if isinstance(terms, basestring) else list(terms)
+        closure = self._closure()
+        ancestors = closure.ancestors(closure.indices(terms))
+        return set(terms).union(closure.names(ancestors))
 
     def extract_sub_graph(self, terms):
         """
@@ -472,28 +693,20 @@ class Ontology(object):
         :param list terms: A list of term IDs.
 
         """
-        terms = [terms] if type(terms) == str else terms
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(set(tid for _, tid in self[term].related_to) -
-                         visited)
-        return visited
+        terms = [terms] if isinstance(terms, basestring) else list(terms)
+        closure = self._closure()
+        descendants = closure.descendants(closure.indices(terms))
+        return set(terms).union(closure.names(descendants))
 
-    def term_depth(self, term, cache_={}):
+    def term_depth(self, term):
         """
         Return the minimum depth of a `term`.
 
         (length of the shortest path to this term from the top level term).
 
         """
-        if term not in cache_:
-            cache_[term] = min([self.term_depth(parent) + 1
-                                for _, parent in self[term].related] or
-                               [1])
-        return cache_[term]
+        closure = self._closure()
+        return int(closure.depth[closure.indices([term])[0]])
 
     def __getitem__(self, termid):
         """
@@ -620,6 +833,393 @@ class AnnotationRecord(_AnnotationRecordBase):
         return list(map(intern, self.DB_Object_Synonym.split("|")))
 
 
+class _AnnotationStore(object):
+    """
+    A columnar store of annotation records.
+
+    Each field (see `annotationFields`) is stored as an integer coded
+    column with a table of its distinct string values. Rows of a field's
+    value are found through a (lazily built) compressed sparse row index.
+
+    """
+    def __init__(self):
+        self.tables = [[] for _ in annotationFields]
+        self._codes = [{} for _ in annotationFields]
+        self._columns = [array.array("i") for _ in annotationFields]
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    def append(self, values):
+        """ Append a record given as a sequence of field values. """
+        for value, table, codes, column in zip(
+                values, self.tables, self._codes, self._columns):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(table)
+                table.append(intern(value))
+            column.append(code)
+        self._cache = {}
+
+    def field(self, name):
+        return annotationFields.index(name)
+
+    def record(self, row):
+        return AnnotationRecord._make(
+            [table[column[row]]
+             for table, column in zip(self.tables, self._columns)])
+
+    def column(self, field):
+        """ Return the codes of `field` as an array. """
+        key = ("column", field)
+        if key not in self._cache:
+            self._cache[key] = numpy.array(self._columns[field],
+                                           dtype=numpy.int32)
+        return self._cache[key]
+
+    def mask(self, field, values):
+        """ Return a boolean mask of rows with `field` value in `values`. """
+        codes = self._codes[field]
+        selected = numpy.zeros(len(self.tables[field]), dtype=bool)
+        selected[[codes[v] for v in values if v in codes]] = True
+        return selected[self.column(field)]
+
+    def index(self, field):
+        """ Return the (indptr, rows) index of `field` values. """
+        key = ("index", field)
+        if key not in self._cache:
+            column = self.column(field)
+            indptr = numpy.zeros(len(self.tables[field]) + 1,
+                                 dtype=numpy.int64)
+            numpy.cumsum(numpy.bincount(column,
+                                        minlength=len(self.tables[field])),
+                         out=indptr[1:])
+            rows = numpy.argsort(column, kind="mergesort")
+            self._cache[key] = indptr, rows
+        return self._cache[key]
+
+    def rows(self, field, value):
+        """ Return the rows with `field` value equal to `value`. """
+        code = self._codes[field].get(value)
+        if code is None:
+            return numpy.zeros(0, dtype=numpy.int64)
+        indptr, rows = self.index(field)
+        return rows[indptr[code]:indptr[code + 1]]
+
+    def __contains__(self, item):
+        field, value = item
+        return value in self._codes[field]
+
+
+class _AnnotationList(Sequence):
+    """ A lazy list of :class:`AnnotationRecord` instances of a store. """
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._store.record(i)
+                    for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._store.record(index)
+
+    def __iter__(self):
+        record = self._store.record
+        for i in range(len(self)):
+            yield record(i)
+
+
+class _AnnotationGroups(Mapping):
+    """
+    A lazy mapping of values of a field (e.g. gene names) to lists of
+    :class:`AnnotationRecord` instances with that value (an empty list for
+    unknown keys).
+    """
+    def __init__(self, store, field):
+        self._store = store
+        self._field = store.field(field)
+
+    def __getitem__(self, key):
+        return [self._store.record(i)
+                for i in self._store.rows(self._field, key)]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return (self._field, key) in self._store
+
+    def __iter__(self):
+        return iter(self._store.tables[self._field])
+
+    def __len__(self):
+        return len(self._store.tables[self._field])
+
+
+class _ClosureIndex(object):
+    """
+    The transitive closure of the term relations of an ontology.
+
+    Term ids are mapped to dense integers (positions in the sorted
+    `terms`). Row ``i`` of the `ancestors` (`descendants`) sparse matrix
+    are the super (sub) terms of ``terms[i]`` through any relation; the
+    term itself is not included. `depth` is the minimum depth of each term
+    (see :func:`Ontology.term_depth`).
+
+    """
+    def __init__(self, ontology):
+        self.terms = sorted(ontology.terms)
+        self.term_index = dict((t, i) for i, t in enumerate(self.terms))
+        self.alias_mapper = ontology.alias_mapper
+        n = len(self.terms)
+
+        parents = [sorted(set(self.term_index[p]
+                              for _, p in ontology._term_related(t)))
+                   for t in self.terms]
+        children = [[] for _ in range(n)]
+        for i, ps in enumerate(parents):
+            for p in ps:
+                children[p].append(i)
+
+        # Ancestors of each term in a topological order (parents first)
+        ancestors = [None] * n
+        pending = [len(ps) for ps in parents]
+        queue = [i for i in range(n) if not pending[i]]
+        for i in queue:
+            anc = set(parents[i])
+            for p in parents[i]:
+                anc.update(ancestors[p])
+            ancestors[i] = anc
+            for c in children[i]:
+                pending[c] -= 1
+                if not pending[c]:
+                    queue.append(c)
+        # Terms on relation cycles
+        for i in range(n):
+            if ancestors[i] is None:
+                ancestors[i] = self._reachable(i, parents)
+
+        # Minimum depth by a breadth first search from the top level terms
+        self.depth = numpy.zeros(n, dtype=numpy.int32)
+        level = [i for i in range(n) if not parents[i]]
+        depth = 1
+        while level:
+            self.depth[level] = depth
+            level = sorted(set(c for i in level for c in children[i]
+                               if not self.depth[c]))
+            depth += 1
+
+        indptr = numpy.zeros(n + 1, dtype=numpy.int64)
+        numpy.cumsum([len(a) for a in ancestors], out=indptr[1:])
+        indices = numpy.fromiter(
+            (j for a in ancestors for j in sorted(a)), dtype=numpy.int32,
+            count=indptr[-1])
+        self.ancestors_matrix = scipy.sparse.csr_matrix(
+            (numpy.ones(len(indices), dtype=bool), indices, indptr),
+            shape=(n, n))
+        self.descendants_matrix = self.ancestors_matrix.T.tocsr()
+
+    @staticmethod
+    def _reachable(i, edges):
+        visited = set()
+        queue = set(edges[i])
+        while queue:
+            j = queue.pop()
+            visited.add(j)
+            queue.update(set(edges[j]) - visited)
+        return visited
+
+    def indices(self, terms):
+        """
+        Return an array of indices of `terms` (alternative ids are mapped
+        to their terms).
+        """
+        get = self.term_index.get
+        alias = self.alias_mapper.get
+        indices = numpy.empty(len(terms), dtype=numpy.int64)
+        for k, term in enumerate(terms):
+            i = get(term)
+            if i is None:
+                i = get(alias(term))
+                if i is None:
+                    raise KeyError(term)
+            indices[k] = i
+        return indices
+
+    def names(self, indices):
+        return [self.terms[i] for i in indices]
+
+    def ancestors(self, indices):
+        """ Return an array of all the super terms of terms `indices`. """
+        return numpy.unique(self.ancestors_matrix[indices].indices)
+
+    def descendants(self, indices):
+        """ Return an array of all the sub terms of terms `indices`. """
+        return numpy.unique(self.descendants_matrix[indices].indices)
+
+
+class _EnrichmentIndex(object):
+    """
+    A sparse gene x term incidence matrix with the annotations propagated
+    to all the ancestor terms.
+
+    Only annotations with evidence code in `evidence_codes` and aspect in
+    `aspects` are included. Row ``i`` of `matrix` are the (propagated)
+    terms annotated to ``genes[i]``, column ``j`` are the genes annotated
+    to ``terms[j]`` or any of its sub terms.
+
+    """
+    def __init__(self, annotations, ontology, evidence_codes, aspects):
+        store = annotations._store
+        gene_field = store.field("DB_Object_Symbol")
+        term_field = store.field("GO_ID")
+        gene_table = store.tables[gene_field]
+        term_table = store.tables[term_field]
+
+        self.genes = sorted(gene_table)
+        self.gene_index = dict((g, i) for i, g in enumerate(self.genes))
+
+        #: GO ids not present in the ontology, by gene.
+        self.unknown_terms = defaultdict(set)
+        #: Genes directly annotated to an alternative term id.
+        self.alt_id_genes = defaultdict(set)
+        #: Alternative term id to the main term id mapping.
+        self.alt_ids = {}
+
+        closure = ontology._closure()
+        self.terms = closure.terms
+        self.term_index = closure.term_index
+
+        mask = (store.mask(store.field("Evidence_Code"), evidence_codes) &
+                store.mask(store.field("Aspect"), aspects))
+        gene_codes = store.column(gene_field)[mask]
+        term_codes = store.column(term_field)[mask]
+
+        # Ontology term (column) of each GO id in the annotations
+        gene_rows = numpy.array([self.gene_index[g] for g in gene_table],
+                                dtype=numpy.int64)
+        term_cols = numpy.full(len(term_table), -1, dtype=numpy.int64)
+        for code in numpy.unique(term_codes):
+            go_id = term_table[code]
+            if go_id in ontology:
+                term = ontology.alias_mapper.get(go_id, go_id)
+                term_cols[code] = self.term_index[term]
+                if term != go_id:
+                    self.alt_ids[go_id] = term
+
+        cols = term_cols[term_codes]
+        known = cols >= 0
+        for gene, code in set(zip(gene_codes[~known], term_codes[~known])):
+            self.unknown_terms[gene_table[gene]].add(term_table[code])
+        if self.alt_ids:
+            alt = store.mask(term_field, self.alt_ids)[mask]
+            for gene, code in set(zip(gene_codes[alt], term_codes[alt])):
+                self.alt_id_genes[term_table[code]].add(gene_table[gene])
+
+        shape = (len(self.genes), len(self.terms))
+        direct = scipy.sparse.csr_matrix(
+            (numpy.ones(numpy.count_nonzero(known), dtype=numpy.int32),
+             (gene_rows[gene_codes[known]], cols[known])), shape=shape)
+        # Propagate the annotations to all the ancestor terms.
+        matrix = direct + direct.dot(
+            closure.ancestors_matrix.astype(numpy.int32))
+        matrix = scipy.sparse.csr_matrix(matrix)
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+        matrix.data[:] = 1
+        self.matrix = matrix
+        self._matrix_t = matrix.T.tocsr()
+
+    def indicator(self, genes):
+        """
+        Return a boolean row mask selecting `genes` (genes without any
+        annotations are ignored).
+        """
+        mask = numpy.zeros(len(self.genes), dtype=bool)
+        rows = [self.gene_index[g] for g in genes if g in self.gene_index]
+        mask[rows] = True
+        return mask
+
+    def counts(self, mask):
+        """
+        Return the number of genes selected by `mask` annotated to each term.
+        """
+        return self._matrix_t.dot(mask.astype(numpy.int32))
+
+    def members(self, mask, columns):
+        """
+        Return a list of gene lists (genes selected by `mask` annotated to
+        each term in `columns`).
+        """
+        rows = numpy.flatnonzero(mask)
+        sub = self.matrix[rows][:, columns].tocsc()
+        return [[self.genes[rows[i]]
+                 for i in sub.indices[sub.indptr[j]:sub.indptr[j + 1]]]
+                for j in range(len(columns))]
+
+
+def _enriched_terms(index, genes, translate, ref, ref_counts, ref_size,
+                    prob, slims_subset=None, use_fdr=True,
+                    progress_callback=None):
+    """
+    Compute the enriched terms for the (canonical) gene names `genes`
+    using the precomputed :class:`_EnrichmentIndex`, the reference gene
+    mask `ref` and the reference counts `ref_counts` of all the terms.
+    """
+    cluster = index.indicator(genes)
+    mapped = cluster & ref
+
+    # All super terms of the terms annotated to the cluster genes.
+    columns = numpy.flatnonzero(index.counts(cluster))
+    if slims_subset is not None:
+        columns = numpy.array(
+            [c for c in columns if index.terms[c] in slims_subset],
+            dtype=int)
+
+    mapped_counts = index.counts(mapped)[columns]
+    ref_counts = ref_counts[columns]
+    members = index.members(mapped, columns)
+    p_values = prob.p_values(mapped_counts, ref_size, ref_counts, len(genes))
+
+    res = {}
+    milestones = progress_bar_milestones(len(columns), 100)
+    for i, col in enumerate(columns):
+        res[index.terms[col]] = (
+            [translate[g] for g in members[i]],
+            float(p_values[i]),
+            int(ref_counts[i]))
+        if progress_callback and i in milestones:
+            progress_callback(100.0 * i / len(columns))
+
+    for alt_id, alt_genes in six.iteritems(index.alt_id_genes):
+        term = index.alt_ids[alt_id]
+        if term in res and not genes.isdisjoint(alt_genes):
+            res[alt_id] = res[term]
+
+    if use_fdr:
+        res = sorted(res.items(), key=lambda x: x[1][1])
+        res = dict([(id, (genes, p, ref))
+                    for (id, (genes, _, ref)), p in
+                    zip(res, stats.FDR([p for _, (_, p, _) in res]))])
+    return res
+
+
+def _enriched_terms_task(shared, query):
+    index, ref, ref_counts, ref_size, prob, slims_subset, use_fdr = shared
+    i, genes, translate = query
+    return i, _enriched_terms(index, genes, translate, ref, ref_counts,
+                              ref_size, prob, slims_subset, use_fdr)
+
+
 class Annotations(object):
     """
     :class:`Annotations` object holds the annotations.
@@ -646,13 +1246,18 @@ class Annotations(object):
                  progress_callback=None, rev=None):
         self.ontology = ontology
 
+        # Annotations are stored in columns; the record (lists and
+        # mappings) attributes are lazy views of the store.
+        self._store = _AnnotationStore()
+
         #: A dictionary mapping a gene name (DB_Object_Symbol) to a
-        #: set of all annotations of that gene.
-        self.gene_annotations = defaultdict(list)
+        #: list of all annotations of that gene.
+        self.gene_annotations = _AnnotationGroups(self._store,
+                                                  "DB_Object_Symbol")
 
-        #: A dictionary mapping a GO term id to a set of annotations that
+        #: A dictionary mapping a GO term id to a list of annotations that
         #: are directly annotated to that term
-        self.term_anotations = defaultdict(list)
+        self.term_anotations = _AnnotationGroups(self._store, "GO_ID")
 
         self.all_annotations = defaultdict(list)
 
@@ -661,7 +1266,7 @@ class Annotations(object):
         self._alias_mapper = None
 
         #: A list of all :class:`AnnotationRecords` instances.
-        self.annotations = []
+        self.annotations = _AnnotationList(self._store)
         self.header = ""
         self.genematcher = genematcher
         self.taxid = None
@@ -751,6 +1356,7 @@ class Annotations(object):
         """Set the ontology to use in the annotations mapping.
         """
         self.all_annotations = defaultdict(list)
+        self._enrichment_indices = {}
         self._ontology = ontology
 
     def get_ontology(self):
@@ -799,31 +1405,55 @@ class Annotations(object):
 
         """
         if isinstance(file, basestring):
+            # progress is reported from the position in the (compressed)
+            # file instead of counting the lines in advance
             if os.path.isfile(file) and tarfile.is_tarfile(file):
-                f = tarfile.open(file).extractfile("gene_association")
+                tar = tarfile.open(file)
+                member = tar.getmember("gene_association")
+                f = tar.extractfile(member)
+                position, size = f.tell, member.size
             elif os.path.isfile(file) and file.endswith(".gz"):
                 f = gzip.open(file)
-            elif os.path.isfile(file):
-                f = open(file)
-            elif os.path.isdir(file):
-                f = open(os.path.join(file, "gene_association"))
+                position, size = f.fileobj.tell, os.path.getsize(file)
+            elif os.path.isfile(file) or os.path.isdir(file):
+                if os.path.isdir(file):
+                    file = os.path.join(file, "gene_association")
+                f = open(file, "rb")
+                position, size = f.tell, os.path.getsize(file)
             else:
                 raise ValueError("Cannot open %r for parsing." % file)
+            with closing(f):
+                self._parse_lines(f, position, size, progress_callback)
         else:
-            f = file
-        lines = [line for line in f.read().splitlines() if line.strip()]
+            self._parse_lines(file, None, None, progress_callback)
 
-        milestones = progress_bar_milestones(len(lines), 100)
+    def _parse_lines(self, lines, position=None, size=None,
+                     progress_callback=None):
+        gene = annotationFields.index("DB_Object_Symbol")
+        go_id = annotationFields.index("GO_ID")
+        qualifier = annotationFields.index("Qualifier")
         for i, line in enumerate(lines):
+            if not isinstance(line, str):
+                line = line.decode("utf-8")
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
             if line.startswith("!"):
                 self.header = self.header + line + "\n"
                 continue
 
-            a = AnnotationRecord.from_string(line)
-            self.add_annotation(a)
+            values = line.split("\t")
+            if len(values) != len(annotationFields):
+                # raises an error for malformed lines
+                values = AnnotationRecord._make(values)
+            if values[gene] and values[go_id] and values[qualifier] != "NOT":
+                self._store.append(values)
 
-            if progress_callback and i in milestones:
-                progress_callback(100.0 * i / len(lines))
+            if progress_callback and size and i % 5000 == 0:
+                progress_callback(min(100.0 * position() / size, 100.0))
+        if progress_callback:
+            progress_callback(100.0)
+        self._invalidate()
 
     def add_annotation(self, a):
         """Add a single :class:`AnotationRecord` instance to this object.
@@ -833,10 +1463,12 @@ class Annotations(object):
         if not a.geneName or not a.GOId or a.Qualifier == "NOT":
             return
 
-        self.gene_annotations[a.geneName].append(a)
-        self.annotations.append(a)
-        self.term_anotations[a.GOId].append(a)
+        self._store.append(a)
+        self._invalidate()
+
+    def _invalidate(self):
         self.all_annotations = defaultdict(list)
+        self._enrichment_indices = {}
 
         self._gene_names_dict = None
         self._gene_names = None
@@ -853,17 +1485,24 @@ class Annotations(object):
     @property
     def gene_names(self):
         if self._gene_names is None:
-            self._gene_names = set([ann.geneName for ann in self.annotations])
+            self._gene_names = set(self.gene_annotations)
         return self._gene_names
 
     @property
     def alias_mapper(self):
         if self._alias_mapper is None:
+            store = self._store
+            fields = [store.field(name) for name in
+                      ["DB_Object_Synonym", "DB_Object_Symbol",
+                       "DB_Object_ID"]]
+            synonyms, names, ids = [store.tables[f] for f in fields]
             self._alias_mapper = {}
-            for ann in self.annotations:
-                self._alias_mapper.update([(alias, ann.geneName)
-                                           for alias in ann.alias +
-                                            [ann.geneName, ann.DB_Object_ID]])
+            for synonym, name, id in zip(*[store.column(f) for f in fields]):
+                name = names[name]
+                self._alias_mapper.update(
+                    [(alias, name) for alias in synonyms[synonym].split("|")])
+                self._alias_mapper[name] = name
+                self._alias_mapper[ids[id]] = name
         return self._alias_mapper
 
     def get_gene_names_translator(self, genes):
@@ -871,12 +1510,16 @@ class Annotations(object):
         to `genes`.
 
         """
+        if self.genematcher:
+            genes = list(genes)
+            targets = self.genematcher.targets
+            matched = self.genematcher.umatch_many(genes)
+            return dict([(targets[i], gene) for i, gene in zip(matched, genes)
+                         if i >= 0 and targets[i]])
+
         def alias(gene):
-            if self.genematcher:
-                return self.genematcher.umatch(gene)
-            else:
-                return (gene if gene in self.gene_names
-                        else self.alias_mapper.get(gene, None))
+            return (gene if gene in self.gene_names
+                    else self.alias_mapper.get(gene, None))
 
         return dict([(alias(gene), gene) for gene in genes if alias(gene)])
 
@@ -905,6 +1548,17 @@ class Annotations(object):
 
     _CollectAnnotations = _collect_annotations
 
+    def _term_mask(self, id):
+        """ Return a row mask of annotations to term `id` and its subterms.
+        """
+        self._ensure_ontology()
+        alt_ids = self.ontology.reverse_alias_mapper
+        terms = set()
+        for term in self.ontology.extract_sub_graph([id]):
+            terms.add(term)
+            terms.update(alt_ids.get(term, ()))
+        return self._store.mask(self._store.field("GO_ID"), terms)
+
     def get_all_annotations(self, id):
         """ Return a set of all annotations (instances of :obj:`AnnotationRecord`)
         for GO term `id` and all it's subterms.
@@ -916,10 +1570,9 @@ class Annotations(object):
         id = self.ontology.alias_mapper.get(id, id)
         if id not in self.all_annotations or \
                 type(self.all_annotations[id]) == list:
-            annot_set = set()
-            for annots in self._collect_annotations(id, set()):
-                annot_set.update(annots)
-            self.all_annotations[id] = annot_set
+            record = self._store.record
+            self.all_annotations[id] = set(
+                record(i) for i in numpy.flatnonzero(self._term_mask(id)))
         return self.all_annotations[id]
 
     def get_all_genes(self, id, evidence_codes=None):
@@ -933,10 +1586,26 @@ class Annotations(object):
             to terms.
 
         """
+        self._ensure_ontology()
+        store = self._store
         evidence_codes = set(evidence_codes or evidenceDict.keys())
-        annotations = self.get_all_annotations(id)
-        return list(set([ann.geneName for ann in annotations
-                         if ann.Evidence_Code in evidence_codes]))
+        id = self.ontology.alias_mapper.get(id, id)
+        mask = self._term_mask(id) & \
+            store.mask(store.field("Evidence_Code"), evidence_codes)
+        field = store.field("DB_Object_Symbol")
+        return [store.tables[field][code]
+                for code in numpy.unique(store.column(field)[mask])]
+
+    def _enrichment_index(self, evidence_codes, aspects):
+        """Return the (cached) :class:`_EnrichmentIndex` for the given
+        `evidence_codes` and `aspects`.
+        """
+        self._ensure_ontology()
+        key = (frozenset(evidence_codes), frozenset(aspects))
+        if key not in self._enrichment_indices:
+            self._enrichment_indices[key] = _EnrichmentIndex(
+                self, self.ontology, key[0], key[1])
+        return self._enrichment_indices[key]
 
     def get_enriched_terms(self, genes, reference=None, evidence_codes=None,
                            slims_only=False, aspect=None,
@@ -959,6 +1628,19 @@ class Annotations(object):
         """
         revGenesDict = self.get_gene_names_translator(genes)
         genes = set(revGenesDict.keys())
+        index, ref, ref_counts, ref_size, slims = self._enrichment_reference(
+            reference, evidence_codes, slims_only, aspect)
+        self._warn_unknown_terms(index, genes)
+        return _enriched_terms(
+            index, genes, revGenesDict, ref, ref_counts, ref_size,
+            prob, slims, use_fdr, progress_callback)
+
+    def _enrichment_reference(self, reference, evidence_codes, slims_only,
+                              aspect):
+        """Prepare the reference for :func:`get_enriched_terms`. Return
+        the enrichment index, the reference gene indicator, annotation
+        counts and size, and the slims subset (or None).
+        """
         if reference:
             refGenesDict = self.get_gene_names_translator(reference)
             reference = set(refGenesDict.keys())
@@ -973,21 +1655,6 @@ class Annotations(object):
             aspects_set = aspect
 
         evidence_codes = set(evidence_codes or evidenceDict.keys())
-        annotations = [ann
-                       for gene in genes for ann in self.gene_annotations[gene]
-                       if ann.Evidence_Code in evidence_codes and
-                       ann.Aspect in aspects_set]
-
-        refAnnotations = set(
-            [ann
-             for gene in reference for ann in self.gene_annotations[gene]
-             if ann.Evidence_Code in evidence_codes and
-             ann.Aspect in aspects_set]
-        )
-
-        annotationsDict = defaultdict(set)
-        for ann in annotations:
-            annotationsDict[ann.GO_ID].add(ann)
 
         self._ensure_ontology()
         if slims_only and not self.ontology.slims_subset:
@@ -995,43 +1662,61 @@ class Annotations(object):
                           "Using 'goslim_generic' subset", UserWarning)
             self.ontology.set_slims_subset("goslim_generic")
 
-        terms = annotationsDict.keys()
-        filteredTerms = [term for term in terms if term in self.ontology]
+        index = self._enrichment_index(evidence_codes, aspects_set)
+        ref = index.indicator(reference)
+        return (index, ref, index.counts(ref), len(reference),
+                self.ontology.slims_subset if slims_only else None)
 
-        if len(terms) != len(filteredTerms):
-            termDiff = set(terms) - set(filteredTerms)
+    @staticmethod
+    def _warn_unknown_terms(index, genes):
+        termDiff = set()
+        for gene in genes:
+            termDiff.update(index.unknown_terms.get(gene, ()))
+        if termDiff:
             warnings.warn("%s terms in the annotations were not found in the "
                           "ontology." % ",".join(map(repr, termDiff)),
                           UserWarning)
 
-        terms = self.ontology.extract_super_graph(filteredTerms)
-        res = {}
+    def get_enriched_terms_many(self, gene_lists, reference=None,
+                                evidence_codes=None, slims_only=False,
+                                aspect=None, prob=stats.Binomial(),
+                                use_fdr=True, processes=1,
+                                progress_callback=None):
+        """ Run :func:`get_enriched_terms` for each gene list in
+        `gene_lists`.
 
-        milestones = progress_bar_milestones(len(terms), 100)
-        for i, term in enumerate(terms):
-            if slims_only and term not in self.ontology.slims_subset:
-                continue
-            allAnnotations = self.get_all_annotations(term).intersection(refAnnotations)
-##            allAnnotations.intersection_update(refAnnotations)
-            allAnnotatedGenes = set([ann.geneName for ann in allAnnotations])
-            mappedGenes = genes.intersection(allAnnotatedGenes)
+        The reference annotations are prepared only once and shared by
+        all queries. Return an iterator over `(index, enriched_terms)`
+        tuples (`index` is the position of the gene list in `gene_lists`)
+        in the order the results are completed.
 
-            if len(reference) > len(allAnnotatedGenes):
-                mappedReferenceGenes = reference.intersection(allAnnotatedGenes)
-            else:
-                mappedReferenceGenes = allAnnotatedGenes.intersection(reference)
-            res[term] = ([revGenesDict[g] for g in mappedGenes],
-                         prob.p_value(len(mappedGenes), len(reference),
-                                      len(mappedReferenceGenes), len(genes)),
-                         len(mappedReferenceGenes))
+        :param int processes:
+            Number of worker processes to use (`None` to use all
+            available CPUs). By default the queries are run in the
+            calling process.
+
+        """
+        gene_lists = list(gene_lists)
+        index, ref, ref_counts, ref_size, slims = self._enrichment_reference(
+            reference, evidence_codes, slims_only, aspect)
+        shared = (index, ref, ref_counts, ref_size, prob, slims, use_fdr)
+
+        def queries():
+            for i, genes in enumerate(gene_lists):
+                revGenesDict = self.get_gene_names_translator(genes)
+                genes = set(revGenesDict.keys())
+                self._warn_unknown_terms(index, genes)
+                yield i, genes, revGenesDict
+
+        milestones = progress_bar_milestones(len(gene_lists), 100)
+        results = parallel.imap_unordered(
+            _enriched_terms_task, queries(), shared, processes=processes)
+        for i, (query, res) in enumerate(results):
             if progress_callback and i in milestones:
-                progress_callback(100.0 * i / len(terms))
-        if use_fdr:
-            res = sorted(res.items(), key=lambda x: x[1][1])
-            res = dict([(id, (genes, p, ref))
-                        for (id, (genes, _, ref)), p in
-                        zip(res, stats.FDR([p for _, (_, p, _) in res]))])
-        return res
+                progress_callback(100.0 * i / len(gene_lists))
+            yield query, res
+        if progress_callback:
+            progress_callback(100.0)
 
     def get_annotated_terms(self, genes, direct_annotation_only=False,
                             evidence_codes=None, progress_callback=None):
@@ -1116,7 +1801,7 @@ class Annotations(object):
         return self.annotations[index]
 
     def __getslice__(self, *args):
-        return self.annotations.__getslice__(*args)
+        return self.annotations[slice(*args)]
 
     def add(self, line):
         """ Add one annotation
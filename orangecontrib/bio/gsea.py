@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 from collections import defaultdict
+import functools
 import random
 import time
 
@@ -12,6 +13,10 @@ import Orange
 from . import geneset as obiGeneSets
 from .utils.expression import *
 from . import gene as obiGene
+from .utils import gseacore
+from .utils.gseacore import enrichmentScoreRanked, genesetsMembership, \
+    enrichmentScoresBatch, permutationIndices, permutationBlocks, \
+    runOptCallbacks
 
 """
 Gene set enrichment analysis.
@@ -38,7 +43,10 @@ def rankingFromOrangeMeas(meas):
     results in a list. Ranking function is build out of 
     orange.MeasureAttribute.
     """
-    return lambda d: [ meas(i,d) for i in range(len(d.domain.attributes)) ]
+    return functools.partial(_rankAttributes, meas)
+
+def _rankAttributes(meas, d):
+    return [ meas(i,d) for i in range(len(d.domain.attributes)) ]
 
 def orderedPointersCorr(lcor):
     """
@@ -51,95 +59,6 @@ def orderedPointersCorr(lcor):
     ordered = nth(ordered, 0) #contains positions in the original list
     return ordered
 
-def enrichmentScoreRanked(subset, lcor, ordered, p=1.0, rev2=None):
-    """
-    Input data and subset. 
-    
-    subset: list of attribute indices of the input data belonging
-        to the same set.
-    lcor: correlations with class for each attribute in a list. 
-
-    Returns enrichment score on given data.
-
-    This implementation efficiently handles "sparse" genesets (that
-    cover only a small subset of all genes in the dataset).
-    """
-
-    #print lcor
-
-    subset = set(subset)
-
-    if rev2 == None:
-        def rev(l):
-            return numpy.argsort(l)
-        rev2 = rev(ordered)
-
-    #add if gene is not in the subset
-    notInA = -(1. / (len(lcor)-len(subset)))
-    #base for addition if gene is in the subset
-
-    cors = [ abs(lcor[i])**p for i in subset ] #belowe in numpy
-    sumcors = sum(cors)
-
-    #this should not happen
-    if sumcors == 0.0:
-        return (0.0, None)
-    
-    inAb = 1./sumcors
-
-    ess = [0.0]
-    
-    map = {}
-    for i in subset:
-        orderedpos = rev2[i]
-        map[orderedpos] = inAb*abs(lcor[i]**p)
-        
-    last = 0
-
-    maxSum = minSum = csum = 0.0
-
-    for a,b in sorted(map.items()):
-        diff = a-last
-        csum += notInA*diff
-        last = a+1
-        
-        if csum < minSum:
-            minSum = csum
-        
-        csum += b
-
-        if csum > maxSum:
-            maxSum = csum
-
-    #finish it
-    diff = (len(ordered))-last
-    csum += notInA*diff
-
-    if csum < minSum:
-        minSum = csum
-
-    #print "MY", (maxSum if abs(maxSum) > abs(minSum) else minSum)
-
-    """
-    #BY DEFINITION
-    print "subset", subset
-
-    for i in ordered:
-        ess.append(ess[-1] + \
-            (inAb*abs(lcor[i]**p) if i in subset else notInA)
-        )
-        if i in subset:
-            print ess[-2], ess[-1]
-            print i, (inAb*abs(lcor[i]**p))
-
-    maxEs = max(ess)
-    minEs = min(ess)
-    
-    print "REAL", (maxEs if abs(maxEs) > abs(minEs) else minEs, ess[1:])
-
-    """
-    return (maxSum if abs(maxSum) > abs(minSum) else minSum, [])
-
 #from mOrngData
 def shuffleAttribute(data, attribute, locations):
     """
@@ -217,7 +136,7 @@ def enrichmentScore(data, subset, rankingf):
     return es,l
 
 def gseaE(data, subsets, rankingf=None, \
-        n=100, permutation="class", callback=None):
+        n=100, permutation="class", callback=None, workers=1):
     """
     Run GSEA algorithm on an example table.
 
@@ -228,95 +147,59 @@ def gseaE(data, subsets, rankingf=None, \
     n: number of random permutations to sample null distribution.
     permutation: "class" for permutating class, else permutate attribute 
         order.
+    workers: number of processes computing permutations (None for
+        all CPUs). Results do not depend on it.
 
     """
 
     if not rankingf:
         rankingf=rankingFromOrangeMeas(MA_signalToNoise())
 
-    enrichmentScores = []
- 
     lcor = rankingf(data)
     #print lcor
 
-    ordered = orderedPointersCorr(lcor)
-
-    def rev(l):
-        return numpy.argsort(l)
-
-    rev2 = rev(ordered)
-
-    for subset in subsets:
-        es = enrichmentScoreRanked(subset, lcor, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
+    membership = genesetsMembership(subsets, len(lcor))
+    enrichmentScores = list(enrichmentScoresBatch(membership, lcor)[0])
 
     runOptCallbacks(callback)
 
     #print "PERMUTATION", permutation
 
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-
-        if permutation == "class":
-            d2 = shuffleClass(data, 2000+i) #fixed permutation
-            r2 = rankingf(d2)
-        else:
-            r2 = shuffleList(lcor, random.Random(2000+i))
-
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-        for si,subset in enumerate(subsets):
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
-
-        runOptCallbacks(callback)
-
-    return gseaSignificance(enrichmentScores, enrichmentNulls)
+    enrichmentNulls = gseaNulls(membership, lcor, n, data=data,
+        rankingf=rankingf, permutation=permutation, callback=callback,
+        workers=workers)
 
+    return gseaSignificance(enrichmentScores, enrichmentNulls.T.tolist())
 
-def runOptCallbacks(callback):
-    if callback is not None:
-        try:
-            [ a() for a in callback ]
-        except:
-            callback()            
 
-def gseaR(rankings, subsets, n, callback=None):
+def gseaR(rankings, subsets, n, callback=None, workers=1):
     """
+    Run GSEA on precomputed rankings (correlations with class) of genes.
+    The enrichment scores for all subsets are computed at once for each
+    block of permutations of rankings.
     """
-    enrichmentScores = []
-    ordered = orderedPointersCorr(rankings)
-    
-    def rev(l):
-        return numpy.argsort(l)
-
-    rev2 = rev(ordered)
+    rankings = numpy.asarray(rankings, dtype=float)
+    membership = genesetsMembership(subsets, len(rankings))
+    enrichmentScores = list(enrichmentScoresBatch(membership, rankings)[0])
 
-    for subset in subsets:
-
-        es = enrichmentScoreRanked(subset, rankings, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
-    
     runOptCallbacks(callback)
 
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-        
-        r2 = shuffleList(rankings, random.Random(2000+i))
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-
-        for si,subset in enumerate(subsets):
+    enrichmentNulls = gseaNulls(membership, rankings, n, permutation="gene",
+        callback=callback, workers=workers)
 
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
+    return gseaSignificance(enrichmentScores, enrichmentNulls.T.tolist())
 
-        runOptCallbacks(callback)
-
-    return gseaSignificance(enrichmentScores, enrichmentNulls)
 
+def gseaNulls(membership, lcor, n, data=None, rankingf=None,
+        permutation="class", callback=None, workers=1):
+    """
+    Return a (n x number of gene sets) array of enrichment scores on
+    permuted data (permutation="class", see shuffleClass) or permuted
+    rankings lcor. See gseacore.gseaNulls.
+    """
+    return gseacore.gseaNulls(membership, lcor, n, data=data,
+        rankingf=rankingf, shuffle=shuffleClass, permutation=permutation,
+        callback=callback, workers=workers)
 
 def gseaSignificance(enrichmentScores, enrichmentNulls):
 
@@ -895,10 +778,11 @@ class GSEA(object):
         to a self.genesets: key is genesetname, it's values are individual
         genes and match results.
         """
+        targets = self.gm.targets
         for g in obiGeneSets.GeneSets(genesets):
-            genes = g.genes
-            datamatch = filter(lambda x: x[1] != None, 
-                [ (gene, self.gm.umatch(gene)) for gene in genes])
+            genes = list(g.genes)
+            datamatch = [ (gene, targets[i]) for gene, i in
+                zip(genes, self.gm.umatch_many(genes)) if i >= 0 ]
             self.genesets[g] = datamatch
 
     def selectGenesets(self, minSize=3, maxSize=1000, minPart=0.1):
@@ -930,7 +814,13 @@ class GSEA(object):
         """
         return dict( (gs, self.genesIndices(nth(self.genesets[gs],1))) for gs in gsets)
 
-    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class"):
+    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class", workers=1):
+        """
+        Compute GSEA for selected gene sets. Permutations are computed
+        with workers processes (None for all CPUs); the results do not
+        depend on their number. Raise an exception in the callback
+        (called after each permutation) to cancel the computation.
+        """
 
         subsetsok = self.selectGenesets(minSize=minSize, maxSize=maxSize, minPart=minPart)
 
@@ -944,10 +834,10 @@ class GSEA(object):
             return {} # quick return if no genesets
 
         if len(itOrFirst(self.data)) > 1:
-            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf)
+            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf, workers=workers)
         else:
             rankings = [ self.data[0][at].native() for at in self.data.domain.attributes ]
-            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None)
+            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=callback, workers=workers)
 
         res = {}
 
@@ -965,7 +855,7 @@ class GSEA(object):
         return res
 
 def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
-    gene_desc=None, n=100, callback=None):
+    gene_desc=None, n=100, callback=None, workers=1):
     """ Gene Set Enrichment analysis for pre-computed correlations
     between genes and phenotypes. 
     
@@ -980,11 +870,12 @@ def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
 
     assert len(data.domain.attributes) == 1 or len(data) == 1
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
-        maxSize=max_size, minPart=min_part, n=n, geneVar=gene_desc, callback=callback)
+        maxSize=max_size, minPart=min_part, n=n, geneVar=gene_desc, callback=callback,
+        workers=workers)
 
 def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     at_least=3, phenotypes=None, gene_desc=None, phen_desc=None, n=100, 
-    permutation="phenotype", callback=None, rankingf=None):
+    permutation="phenotype", callback=None, rankingf=None, workers=1):
     """ Run Gene Set Enrichment Analysis.
 
     :param Orange.data.Table data: Gene expression data.  
@@ -1015,6 +906,10 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
         specifies a sample, then the user should pass the meta variable
         containing the gene names. Defaults to attribute names if each
         example specifies one sample.
+    :param callback: Called after each permutation. Raise an exception
+        in it to cancel the computation.
+    :param workers: Number of processes for computing permutations
+        (None for all CPUs). Results do not depend on it. Default: 1.
 
     :return: | a dictionary where key is a gene set and values are:
         | { es: enrichment score, 
@@ -1033,19 +928,19 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
         maxSize=max_size, minPart=min_part, n=n, permutation=permutation, 
         geneVar=gene_desc, callback=callback, phenVar=phen_desc, 
-        classValues=phenotypes)
+        classValues=phenotypes, workers=workers)
 
 def runGSEA(data, organism=None, classValues=None, geneSets=None, n=100, 
         permutation="class", minSize=3, maxSize=1000, minPart=0.1, atLeast=3, 
         matcher=None, geneVar=None, phenVar=None, caseSensitive=False, 
-        rankingf=None, callback=None):
+        rankingf=None, callback=None, workers=1):
     gso = GSEA(data, organism=organism, matcher=matcher, 
         classValues=classValues, atLeast=atLeast, caseSensitive=caseSensitive,
         geneVar=geneVar, phenVar=phenVar)
     gso.addGenesets(geneSets)
     res1 = gso.compute(n=n, permutation=permutation, minSize=minSize,
         maxSize=maxSize, minPart=minPart, rankingf=rankingf,
-        callback=callback)
+        callback=callback, workers=workers)
     return res1
 
 def etForAttribute(datal,a):
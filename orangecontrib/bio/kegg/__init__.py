@@ -55,15 +55,20 @@ from __future__ import absolute_import
 
 import os
 import sys
+import json
+import shutil
+import tempfile
 import threading
 
 from collections import defaultdict
-from itertools import chain
+from itertools import chain, groupby
 from datetime import datetime
 from contextlib import contextmanager
 
+import numpy
+
 from orangecontrib.bio import utils, taxonomy
-from orangecontrib.bio.utils import progress_bar_milestones
+from orangecontrib.bio.utils import progress_bar_milestones, parallel
 from orangecontrib.bio.kegg import databases
 from orangecontrib.bio.kegg import entry
 
@@ -71,6 +76,7 @@ from orangecontrib.bio.kegg.brite import BriteEntry, Brite
 
 from orangecontrib.bio.kegg import api
 from orangecontrib.bio.kegg import conf
+from orangecontrib.bio.kegg.caching import touch_dir
 from orangecontrib.bio.kegg import pathway
 
 from functools import reduce
@@ -162,10 +168,11 @@ class Organism(object):
 
     def pathways(self, with_ids=None):
         """
-        Return a list of all pathways for this organism.
+        Return a list of all pathways for this organism (or only of
+        pathways which include all genes in `with_ids`).
         """
         if with_ids is not None:
-            return self.api.get_pathways_by_genes(with_ids)
+            return self.get_pathways_by_genes(with_ids)
         else:
             return [p.entry_id for p in self.api.list_pathways(self.org_code)]
 
@@ -186,6 +193,16 @@ class Organism(object):
     def enzymes(self, genes=None):
         raise NotImplementedError()
 
+    def pathway_index(self):
+        """
+        Return a :class:`PathwayGeneIndex` of pathways and genes of this
+        organism. The index is stored locally and rebuilt when the KEGG
+        release of the organism changes.
+        """
+        if getattr(self, "_pathway_index", None) is None:
+            self._pathway_index = pathway_index(self.org_code, self.api)
+        return self._pathway_index
+
     def get_enriched_pathways(self, genes, reference=None,
                               prob=utils.stats.Binomial(), callback=None):
         """
@@ -197,36 +214,51 @@ class Organism(object):
         if reference is None:
             reference = self.genes.keys()
         reference = set(reference)
+        genes = list(genes)
+
+        index = self.pathway_index()
+        res = index.enrichment(genes, index.counts(reference),
+                               len(reference), prob)
+        if callback:
+            callback(100.0)
+        return res
+
+    def get_enriched_pathways_many(self, gene_lists, reference=None,
+                                   prob=utils.stats.Binomial(), processes=1,
+                                   callback=None):
+        """
+        Run :func:`get_enriched_pathways` for each gene list in
+        `gene_lists`.
 
-        allPathways = defaultdict(lambda: [[], 1.0, []])
-        milestones = progress_bar_milestones(len(genes), 100)
-        pathways_db = KEGGPathways()
+        The gene to pathway mapping and the reference pathway counts are
+        retrieved only once and shared by all queries. Return an iterator
+        over `(index, enriched_pathways)` tuples (`index` is the position
+        of the gene list in `gene_lists`) in the order the results are
+        completed.
 
-        pathways_for_gene = []
-        for i, gene in enumerate(genes):
-            pathways_for_gene.append(self.pathways([gene]))
-            if callback and i in milestones:
-                callback(i * 50.0 / len(genes))
-
-        # pre-cache for speed
-        pathways_db.pre_cache([pid for pfg in pathways_for_gene
-                               for pid in pfg])
-        for i, (gene, pathways) in enumerate(zip(genes, pathways_for_gene)):
-            for pathway in pathways:
-                if pathways_db.get_entry(pathway).gene:
-                    allPathways[pathway][0].append(gene)
-            if callback and i in milestones:
-                callback(50.0 + i * 50.0 / len(genes))
+        :param int processes:
+            Number of worker processes to use (`None` to use all
+            available CPUs). By default the queries are run in the
+            calling process.
 
-        pItems = allPathways.items()
+        """
+        gene_lists = list(gene_lists)
+        if reference is None:
+            reference = self.genes.keys()
+        reference = set(reference)
 
-        for i, (p_id, entry) in enumerate(pItems):
-            pathway = pathways_db.get_entry(p_id)
-            entry[2].extend(reference.intersection(pathway.gene or []))
-            entry[1] = prob.p_value(len(entry[0]), len(reference),
-                                    len(entry[2]), len(genes))
-        return dict([(pid, (genes, p, len(ref)))
-                     for pid, (genes, p, ref) in allPathways.items()])
+        index = self.pathway_index()
+        shared = (index, index.counts(reference), len(reference), prob)
+        milestones = progress_bar_milestones(len(gene_lists), 100)
+        results = parallel.imap_unordered(
+            _enriched_pathways_task, enumerate(gene_lists), shared,
+            processes=processes)
+        for i, (query, res) in enumerate(results):
+            if callback and i in milestones:
+                callback(100.0 * i / len(gene_lists))
+            yield query, res
+        if callback:
+            callback(100.0)
 
     def get_genes_by_enzyme(self, enzyme):
         enzyme = KEGGEnzyme().get_entry(enzyme)
@@ -243,12 +275,8 @@ class Organism(object):
 
     def get_pathways_by_genes(self, gene_ids):
         """ Pathways that include all genes in gene_ids. """
-        l = self.api.get_genes_pathway_organism(self.org_code)
-        gene_ids = set(gene_ids)
-        gtp = defaultdict(set)
-        for a,b in l:
-            gtp[a].add(b)
-        pathways = [ gtp[g] for g in gene_ids ]
+        index = self.pathway_index()
+        pathways = [set(index.pathways_of(g)) for g in set(gene_ids)]
         pathways = reduce(set.intersection, pathways)
         return sorted(pathways)
 
@@ -284,10 +312,11 @@ class Organism(object):
 
         """
         unique, conflicting, unknown = {}, [], []
-        for gene in genes:
-            names = self.genematcher.match(gene)
+        genes = list(genes)
+        targets = self.genematcher.targets
+        for gene, names in zip(genes, self.genematcher.match_many(genes)):
             if len(names) == 1:
-                unique[names[0]] = gene
+                unique[targets[names[0]]] = gene
             elif len(names) == 0:
                 unknown.append(gene)
             else:
@@ -332,6 +361,165 @@ class Organism(object):
 KEGGOrganism = Organism
 
 
+class PathwayGeneIndex(object):
+    """
+    An incidence index of pathways and genes of an organism.
+
+    Pathways of each gene are stored as a sparse gene x pathway matrix
+    in a compressed row format (`indptr`, `indices`); `genes` and
+    `pathways` are sorted lists of KEGG ids.
+    """
+    VERSION = 1
+
+    def __init__(self, genes, pathways, indptr, indices, release=None):
+        self.genes = genes
+        self.pathways = pathways
+        self.indptr = indptr
+        self.indices = indices
+        self.release = release
+        self._gene_index = None
+
+    @classmethod
+    def from_links(cls, links, release=None):
+        """ Build the index from (gene, pathway) pairs. """
+        links = sorted(set(map(tuple, links)))
+        pathways = sorted(set(p for _, p in links))
+        pathway_index = dict((p, i) for i, p in enumerate(pathways))
+        genes, counts = [], []
+        for gene, group in groupby(links, key=lambda link: link[0]):
+            genes.append(gene)
+            counts.append(len(list(group)))
+        indptr = numpy.zeros(len(genes) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=indptr[1:])
+        indices = numpy.array([pathway_index[p] for _, p in links],
+                              dtype=numpy.int32)
+        return cls(genes, pathways, indptr, indices, release)
+
+    def save(self, path):
+        """ Save the index into directory path. """
+        parent = os.path.dirname(os.path.abspath(path))
+        tmp = tempfile.mkdtemp(dir=parent)
+        numpy.save(os.path.join(tmp, "indptr.npy"), self.indptr)
+        numpy.save(os.path.join(tmp, "indices.npy"), self.indices)
+        with open(os.path.join(tmp, "index.json"), "w") as f:
+            json.dump({"version": self.VERSION, "release": self.release,
+                       "genes": self.genes, "pathways": self.pathways}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a saved index. """
+        with open(os.path.join(path, "index.json")) as f:
+            desc = json.load(f)
+        if desc["version"] != cls.VERSION:
+            raise ValueError("Unsupported pathway index version")
+        arrays = [numpy.load(os.path.join(path, name + ".npy"),
+                             mmap_mode="r")
+                  for name in ["indptr", "indices"]]
+        return cls([str(g) for g in desc["genes"]],
+                   [str(p) for p in desc["pathways"]],
+                   arrays[0], arrays[1], desc["release"])
+
+    def gene_indices(self, genes):
+        """ Return an array of row indices of `genes` (-1 if unknown). """
+        if self._gene_index is None:
+            self._gene_index = dict((g, i) for i, g in enumerate(self.genes))
+        get = self._gene_index.get
+        return numpy.array([get(g, -1) for g in genes], dtype=numpy.int64)
+
+    def _incidence(self, genes):
+        """
+        Return a tuple of arrays (positions, pathways) with a position
+        in `genes` and a pathway index for each gene's pathway.
+        """
+        rows = self.gene_indices(genes)
+        positions = numpy.flatnonzero(rows >= 0)
+        rows = rows[positions]
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths),
+                               lengths)
+        offsets += numpy.arange(len(offsets), dtype=offsets.dtype)
+        return numpy.repeat(positions, lengths), self.indices[offsets]
+
+    def pathways_of(self, gene):
+        """ Return a list of pathways of `gene`. """
+        _, pathways = self._incidence([gene])
+        return [self.pathways[i] for i in pathways]
+
+    def counts(self, genes):
+        """
+        Return an array with the number of (distinct) `genes` in each
+        pathway.
+        """
+        _, pathways = self._incidence(list(set(genes)))
+        return numpy.bincount(pathways, minlength=len(self.pathways))
+
+    def enrichment(self, genes, ref_counts, ref_size, prob):
+        """
+        Return a dictionary with pathways ids of `genes` as keys and
+        (list_of_genes, p_value, num_of_reference_genes) tuples as items.
+        `ref_counts` are reference gene :func:`counts`.
+        """
+        positions, pathways = self._incidence(genes)
+        order = numpy.lexsort((positions, pathways))
+        positions, pathways = positions[order], pathways[order]
+        found, starts, k = numpy.unique(pathways, return_index=True,
+                                        return_counts=True)
+        counts = numpy.asarray(ref_counts)[found]
+        p_values = prob.p_values(k, ref_size, counts, len(genes))
+        groups = numpy.split(positions, starts[1:])
+        return dict(
+            (self.pathways[pid], ([genes[i] for i in group], float(p), int(c)))
+            for pid, group, p, c in zip(found, groups, p_values, counts))
+
+
+def pathway_index(org, kegg_api=None):
+    """
+    Return a :class:`PathwayGeneIndex` for KEGG organism code `org`.
+
+    The index is stored in the cache directory and rebuilt when the KEGG
+    release of the organism changes. If the release cannot be retrieved
+    (e.g. when offline) a stored index is used regardless of its release.
+    """
+    from slumber.exceptions import SlumberHttpBaseException
+
+    if kegg_api is None:
+        kegg_api = api.CachedKeggApi()
+    path = os.path.join(conf.params["cache.path"], "pathway_index." + org)
+    try:
+        release = kegg_api.info(org).release
+    except (IOError, OSError, SlumberHttpBaseException):
+        # connection (requests) or HTTP errors
+        release = None
+
+    try:
+        index = PathwayGeneIndex.load(path)
+    except (IOError, OSError, ValueError, KeyError):
+        index = None
+
+    if index is None or (release is not None and index.release != release):
+        # Not the cached method: its entries do not depend on the release
+        # of the organism and would return the links of the old release.
+        # The stored index is the cache of the links.
+        links = api.KeggApi.get_genes_pathway_organism(kegg_api, org)
+        index = PathwayGeneIndex.from_links(links, release)
+        try:
+            touch_dir(conf.params["cache.path"])
+            index.save(path)
+        except (IOError, OSError):
+            pass
+    return index
+
+
+def _enriched_pathways_task(shared, query):
+    index, ref_counts, ref_size, prob = shared
+    i, genes = query
+    return i, index.enrichment(list(genes), ref_counts, ref_size, prob)
+
+
 def organism_name_search(name):
     """
     Search for a organism by `name` and return it's KEGG organism code.
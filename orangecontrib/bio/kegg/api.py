@@ -402,57 +402,94 @@ class CachedKeggApi(KeggApi):
         if len(ids) > 10:
             raise ValueError("Can batch at most 10 ids at a time.")
 
+        entries = self.get_many(ids, workers=1)
+
+        # Join all the results, but drop all None objects
+        return "".join(entries[id] for id in ids
+                       if entries.get(id) is not None)
+
+    def _fetch_entries(self, ids):
+        """
+        Request entries for a batch of ids and split them. Return a list
+        of (id, entry text) pairs for ids that were found.
+        """
+        rval = KeggApi.get(self, ids)
+
+        if rval:
+            entries = rval.split("///\n")
+        else:
+            entries = []
+
+        if entries and not entries[-1].strip():
+            # Delete the last single newline entry if present
+            del entries[-1]
+
+        if len(entries) != len(ids):
+            new_ids, entries = match_by_ids(ids, entries)
+            unmatched = set(ids) - set(new_ids)
+            ids = new_ids
+            warnings.warn("Unable to match entries for keys: %s." %
+                          ", ".join(map(repr, unmatched)))
+
+        return [(id, entry + "///\n") for id, entry in zip(ids, entries)]
+
+    def get_many(self, ids, batch_size=10, workers=4,
+                 progress_callback=None):
+        """
+        Return a dictionary mapping ids to entry texts (None for entries
+        that were not found). Entries that are not cached yet are requested
+        in batches of `batch_size` ids, with at most `workers` requests at
+        a time, and stored into the cache as they arrive.
+        """
+        if batch_size > 10 or batch_size < 1:
+            raise ValueError("Invalid batch_size")
+
         get = self.get
+        entries = {}
         uncached = []
-        unmatched = set()
 
         with closing(get.cache_store()) as store:
             # Which ids are already cached
             # TODO: Invalidate entries by release string.
             for id in ids:
+                if id in entries:
+                    continue
                 key = get.key_from_args((id,))
-                if not get.key_has_valid_cache(key, store):
+                if get.key_has_valid_cache(key, store):
+                    entries[id] = store[key].value
+                else:
+                    entries[id] = None
                     uncached.append(id)
 
-        if uncached:
-            # in case there are duplicate ids
-            uncached = sorted(set(uncached))
-
-            rval = KeggApi.get(self, uncached)
-
-            if rval is not None:
-                entries = rval.split("///\n")
-            else:
-                entries = []
-
-            if entries and not entries[-1].strip():
-                # Delete the last single newline entry if present
-                del entries[-1]
+        batches = [uncached[start: start + batch_size]
+                   for start in range(0, len(uncached), batch_size)]
+        if not batches:
+            return entries
 
-            if len(entries) != len(uncached):
-                new_uncached, entries = match_by_ids(uncached, entries)
-                unmatched = set(uncached) - set(new_uncached)
-                uncached = new_uncached
-                warnings.warn("Unable to match entries for keys: %s." %
-                              ", ".join(map(repr, unmatched)))
+        pool = None
+        if workers > 1 and len(batches) > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(workers, len(batches)))
+            results = pool.imap_unordered(self._fetch_entries, batches)
+        else:
+            results = six.moves.map(self._fetch_entries, batches)
 
+        try:
             with closing(get.cache_store()) as store:
-                for id, entry in zip(uncached, entries):
-                    key = get.key_from_args((id,))
-                    if entry is not None:
-                        entry = entry + "///\n"
-                    store[key] = cache_entry(entry, mtime=datetime.now())
-
-        # Finally join all the results, but drop all None objects
-
-        with closing(get.cache_store()):
-            keys = [get.key_from_args((id,)) for id in ids]
-            entries = [store[key].value for key in keys]
-
-        entries = filter(lambda e: e is not None, entries)
-
-        rval = "".join(entries)
-        return rval
+                for i, fetched in enumerate(results):
+                    mtime = datetime.now()
+                    store.update((get.key_from_args((id,)),
+                                  cache_entry(entry, mtime=mtime))
+                                 for id, entry in fetched)
+                    entries.update(fetched)
+                    if progress_callback:
+                        progress_callback(100.0 * (i + 1) / len(batches))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        return entries
 
     @cached_method
     def conv(self, target_db, source):
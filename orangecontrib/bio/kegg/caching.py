@@ -4,6 +4,8 @@ Caching framework for cached kegg api calls.
 """
 import os
 import sqlite3
+import time
+import zlib
 try:
     import cPickle as pickle
 except ImportError:
@@ -36,10 +38,41 @@ class Store(object):
 
 
 class Sqlite3Store(Store, DictMixin):
+    """
+    A persistent store of pickled (and zlib compressed) values in a
+    sqlite3 database.
+
+    Writes are committed immediately, except inside a `with` block, where
+    they are committed once at the end of the (outermost) block. The
+    database uses a write-ahead log. On close, entries older than
+    `max_age` days are removed, and the oldest entries are removed while
+    the total size of stored values exceeds `max_size` MB (by default
+    the "cache.max_age" and "cache.max_size" settings; 0 means no limit).
 
-    def __init__(self, filename):
+    """
+    #: Values are zlib compressed pickles.
+    CODEC_ZLIB = 1
+
+    def __init__(self, filename, max_size=None, max_age=None):
+        Store.__init__(self)
         self.filename = filename
+        if max_size is None:
+            max_size = float(conf.params.get("cache.max_size", 0))
+        if max_age is None:
+            max_age = float(conf.params.get("cache.max_age", 0))
+        self.max_size = max_size
+        self.max_age = max_age
+        self._batch = 0
+        self._written = False
+
         self.con = sqlite3.connect(filename)
+        # auto_vacuum only takes effect for new databases
+        self.con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        try:
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.OperationalError:
+            pass  # for instance on file systems without shared memory
         self.con.execute("""
             CREATE TABLE IF NOT EXISTS cache
                 (key TEXT UNIQUE,
@@ -50,11 +83,61 @@ class Sqlite3Store(Store, DictMixin):
             CREATE INDEX IF NOT EXISTS cache_index
             ON cache (key)
         """)
+        # columns added to the schema of older caches
+        columns = set(r[1] for r in self.con.execute("PRAGMA table_info(cache)"))
+        for column, definition in [("codec", "INTEGER DEFAULT 0"),
+                                   ("mtime", "REAL DEFAULT 0"),
+                                   ("size", "INTEGER DEFAULT 0")]:
+            if column not in columns:
+                self.con.execute("ALTER TABLE cache ADD COLUMN %s %s" %
+                                 (column, definition))
+        self.con.execute("""
+            CREATE INDEX IF NOT EXISTS cache_mtime_index
+            ON cache (mtime)
+        """)
+        # the total size of values is kept up to date by triggers
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS cache_meta
+                (name TEXT PRIMARY KEY,
+                 value INTEGER
+                )
+        """)
+        self.con.execute("""
+            INSERT OR IGNORE INTO cache_meta (name, value)
+            SELECT 'size', coalesce(sum(size), 0) FROM cache
+        """)
+        for event, change in [("INSERT", "new.size"),
+                              ("DELETE", "-old.size"),
+                              ("UPDATE OF size", "new.size - old.size")]:
+            self.con.execute("""
+                CREATE TRIGGER IF NOT EXISTS cache_size_%s
+                AFTER %s ON cache
+                BEGIN
+                    UPDATE cache_meta SET value = value + %s
+                    WHERE name = 'size';
+                END
+            """ % (event.split()[0].lower(), event, change))
+        # rows replaced by INSERT OR REPLACE fire the delete trigger
+        self.con.execute("PRAGMA recursive_triggers=ON")
         self.con.commit()
 
+    def __enter__(self):
+        self._batch += 1
+        return self
+
+    def __exit__(self, *args):
+        self._batch -= 1
+        if not self._batch:
+            self.con.commit()
+
+    def _commit(self):
+        self._written = True
+        if not self._batch:
+            self.con.commit()
+
     def __getitem__(self, key):
         cur = self.con.execute("""
-            SELECT value
+            SELECT value, codec
             FROM cache
             WHERE key=?
         """, (key,))
@@ -62,28 +145,54 @@ class Sqlite3Store(Store, DictMixin):
         if not r:
             raise KeyError(key)
         else:
-            pickle_str = r[0][0]
+            pickle_str, codec = r[0]
             if not six.PY3:
                 pickle_str = str(pickle_str)
             try:
+                if codec == Sqlite3Store.CODEC_ZLIB:
+                    pickle_str = zlib.decompress(pickle_str)
                 return pickle.loads(pickle_str)
             except Exception:
                 raise KeyError(key)
 
+    @staticmethod
+    def _row(key, value):
+        value = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        return (key, sqlite3.Binary(value), Sqlite3Store.CODEC_ZLIB,
+                time.time(), len(value))
+
     def __setitem__(self, key, value):
-        value = pickle.dumps(value)
         self.con.execute("""
-            INSERT OR REPLACE INTO cache
-            VALUES (?, ?)
-        """, (key, value))
-        self.con.commit()
+            INSERT OR REPLACE INTO cache (key, value, codec, mtime, size)
+            VALUES (?, ?, ?, ?, ?)
+        """, self._row(key, value))
+        self._commit()
+
+    def update(self, items=(), **kwargs):
+        """ Store many items in a single transaction. """
+        if hasattr(items, "keys"):
+            items = [(key, items[key]) for key in items.keys()]
+        items = list(items) + list(kwargs.items())
+        self.con.executemany("""
+            INSERT OR REPLACE INTO cache (key, value, codec, mtime, size)
+            VALUES (?, ?, ?, ?, ?)
+        """, (self._row(key, value) for key, value in items))
+        self._commit()
 
     def __delitem__(self, key):
         self.con.execute("""
             DELETE FROM cache
             WHERE key=?
         """, (key,))
-        self.con.commit()
+        self._commit()
+
+    def __contains__(self, key):
+        cur = self.con.execute("""
+            SELECT 1
+            FROM cache
+            WHERE key=?
+        """, (key,))
+        return cur.fetchone() is not None
 
     def keys(self):
         cur = self.con.execute("""
@@ -92,14 +201,67 @@ class Sqlite3Store(Store, DictMixin):
         """)
         return [str(r[0]) for r in cur.fetchall()]
 
+    def evict(self, max_size=None, max_age=None):
+        """
+        Remove entries older than max_age days, then remove the oldest
+        entries until values take at most max_size MB. Return the number
+        of removed entries.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        max_age = self.max_age if max_age is None else max_age
+        removed = 0
+        if max_age:
+            cur = self.con.execute("""
+                DELETE FROM cache
+                WHERE mtime < ?
+            """, (time.time() - max_age * 24 * 3600,))
+            removed += cur.rowcount
+        if max_size and self.total_size() > max_size * 2 ** 20:
+            # recount in case the cache was written without the triggers
+            total = self.con.execute(
+                "SELECT coalesce(sum(size), 0) FROM cache").fetchone()[0]
+            self.con.execute(
+                "UPDATE cache_meta SET value=? WHERE name='size'", (total,))
+            excess = total - max_size * 2 ** 20
+            rows = []
+            if excess > 0:
+                cur = self.con.execute("""
+                    SELECT rowid, size
+                    FROM cache
+                    ORDER BY mtime""")
+                for rowid, size in cur:
+                    if excess <= 0:
+                        break
+                    rows.append((rowid,))
+                    excess -= max(size, 1)
+                cur.close()
+            self.con.executemany("DELETE FROM cache WHERE rowid=?", rows)
+            removed += len(rows)
+        self.con.commit()
+        if removed:
+            self.con.execute("PRAGMA incremental_vacuum")
+        return removed
+
+    def total_size(self):
+        """ Return the total size of stored values in bytes. """
+        return self.con.execute(
+            "SELECT value FROM cache_meta WHERE name='size'").fetchone()[0]
+
     def close(self):
-        pass
+        if self.con is None:
+            return
+        self.con.commit()
+        if self._written and (self.max_size or self.max_age):
+            self.evict()
+        self.con.close()
+        self.con = None
 
     def __len__(self):
-        return None
+        return self.con.execute("SELECT count(*) FROM cache").fetchone()[0]
 
     def __iter__(self):
-        return None
+        # a snapshot of keys, so entries can be deleted while iterating
+        return iter(self.keys())
 
 
 
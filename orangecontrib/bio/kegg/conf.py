@@ -23,6 +23,10 @@ default = """
 path = %(kegg_dir)s/
 store = sqlite3
 invalidate = weekly
+# limits of each cache store: size of values in MB and age of entries
+# in days (0 for no limit)
+max_size = 1024
+max_age = 0
 
 [service]
 transport = urllib2
@@ -49,6 +53,8 @@ _ALL_PARAMS = [
     "cache.path",
     "cache.store",
     "cache.invalidate",
+    "cache.max_size",
+    "cache.max_age",
     "service.transport"
 ]
 
@@ -6,7 +6,6 @@ DBGET Database Interface
 from __future__ import absolute_import
 
 import re
-from contextlib import closing
 
 from . import entry
 from .entry import fields
@@ -184,11 +183,13 @@ class DBDataBase(object):
         res = self.api.find(self.DB, name).splitlines()
         return [r.split(" ", 1)[0] for r in res]
 
-    def pre_cache(self, keys=None, batch_size=10, progress_callback=None):
+    def pre_cache(self, keys=None, batch_size=10, progress_callback=None,
+                  workers=4):
         """
         Retrieve all the entries for `keys` and cache them locally for faster
         subsequent retrieval. If `keys` is ``None`` then all entries will be
-        retrieved.
+        retrieved. Up to `workers` batches of entries are requested
+        concurrently.
 
         """
         if not isinstance(self.api, api.CachedKeggApi):
@@ -200,54 +201,32 @@ class DBDataBase(object):
         if keys is None:
             keys = self.keys()
 
-        keys = map(self._add_db, keys)
-
-        get = self.api.get
-
-        # drop all keys with a valid cache entry to minimize the number
-        # of 'get' requests.
-        with closing(get.cache_store()) as store:
-            def is_uncached(key):
-                cache_key = get.key_from_args((key,))
-                return not get.key_has_valid_cache(cache_key, store)
-            keys = [key for key in keys if is_uncached(key)]
-
-        start = 0
-
-        while start < len(keys):
-            batch = keys[start: start + batch_size]
-            self.api.get(batch)
-
-            if progress_callback:
-                progress_callback(100.0 * start / len(keys))
+        keys = list(map(self._add_db, keys))
 
-            start += batch_size
+        self.api.get_many(keys, batch_size=batch_size, workers=workers,
+                          progress_callback=progress_callback)
 
-    def batch_get(self, keys):
+    def batch_get(self, keys, workers=4):
         """
         Batch retrieve all entries for keys. This can be significantly
         faster then getting each entry separately especially if entries
         are not yet cached.
 
         """
-        entries = []
-        batch_size = 10
-        keys = list(map(self._add_db, keys))
-
-        # Precache the entries first
-        self.pre_cache(keys)
+        if not isinstance(self.api, api.CachedKeggApi):
+            raise TypeError("Not an instance of api.CachedKeggApi")
 
-        start = 0
-        while start < len(keys):
-            batch = keys[start: start + batch_size]
-            batch_entries = self.api.get(batch)
-            if batch_entries is not None:
-                batch_entries = batch_entries.split("///\n")
-                # Remove possible empty last line
-                batch_entries = [e for e in batch_entries if e.strip()]
-                entries.extend(map(self.ENTRY_TYPE, batch_entries))
-            start += batch_size
+        keys = list(map(self._add_db, keys))
+        texts = self.api.get_many(keys, workers=workers)
 
+        entries = []
+        for key in keys:
+            text = texts.get(key)
+            if text is not None:
+                if text.endswith("///\n"):
+                    text = text[:-len("///\n")]
+                if text.strip():
+                    entries.append(self.ENTRY_TYPE(text))
         return entries
 
     def _add_db(self, key):
@@ -7,13 +7,21 @@ KEGG Pathway
 from __future__ import absolute_import
 
 import os
+import tempfile
 
 import xml.parsers
 from xml.dom import minidom
 
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
 from contextlib import closing
 from functools import reduce
 
+from six.moves import cPickle as pickle
+
 import requests
 
 from . import conf
@@ -32,6 +40,49 @@ def cached_method(func, cache_name="_cached_method_cache", store=None):
     return wrapper
 
 
+def parse_kgml(source):
+    """
+    Parse a KGML file (a filename or a file object) incrementally.
+
+    Return a tuple (pathway attributes, entries, reactions, relations).
+    Elements are plain tuples of their attributes and subelements (see
+    :class:`Pathway.entry`, :class:`Pathway.reaction` and
+    :class:`Pathway.relation`).
+    """
+    attributes, entries, reactions, relations = None, [], [], []
+    for event, elem in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "pathway":
+                attributes = dict(elem.attrib)
+            continue
+        if elem.tag == "entry":
+            graphics = elem.find("graphics")
+            entries.append(
+                (dict(elem.attrib),
+                 dict(graphics.attrib) if graphics is not None else {},
+                 [node.get("id") for node in elem.iter("component")]))
+        elif elem.tag == "reaction":
+            reactions.append(
+                (dict(elem.attrib),
+                 [node.get("name") for node in elem.iter("substrate")],
+                 [node.get("name") for node in elem.iter("product")]))
+        elif elem.tag == "relation":
+            relations.append(
+                (dict(elem.attrib),
+                 [list(node.attrib.items()) for node in elem.iter("subtype")]))
+        else:
+            continue
+        # parsed elements are not needed anymore
+        elem.clear()
+    return attributes, entries, reactions, relations
+
+
+def _set_attributes(record, attributes):
+    for name, value in attributes.items():
+        if name in record.__slots__:
+            setattr(record, name, value)
+
+
 class Pathway(object):
     """
     Class representing a KEGG Pathway (parsed from a "kgml" file)
@@ -41,6 +92,9 @@ class Pathway(object):
     """
     KGML_URL_FORMAT = "http://www.genome.jp/kegg-bin/download?entry={pathway_id}&format=kgml"
 
+    #: Version of the parsed kgml cache format
+    KGML_CACHE_VERSION = 1
+
     def __init__(self, pathway_id, local_cache=None, connection=None):
         if pathway_id.startswith("path:"):
             _, pathway_id = pathway_id.split(":", 1)
@@ -141,36 +195,74 @@ class Pathway(object):
                                       self.pathway_id + ".xml")
         return local_filename
 
-    class entry(object):
-        def __init__(self, dom_element):
-            self.__dict__.update(dom_element.attributes.items())
-            self.graphics = ()
-            self.components = []
+    def _parsed_kgml_filename(self):
+        return self._local_kgml_filename() + ".pck"
 
-            graphics = dom_element.getElementsByTagName("graphics")[0]
-            self.graphics = dict(graphics.attributes.items())
+    @cached_method
+    def _parsed_kgml(self):
+        """
+        Return the parsed kgml (see :func:`parse_kgml`) or None if the
+        kgml file is invalid. The parsed kgml is cached on disk and reused
+        while the kgml file is not modified.
+        """
+        with self._get_kgml() as kgml:
+            stat = os.fstat(kgml.fileno())
+            key = [self.KGML_CACHE_VERSION, stat.st_mtime, stat.st_size]
+            filename = self._parsed_kgml_filename()
+            try:
+                with open(filename, "rb") as f:
+                    cached_key, parsed = pickle.load(f)
+                if cached_key == key:
+                    return parsed
+            except Exception:
+                pass
+
+            try:
+                parsed = parse_kgml(kgml)
+            except SyntaxError:
+                # TODO: Should delete the cached xml file.
+                return None
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.local_cache)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((key, parsed), f, pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmp, filename)
+        except (IOError, OSError):
+            pass
+        return parsed
+
+    class entry(object):
+        __slots__ = ("id", "name", "type", "link", "reaction", "graphics",
+                     "components")
 
-            components = dom_element.getElementsByTagName("component")
-            self.components = [node.getAttribute("id") for node in components]
+        def __init__(self, attributes, graphics=None, components=()):
+            _set_attributes(self, attributes)
+            self.graphics = graphics if graphics is not None else {}
+            self.components = list(components)
 
     class reaction(object):
-        def __init__(self, dom_element):
-            self.__dict__.update(dom_element.attributes.items())
-            self.substrates = [node.getAttribute("name") for node in
-                               dom_element.getElementsByTagName("substrate")]
-            self.products = [node.getAttribute("name") for node in
-                             dom_element.getElementsByTagName("product")]
+        __slots__ = ("id", "name", "type", "substrates", "products")
+
+        def __init__(self, attributes, substrates=(), products=()):
+            _set_attributes(self, attributes)
+            self.substrates = list(substrates)
+            self.products = list(products)
 
     class relation(object):
-        def __init__(self, dom_element):
-            self.__dict__.update(dom_element.attributes.items())
-            self.subtypes = [node.attributes.items() for node in
-                             dom_element.getElementsByTagName("subtype")]
+        __slots__ = ("entry1", "entry2", "type", "subtypes")
+
+        def __init__(self, attributes, subtypes=()):
+            _set_attributes(self, attributes)
+            self.subtypes = list(subtypes)
 
     @cached_method
     def pathway_attributes(self):
-        if self.pathway_dom():
-            return dict(self.pathway_dom().attributes.items())
+        parsed = self._parsed_kgml()
+        if parsed and parsed[0] is not None:
+            return dict(parsed[0])
         else:
             return None
 
@@ -227,27 +319,18 @@ class Pathway(object):
 
     @cached_method
     def entries(self):
-        dom = self.pathway_dom()
-        if dom:
-            return [self.entry(e) for e in dom.getElementsByTagName("entry")]
-        else:
-            return []
+        parsed = self._parsed_kgml()
+        return [self.entry(*e) for e in parsed[1]] if parsed else []
 
     @cached_method
     def reactions(self):
-        dom = self.pathway_dom()
-        if dom:
-            return [self.reaction(e) for e in dom.getElementsByTagName("reaction")]
-        else:
-            return []
+        parsed = self._parsed_kgml()
+        return [self.reaction(*e) for e in parsed[2]] if parsed else []
 
     @cached_method
     def relations(self):
-        dom = self.pathway_dom()
-        if dom:
-            return [self.relation(e) for e in dom.getElementsByTagName("relation")]
-        else:
-            return []
+        parsed = self._parsed_kgml()
+        return [self.relation(*e) for e in parsed[3]] if parsed else []
 
     def __iter__(self):
         """
@@ -274,14 +357,18 @@ class Pathway(object):
         """
         return reduce(list.__add__,
                       [self.genes(), self.compounds(),
-                       self.enzmes(), self.reactions()],
+                       self.enzymes(), self.reactions()],
                       [])
 
+    @cached_method
+    def _entry_names_by_type(self):
+        names = {}
+        for entry in self.entries():
+            names.setdefault(entry.type, set()).update(entry.name.split())
+        return dict((type, sorted(n)) for type, n in names.items())
+
     def _get_entries_by_type(self, type):
-        return sorted(reduce(set.union,
-                             [entry.name.split() for entry in self.entries()
-                              if entry.type == type],
-                             set()))
+        return list(self._entry_names_by_type().get(type, []))
 
     @cached_method
     def genes(self):
@@ -3,28 +3,36 @@
 """
 from __future__ import absolute_import
 
+import six
+
 REST_API = "http://rest.kegg.jp/"
 
 
 def slumber_service():
     """
-    Return a rest based service using `slumber` package
+    Return a rest based service (for the `REST_API` url) using `slumber`
+    package
     """
     import slumber
     if not hasattr(slumber_service, "_cached"):
+        slumber_service._cached = {}
+    if REST_API not in slumber_service._cached:
 
         class DecodeSerializer(slumber.serialize.BaseSerializer):
             key = "decode"
             content_types = ["text/plain"]
 
             def loads(self, data):
+                if six.PY3 and isinstance(data, bytes):
+                    data = data.decode("utf-8")
                 return data
 
         # for python 2/3 compatibility
         serializer = slumber.serialize.Serializer(
             default="decode", serializers=[DecodeSerializer()])
-        slumber_service._cached = slumber.API(REST_API, serializer=serializer)
-    return slumber_service._cached
+        slumber_service._cached[REST_API] = \
+            slumber.API(REST_API, serializer=serializer)
+    return slumber_service._cached[REST_API]
 
 
 from . import conf
@@ -11,14 +11,19 @@ from urllib import urlopen
 from sgmllib import SGMLParser
 import os.path
 
+import numpy
+
 import orange
 from Orange.orng import orngServerFiles
 
+from .utils.meshindex import MeSHIndex, tree_data
+
 FUZZYMETAID = -12
 
 import Orange.bio.utils.stats
 HYPERG = Orange.bio.utils.stats.Hypergeometric()
 
+
 class obiMeSH(object):
 
     def __init__(self):
@@ -90,29 +95,17 @@ class obiMeSH(object):
                 ids.extend(self.toID[i])
         else:
             ids = meshTerms
+        index = self.__meshIndex()
+        selected = index.mask(ids)
+        memo = {}
         for e in examples:
-            try:
-                if callback and c % 10 == 0:
-                    callback(int(c * 100.0 / l))
-                c = c + 1.0
-                ends = eval(e[self.solo_att].value)
-            except SyntaxError:
-                # print "Error in parsing ", e[self.solo_att].value
+            if callback and c % 10 == 0:
+                callback(int(c * 100.0 / l))
+            c = c + 1.0
+            endIDs, _ = index.encode(e[self.solo_att].value, memo)
+            if endIDs is None:
                 continue
-            endids = list()
-            for i in ends:
-                if self.toID.has_key(i):
-                    endids.extend(self.toID[i])
-            #allnodes = self.__findParents(endids)
-            allnodes = endids
-            # calculate intersection
-            isOk = False
-            for i in allnodes:
-                if ids.count(i) > 0:
-                    isOk = True
-                    break
-
-            if isOk:	  # intersection between example mesh terms and observed term group is None
+            if selected[endIDs].any():	  # intersection between example mesh terms and observed term group is not empty
                 newdata.append(e)
         return newdata
 
@@ -201,31 +194,15 @@ class obiMeSH(object):
             else:
                 return ret
         # plain frequency
-        t = 0.0
         n = len(data)
-        for i in data:
-            t = t + 1
-            if callback and t % 10 == 0:
-                callback(int(t * 100 / n))
-            try:
-                endNodes = list(set(eval(i[self.solo_att].value)))  # for every CID we look up for end nodes in mesh. for every end node we have to find its ID
-            except SyntaxError:
-                # print "Error in parsing ",i[self.solo_att].value
-                continue
-            # we find ID of end nodes
-            endIDs = []
-            for k in endNodes:
-                if(self.toID.has_key(k)):  # this should be always true, but anyway ...
-                    endIDs.extend(self.toID[k])
-                else:
-                    print "Current ontology does not contain MeSH term ", k, "."
-            # we find id of all parents
-            #allIDs = self.__findParents(endIDs)
-            allIDs = endIDs
-            for k in allIDs:  # for every meshID we update statistics dictionary
-                if(not self.statistics.has_key(k)):  # first time meshID
-                    self.statistics[k] = 0
-                self.statistics[k] += 1  # counter increased
+        progress = None
+        if callback:
+            progress = lambda t: callback(int(t * 100 / n))
+        index = self.__meshIndex()
+        rows, _ = self.__encodeExamples(data, self.solo_att, progress=progress)
+        counts = index.counts(rows)
+        for i in numpy.flatnonzero(counts):
+            self.statistics[index.ids[i]] = int(counts[i])
         # post processing
         for i in self.statistics.iterkeys():
             if(self.statistics[i] >= minSizeInTerm):
@@ -238,32 +215,7 @@ class obiMeSH(object):
             return ret
 
     def __treeData(self, ids):
-        succesors = dict()
-        succesors["tops"] = []
-        # we build a list of succesors. for each node we know which are its succesors in mesh ontology
-        for i in ids:
-            succesors[i] = []
-            for j in ids:
-                if(i != j and self.__isPrecedesor(i, j)):
-                    succesors[i].append(j)
-        # for each node from list above we remove its indirect succesors
-        # only  i -1-> j   remain
-        for i in succesors.iterkeys():
-            succs = succesors[i]
-            second_level_succs = []
-            for k in succs:
-                second_level_succs.extend(succesors[k])
-            for m in second_level_succs:
-                if succesors[i].count(m) > 0:
-                    succesors[i].remove(m)
-        # we make a list of top nodes
-        tops = list(ids)
-        for i in ids:
-            for j in succesors[i]:
-                tops.remove(j)
-        # we pack tops table and succesors hash
-        succesors["tops"] = tops
-        return succesors
+        return tree_data(ids)
 
     def findEnrichedTerms(self, reference, cluster, pThreshold=0.05, treeData=False, callback=None, fuzzy=False):
         """
@@ -444,108 +396,58 @@ class obiMeSH(object):
         print "Program was unable to determinate MeSH attribute."
         return "Unknown"
 
-    def __isPrecedesor(self, a, b):
-        """ function returns true if in Mesh ontology exists path from term id a to term id b """
-        if b.count(a) > 0:
-            return True
-        return False
+    def __meshIndex(self):
+        """ Return the (cached) index of the loaded MeSH ontology. """
+        if self.__index is None:
+            self.__index = MeSHIndex(self.toID)
+        return self.__index
+
+    def __encodeExamples(self, examples, att, fuzzy=False, verbose=True, progress=None):
+        """
+        Return codes of MeSH terms of examples annotated with at least one
+        known term and an array of example weights (membership 'u' of fuzzy
+        examples).
+        """
+        index = self.__meshIndex()
+        rows = []
+        weights = []
+        memo = {}  # repeated annotations are parsed once
+        for t, e in enumerate(examples):
+            if progress and t % 10 == 0:
+                progress(t)
+            value = e[att].value
+            endIDs, unknown = index.encode(value, memo)
+            if endIDs is None:  # where was a parse error
+                if verbose:
+                    print "Error in parsing ", value
+                continue
+            if verbose:
+                for k in unknown:
+                    print "Current ontology does not contain MeSH term ", k, "."
+            # examples without known terms are skipped
+            if len(endIDs):
+                rows.append(endIDs)
+                weights.append(float(e["u"]) if fuzzy else 1)
+        return rows, numpy.array(weights)
 
     def __calculateAll(self, callback, fuzzy):
         """calculates all statistics"""
-        # we build a dictionary 		meshID -> [description, noReference,noCluster, enrichment, deprivement, [cids] ]
-        # print "ok"
-        self.statistics = dict()
-        if fuzzy:
-            n = 0
-            for i in self.reference:
-                n = n + float(i['u'])
-            cln = 0
-            for i in self.cluster:
-                cln = cln + float(i['u'])
-
-        else:
-            n = len(self.reference) 										# reference size
-            cln = len(self.cluster)											# cluster size
-        # frequency from reference list
-        r = 0.0
-        for i in self.reference:
-            if callback and r % 10 == 0:
-                r += 1.0
-                callback(int(100 * r / (n + cln)))
-            try:
-                endNodes = list(set(eval(i[self.ref_att].value)))  # for every CID we look up for end nodes in mesh. for every end node we have to find its ID
-            except SyntaxError:					 # where was a parse error
-                print "Error in parsing ", i[self.ref_att].value
-                if fuzzy:
-                    n = n - float(i["u"])
-                else:
-                    n = n - 1
-                continue
-            # we find ID of end nodes
-            endIDs = []
-            for k in endNodes:
-                if(self.toID.has_key(k)):					# this should be always true, but anyway ...
-                    endIDs.extend(self.toID[k])
-                else:
-                    print "Current ontology does not contain MeSH term ", k, "."
-            # endIDs may be empty > in this case we can skip this example
-            if len(endIDs) == 0:
-                if fuzzy:
-                    n = n - float(i["u"])
-                else:
-                    n = n - 1
-                continue
-            # we find id of all parents
-            # allIDs = self.__findParents(endIDs) PATCH
-            allIDs = endIDs
-            for k in list(set(allIDs)):				# for every meshID we update statistics dictionary
-                if(not self.statistics.has_key(k)):			# first time meshID
-                    self.statistics[k] = [0, 0, 0.0, 0.0]
-                if fuzzy:
-                    self.statistics[k][0] += float(i["u"])
-                else:
-                    self.statistics[k][0] += 1  # increased noReference
-        # frequency from cluster list
-        r = 0.0
-        for i in self.cluster:
-            try:
-                if callback and r % 10 == 0:
-                    r += 1.0
-                    callback(int(100 * r / (n + cln)))
-                endNodes = list(set(eval(i[self.clu_att].value)))  # for every CID we look up for end nodes in mesh. for every end node we have to find its ID
-            except SyntaxError:
-                # print "Error in parsing ",i[self.clu_att].value
-                if fuzzy:
-                    cln = cln - float(i["u"])
-                else:
-                    cln = cln - 1
-                continue
-            # we find ID of end nodes
-            endIDs = []
-            for k in endNodes:
-                if(self.toID.has_key(k)):
-                    endIDs.extend(self.toID[k])  # for every endNode we add all corensponding meshIDs
-            # endIDs may be empty > in this case we can skip this example
-            if len(endIDs) == 0:
-                if fuzzy:
-                    cln = cln - float(i["u"])
-                else:
-                    cln = cln - 1
-                continue
-            # we find id of all parents
-            #allIDs = self.__findParents(endIDs)
-            allIDs = endIDs
-            for k in list(set(allIDs)):  # for every meshID we update statistics dictionary
-                if self.statistics.has_key(k):
-                    if fuzzy:
-                        self.statistics[k][1] += float(i["u"])
-                    else:
-                        self.statistics[k][1] += 1  # increased noCluster
-        self.ratio = float(cln) / float(n)
-        # enrichment
-        for i in self.statistics.iterkeys():
-            self.statistics[i][2] = HYPERG.p_value(int(self.statistics[i][1]), int(n), int(cln), int(self.statistics[i][0]))
-            self.statistics[i][3] = float(self.statistics[i][1]) / float(self.statistics[i][0]) / self.ratio   # fold enrichment
+        # we build a dictionary 		meshID -> [noReference, noCluster, p value, fold enrichment]
+        index = self.__meshIndex()
+        total = len(self.reference) + len(self.cluster)
+
+        def progress(offset):
+            if callback:
+                return lambda t: callback(int(100.0 * (offset + t) / total))
+
+        refRows, refWeights = self.__encodeExamples(
+            self.reference, self.ref_att, fuzzy, progress=progress(0))
+        cluRows, cluWeights = self.__encodeExamples(
+            self.cluster, self.clu_att, fuzzy, verbose=False,
+            progress=progress(len(self.reference)))
+        # statistics are computed for terms from the reference
+        self.statistics, self.ratio = index.enrichment(
+            refRows, refWeights, cluRows, cluWeights, fuzzy)
         self.calculated = True
 
     def __loadOntologyFromDisk(self):
@@ -557,6 +459,7 @@ class obiMeSH(object):
         self.toDesc = dict()  # name -> description
         self.fromCID = dict()  # cid -> term id
         self.fromPMID = dict()  # pmid -> term id
+        self.__index = None
 
         d = file(orngServerFiles.localpath_download('MeSH', 'mesh-ontology.dat'))
         f = file(orngServerFiles.localpath_download('MeSH', 'cid-annotation.dat'))
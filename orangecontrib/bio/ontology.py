@@ -477,31 +477,37 @@ class OBOParser(object):
         """
         Parse the file and yield parse events.
 
+        The file is read incrementally (line by line).
+
         .. todo List events and values
 
         """
-        data = self.file.read()
-        header = data[: data.index("\n[")]
-        body = data[data.index("\n[") + 1:]
-        for line in header.splitlines():
-            if line.strip():
-                yield "HEADER_TAG", line.split(": ", 1)
-
         current = None
+        in_header = True
         #  For speed make these functions local
         startswith = str.startswith
         endswith = str.endswith
         parse_tag_value_ = parse_tag_value
 
-        for line in body.splitlines():
+        for line in self.file:
+            if not isinstance(line, str):
+                line = line.decode("utf-8")
+            line = line.rstrip("\r\n")
             if startswith(line, "[") and endswith(line, "]"):
+                if current is not None:
+                    yield "CLOSE_STANZA", None
+                in_header = False
                 yield "START_STANZA", line.strip("[]")
                 current = line
+            elif in_header:
+                if line.strip():
+                    yield "HEADER_TAG", line.split(": ", 1)
             elif startswith(line, "!"):
                 yield "COMMENT", line[1:]
             elif line:
                 yield "TAG_VALUE", parse_tag_value_(line)
-            else:  # empty line is the end of a term
+            elif current is not None:
+                # empty line is the end of a term
                 yield "CLOSE_STANZA", None
                 current = None
         if current is not None:
@@ -533,6 +539,10 @@ class OBOOntology(object):
         self._resolved_imports = []
         self._invalid_cache_flag = False
         self._related_to = {}
+        self._parents = {}
+        #: Objects by stanza type and terms by name
+        self._by_type = defaultdict(list)
+        self._by_name = defaultdict(list)
 
         # First load the built in OBO objects
         builtins = StringIO("\n" + "\n\n".join(self.BUILTINS) + "\n")
@@ -549,6 +559,9 @@ class OBOOntology(object):
                              "the ontology" % obj.id)
         self.objects.append(obj)
         self.id2term[obj.id] = obj
+        self._by_type[obj.stanza_type].append(obj)
+        if obj.stanza_type == "Term":
+            self._by_name[obj.name].append(obj)
         self._invalid_cache_flag = True
 
     def add_header_tag(self, tag, value):
@@ -638,6 +651,10 @@ class OBOOntology(object):
                     pass
             else:
                 self.add_object(term)
+        # names of updated terms could change
+        self._by_name = defaultdict(list)
+        for term in self._by_type["Term"]:
+            self._by_name[term.name].append(term)
         self._invalid_cache_flag = True
 
     def _cache_validate(self, force=False):
@@ -649,17 +666,29 @@ class OBOOntology(object):
 
     def _cache_relations(self):
         """
-        Collect all relations from parent to a child and store it in
-        ``self._related_to`` member.
+        Collect all relations from parent to a child and store them in
+        ``self._related_to`` member and all relations from a child to a
+        parent in ``self._parents`` member.
+
+        Parents which are not in the ontology are stored by their id.
 
         """
         related_to = defaultdict(list)
+        parents = {}
         for obj in self.objects:
+            edges = []
             for rel_type, id in self.related_terms(obj):
-                term = self.term(id)
+                try:
+                    term = self.term(id)
+                except ValueError:
+                    edges.append((rel_type, id))
+                    continue
+                edges.append((rel_type, term))
                 related_to[term].append((rel_type, obj))
+            parents[obj] = edges
 
         self._related_to = related_to
+        self._parents = parents
         self._invalid_cache_flag = False
 
     def term(self, id):
@@ -684,13 +713,13 @@ class OBOOntology(object):
         """
         Return all :class:`Term` instances in the ontology.
         """
-        return [obj for obj in self.objects if obj.stanza_type == "Term"]
+        return list(self._by_type.get("Term", []))
 
     def term_by_name(self, name):
         """
         Return the term with name `name`.
         """
-        terms = [t for t in self.terms() if t.name == name]
+        terms = self._by_name.get(name, [])
         if len(terms) != 1:
             raise ValueError("Unknown term name: %r" % name)
         return terms[0]
@@ -699,19 +728,20 @@ class OBOOntology(object):
         """
         Return all :class:`Typedef` instances in the ontology.
         """
-        return [obj for obj in self.objects if obj.stanza_type == "Typedef"]
+        return list(self._by_type.get("Typedef", []))
 
     def instances(self):
         """
         Return all :class:`Instance` instances in the ontology.
         """
-        return [obj for obj in self.objects if obj.stanza_type == "Instance"]
+        return list(self._by_type.get("Instance", []))
 
     def root_terms(self):
         """
         Return all root terms (terms without any parents).
         """
-        return [term for term in self.terms() if not self.parent_terms(term)]
+        self._cache_validate()
+        return [term for term in self.terms() if not self._parents.get(term)]
 
     def related_terms(self, term):
         """
@@ -733,17 +763,19 @@ class OBOOntology(object):
         """
         Return a list of all edge types in the ontology.
         """
-        return [obj.id for obj in self.objects if obj.stanza_type == "Typedef"]
+        return [obj.id for obj in self._by_type.get("Typedef", [])]
 
     def parent_edges(self, term):
         """
         Return a list of (rel_type, parent_term) tuples.
         """
+        self._cache_validate()
         term = self.term(term)
-        parents = []
-        for rel_type, parent in self.related_terms(term):
-            parents.append((rel_type, self.term(parent)))
-        return parents
+        if term in self._parents:
+            edges = self._parents[term]
+        else:
+            edges = self.related_terms(term)
+        return [(rel_type, self.term(parent)) for rel_type, parent in edges]
 
     def child_edges(self, term):
         """
@@ -757,26 +789,26 @@ class OBOOntology(object):
         """
         Return a set of all super terms of `term` up to the most general one.
         """
-        terms = self.parent_terms(term)
         visited = set()
-        queue = set(terms)
+        queue = list(self.parent_terms(term))
         while queue:
             term = queue.pop()
-            visited.add(term)
-            queue.update(self.parent_terms(term) - visited)
+            if term not in visited:
+                visited.add(term)
+                queue.extend(self.parent_terms(term))
         return visited
 
     def sub_terms(self, term):
         """
         Return a set of all sub terms for `term`.
         """
-        terms = self.child_terms(term)
         visited = set()
-        queue = set(terms)
+        queue = list(self.child_terms(term))
         while queue:
             term = queue.pop()
-            visited.add(term)
-            queue.update(self.child_terms(term) - visited)
+            if term not in visited:
+                visited.add(term)
+                queue.extend(rel[1] for rel in self.child_edges(term))
         return visited
 
     def child_terms(self, term):
@@ -794,21 +826,18 @@ class OBOOntology(object):
         """
         Return a set of all parent terms for this `term`.
         """
-        term = self.term(term)
-        parents = []
-        for rel_type, id in self.parent_edges(term):
-            parents.append(self.term(id))
-        return set(parents)
+        return set(parent for _, parent in self.parent_edges(term))
 
     def relations(self):
         """
         Return a list of all relations in the ontology.
         """
+        self._cache_validate()
         relations = []
         for obj in self.objects:
-            for type_id, id in  obj.related:
-                target_term = self.term(id)
-            relations.append((obj, type_id, target_term))
+            for type_id, target_term in self._parents.get(obj, []):
+                if isinstance(target_term, OBOObject):
+                    relations.append((obj, type_id, target_term))
         return relations
 
     def __len__(self):
@@ -14,11 +14,18 @@ import sqlite3
 import errno
 import posixpath
 import textwrap
+import itertools
+import json
+import tempfile
 
 from io import StringIO
-from collections import defaultdict, namedtuple
+from collections import defaultdict, namedtuple, OrderedDict
+from contextlib import contextmanager
 from operator import itemgetter
 
+import numpy
+import scipy.sparse
+
 from .utils import serverfiles
 try:
     from Orange.utils import ConsoleProgressBar, wget
@@ -40,6 +47,244 @@ def mkdir_p(path, mode=0o777):
             raise
 
 
+_temp_table_count = itertools.count()
+
+
+@contextmanager
+def _temp_table(db, rows, columns=("id",)):
+    """
+    Create a temporary table with (distinct) `rows` (tuples of values for
+    `columns`) in an sqlite3 connection `db` and return its name. The
+    table is dropped on exit.
+
+    """
+    name = "temp_query_{}".format(next(_temp_table_count))
+    db.execute("CREATE TEMP TABLE {} ({}, PRIMARY KEY ({}))".format(
+        name, ", ".join(c + " TEXT" for c in columns), ", ".join(columns)))
+    try:
+        db.executemany("INSERT OR IGNORE INTO {} VALUES ({})".format(
+            name, ", ".join("?" * len(columns))), rows)
+        yield name
+    finally:
+        db.execute("DROP TABLE temp.{}".format(name))
+
+
+def _stream(cursor):
+    """
+    Iterate over the cursor rows. Close the cursor if the iteration is
+    stopped early (so the temporary tables it uses can be dropped).
+    """
+    try:
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def _chunks(iterable, size):
+    iterable = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterable, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class PPIGraph(object):
+    """
+    An undirected protein interaction network stored as a compressed
+    sparse row (CSR) adjacency: the neighbours of the `i`-th protein
+    (``ids[i]``) are ``indices[indptr[i]:indptr[i + 1]]`` and the
+    interaction scores are in the same positions in ``scores``.
+
+    Use :obj:`PPIDatabase.graph` to get the network of a database.
+
+    """
+    #: Version of the snapshot format (see :obj:`save`).
+    VERSION = 1
+
+    def __init__(self, ids, indptr, indices, scores):
+        self.ids = list(ids)
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+        self._index = None
+
+    @classmethod
+    def from_edges(cls, edges):
+        """
+        Build the network from (id1, id2, score) tuples. Edges are
+        undirected; for repeated edges the highest score is kept.
+        Self interactions are ignored. Unknown scores (None) are NaN.
+
+        """
+        index = {}
+        src, dst, scores = [], [], []
+        for id1, id2, score in edges:
+            src.append(index.setdefault(id1, len(index)))
+            dst.append(index.setdefault(id2, len(index)))
+            scores.append(score if score is not None else numpy.nan)
+        ids = sorted(index, key=index.get)
+        src = numpy.array(src, dtype=numpy.int32)
+        dst = numpy.array(dst, dtype=numpy.int32)
+        scores = numpy.array(scores, dtype=float)
+
+        rows = numpy.concatenate([src, dst])
+        cols = numpy.concatenate([dst, src])
+        scores = numpy.concatenate([scores, scores])
+        keep = rows != cols
+        rows, cols, scores = rows[keep], cols[keep], scores[keep]
+
+        # sort by row, column and decreasing score and keep the first
+        # (highest scoring) of the repeated edges
+        order = numpy.lexsort((-numpy.nan_to_num(scores), cols, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        first = numpy.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, scores = rows[first], cols[first], scores[first]
+
+        indptr = numpy.zeros(len(ids) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(rows, minlength=len(ids)),
+                     out=indptr[1:])
+        return cls(ids, indptr, cols, scores)
+
+    def save(self, path, meta=None):
+        """
+        Save the network into directory `path` (.npy arrays and a json
+        file with ids and `meta` data).
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        tmp = tempfile.mkdtemp(dir=parent)
+        for name in ["indptr", "indices", "scores"]:
+            numpy.save(os.path.join(tmp, name + ".npy"), getattr(self, name))
+        with open(os.path.join(tmp, "graph.json"), "w") as f:
+            json.dump({"version": self.VERSION, "ids": self.ids,
+                       "meta": meta}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a network saved with :obj:`save`. The arrays are memory
+        mapped if `mmap` is True. Return a tuple (graph, meta).
+        """
+        with open(os.path.join(path, "graph.json")) as f:
+            desc = json.load(f)
+        if desc["version"] != cls.VERSION:
+            raise ValueError("Unsupported graph snapshot version")
+        arrays = [numpy.load(os.path.join(path, name + ".npy"),
+                             mmap_mode="r" if mmap else None)
+                  for name in ["indptr", "indices", "scores"]]
+        ids = desc["ids"]
+        if str is bytes:
+            ids = [id.encode("utf-8") for id in ids]
+        return cls(ids, *arrays), desc["meta"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def matrix(self):
+        """The adjacency (with scores) as a :obj:`scipy.sparse.csr_matrix`."""
+        n = len(self.ids)
+        return scipy.sparse.csr_matrix(
+            (self.scores, self.indices, self.indptr), shape=(n, n))
+
+    def index(self, ids):
+        """Return an array of positions of `ids` (unknown ids are skipped)."""
+        if self._index is None:
+            self._index = dict((id, i) for i, id in enumerate(self.ids))
+        return numpy.array([self._index[id] for id in ids if id in self._index],
+                           dtype=numpy.int64)
+
+    def threshold(self, min_score):
+        """
+        Return a network with only the edges with at least `min_score`.
+        """
+        if min_score is None:
+            return self
+        keep = self.scores >= min_score
+        rows = numpy.repeat(numpy.arange(len(self.ids)), numpy.diff(self.indptr))
+        indptr = numpy.zeros(len(self.ids) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(rows[keep], minlength=len(self.ids)),
+                     out=indptr[1:])
+        return PPIGraph(self.ids, indptr, self.indices[keep], self.scores[keep])
+
+    def neighbors(self, id, min_score=None):
+        """Return a list of (neighbour id, score) of protein `id`."""
+        graph = self.threshold(min_score)
+        res = []
+        for i in graph.index([id]):
+            start, end = graph.indptr[i], graph.indptr[i + 1]
+            res.extend((self.ids[j], score) for j, score in
+                       zip(graph.indices[start:end], graph.scores[start:end]))
+        return res
+
+    def neighborhood(self, ids, k=1, min_score=None):
+        """
+        Return a list of proteins at most `k` interactions (with at least
+        `min_score`) away from any of the proteins in `ids` (including
+        the proteins in `ids` that are in the network).
+
+        """
+        matrix = self.threshold(min_score).matrix
+        visited = numpy.zeros(len(self.ids), dtype=bool)
+        frontier = numpy.unique(self.index(ids))
+        visited[frontier] = True
+        for _ in range(k):
+            if not len(frontier):
+                break
+            frontier = numpy.unique(matrix[frontier].indices)
+            frontier = frontier[~visited[frontier]]
+            visited[frontier] = True
+        return [self.ids[i] for i in numpy.flatnonzero(visited)]
+
+    def subgraph(self, ids=None, min_score=None):
+        """
+        Return the network induced by proteins `ids` (all if None) with
+        only the edges with at least `min_score`.
+        """
+        graph = self.threshold(min_score)
+        if ids is None:
+            return graph
+        nodes = numpy.unique(graph.index(ids))
+        matrix = graph.matrix[nodes][:, nodes].tocsr()
+        matrix.sort_indices()
+        return PPIGraph([self.ids[i] for i in nodes], matrix.indptr,
+                        matrix.indices, matrix.data)
+
+    def edges(self):
+        """Return an iterator over (id1, id2, score), each edge once."""
+        rows = numpy.repeat(numpy.arange(len(self.ids)), numpy.diff(self.indptr))
+        upper = numpy.flatnonzero(rows < self.indices)
+        for i, j, score in zip(rows[upper], self.indices[upper],
+                               self.scores[upper]):
+            yield self.ids[i], self.ids[j], score
+
+    def degrees(self, min_score=None):
+        """
+        Return an array of degrees of proteins (in order of `ids`),
+        counting the edges with at least `min_score`.
+        """
+        return numpy.diff(self.threshold(min_score).indptr)
+
+    def degree_statistics(self, min_score=None):
+        """
+        Return a dictionary with the minimal, maximal, mean and median
+        degree and the number of edges and nodes.
+        """
+        degrees = self.degrees(min_score)
+        if not len(degrees):
+            return {"nodes": 0, "edges": 0, "min": 0, "max": 0,
+                    "mean": 0.0, "median": 0.0}
+        return {"nodes": len(degrees), "edges": int(degrees.sum()) // 2,
+                "min": int(degrees.min()), "max": int(degrees.max()),
+                "mean": float(degrees.mean()),
+                "median": float(numpy.median(degrees))}
+
+
 class PPIDatabase(object):
     """
     A general interface for protein-protein interaction database access.
@@ -123,23 +368,118 @@ class PPIDatabase(object):
         """
         raise NotImplementedError
 
+    def edges_many(self, ids):
+        """
+        Return an iterator over edges (3-tuples (id1, id2, score)) of all
+        (distinct) proteins in `ids`.
+        """
+        for id in OrderedDict.fromkeys(ids):
+            for edge in self.edges(id):
+                yield edge
+
+    def synonyms_many(self, ids):
+        """
+        Return a dictionary mapping primary ids in `ids` to lists of
+        their synonyms.
+        """
+        return dict((id, self.synonyms(id)) for id in ids)
+
+    def search_ids(self, names, taxid=None):
+        """
+        Search the database for protein names. Return a dictionary
+        mapping names to lists of matching primary ids. Use `taxid` to
+        limit the results to a single organism.
+
+        """
+        return dict((name, list(self.search_id(name, taxid)))
+                    for name in names)
+
+    def subnetwork(self, ids, min_score=None):
+        """
+        Return an iterator over edges (3-tuples (id1, id2, score))
+        among proteins in `ids`. If `min_score` is not ``None`` only
+        return edges with at least this score.
+
+        """
+        ids = set(ids)
+        for id1, id2, score in self.edges_many(ids):
+            if id1 in ids and id2 in ids and \
+                    (min_score is None or score >= min_score):
+                yield id1, id2, score
+
     def extract_network(self, ids):
         """
         """
         from Orange import network
 
+        ids = list(ids)
+        synonyms = self.synonyms_many(ids)
+
         graph = network.Graph()
         for id in ids:
-            graph.add_node(id, synonyms=",".join(self.synonyms(id)))
+            graph.add_node(id, synonyms=",".join(synonyms[id]))
 
-        for id in ids:
-            edges = self.edges(id)
+        for id1, id2, score in self.edges_many(ids):
+            graph.add_edge(id1, id2, weight=score)
 
-            for id1, id2, score in edges:
-                graph.add_edge(id1, id2, weight=score)
+        return graph
 
+    def graph(self, taxid=None):
+        """
+        Return the network of all edges (of organism `taxid`) as a
+        :obj:`PPIGraph`. For databases stored in a file, the network is
+        saved into a snapshot next to it and memory mapped on later
+        calls (until the database file changes).
+
+        """
+        graphs = self.__dict__.setdefault("_graphs", {})
+        if taxid in graphs:
+            return graphs[taxid]
+
+        filename = getattr(self, "filename", None)
+        if filename is None:
+            graph = PPIGraph.from_edges(self.all_edges(taxid))
+        else:
+            path = "{}.graph.{}".format(filename, taxid or "all")
+            stat = os.stat(filename)
+            meta = {"size": stat.st_size, "mtime": stat.st_mtime}
+            try:
+                graph, saved_meta = PPIGraph.load(path)
+                if saved_meta != meta:
+                    graph = None
+            except (IOError, OSError, ValueError, KeyError):
+                graph = None
+            if graph is None:
+                graph = PPIGraph.from_edges(self.all_edges(taxid))
+                try:
+                    graph.save(path, meta)
+                except (IOError, OSError):
+                    pass  # the snapshot is optional
+
+        graphs[taxid] = graph
         return graph
 
+    def neighborhood(self, ids, k=1, min_score=None, taxid=None):
+        """
+        Return a list of proteins at most `k` interactions (with at least
+        `min_score`) away from proteins in `ids`. See :obj:`graph`.
+        """
+        return self.graph(taxid).neighborhood(ids, k, min_score)
+
+    def threshold_subgraph(self, min_score, ids=None, taxid=None):
+        """
+        Return a :obj:`PPIGraph` with edges with at least `min_score`
+        among proteins in `ids` (all if None). See :obj:`graph`.
+        """
+        return self.graph(taxid).subgraph(ids, min_score)
+
+    def degree_statistics(self, min_score=None, taxid=None):
+        """
+        Return degree statistics of the network with edges with at least
+        `min_score` (see :obj:`PPIGraph.degree_statistics`).
+        """
+        return self.graph(taxid).degree_statistics(min_score)
+
     @classmethod
     def download_data(self):
         """
@@ -300,7 +640,7 @@ class BioGRID(PPIDatabase):
         """
         if taxid is not None:
             cur = self.db.execute("""\
-                select biogrid_id_interactor_a, biogrid_id_interactor_a, score
+                select biogrid_id_interactor_a, biogrid_id_interactor_b, score
                 from links left join proteins on
                     biogrid_id_interactor_a=biogrid_id_interactor or
                     biogrid_id_interactor_b=biogrid_id_interactor
@@ -308,7 +648,7 @@ class BioGRID(PPIDatabase):
             """, (taxid,))
         else:
             cur = self.db.execute("""\
-                select biogrid_id_interactor_a, biogrid_id_interactor_a, score
+                select biogrid_id_interactor_a, biogrid_id_interactor_b, score
                 from links
             """)
         edges = cur.fetchall()
@@ -328,6 +668,44 @@ class BioGRID(PPIDatabase):
         """, (id, id))
         return cur.fetchall()
 
+    def edges_many(self, ids):
+        """
+        Return an iterator over all interactions where a protein in
+        `ids` is a participant (each interaction is reported once).
+
+        """
+        with _temp_table(self.db, ((id,) for id in ids)) as table:
+            cur = self.db.execute("""\
+                select biogrid_id_interactor_a, biogrid_id_interactor_b, score
+                from {table} join links
+                    on biogrid_id_interactor_a={table}.id
+                union all
+                select biogrid_id_interactor_a, biogrid_id_interactor_b, score
+                from {table} join links
+                    on biogrid_id_interactor_b={table}.id
+                where biogrid_id_interactor_a not in (select id from {table})
+            """.format(table=table))
+            for edge in _stream(cur):
+                yield edge
+
+    def subnetwork(self, ids, min_score=None):
+        """
+        Return an iterator over interactions among proteins in `ids`.
+        If `min_score` is not ``None`` only return interactions with at
+        least this score.
+
+        """
+        with _temp_table(self.db, ((id,) for id in ids)) as table:
+            cur = self.db.execute("""\
+                select biogrid_id_interactor_a, biogrid_id_interactor_b, score
+                from {table} join links
+                    on biogrid_id_interactor_a={table}.id
+                where biogrid_id_interactor_b in (select id from {table})
+                      and (? is null or score >= ?)
+            """.format(table=table), (min_score, min_score))
+            for edge in _stream(cur):
+                yield edge
+
     def all_edges_annotated(self, taxid=None):
         """
         Return a list of all edges annotated. If taxid is not None
@@ -671,7 +1049,7 @@ class STRING(PPIDatabase):
                 """, (taxid,))
         else:
             cur = self.db.execute("""\
-                select protein_id1, protein_id1, score
+                select protein_id1, protein_id2, score
                 from links
                 """)
         return cur.fetchall()
@@ -687,11 +1065,39 @@ class STRING(PPIDatabase):
             """, (id,))
         return cur.fetchall()
 
+    def edges_many(self, ids):
+        """
+        Return an iterator over all edges (3-tuples (id1, id2, score)) of
+        proteins in `ids`. The edges are retrieved with a single query.
+
+        """
+        with _temp_table(self.db, ((id,) for id in ids)) as table:
+            cur = self.db.execute("""\
+                select links.protein_id1, links.protein_id2, links.score
+                from {table} join links on links.protein_id1={table}.id
+                """.format(table=table))
+            for edge in _stream(cur):
+                yield edge
+
+    def subnetwork(self, ids, min_score=None):
+        """
+        Return an iterator over edges (3-tuples (id1, id2, score)) among
+        proteins in `ids`. If `min_score` is not ``None`` only return
+        edges with at least this combined score.
+
+        """
+        with _temp_table(self.db, ((id,) for id in ids)) as table:
+            cur = self.db.execute("""\
+                select links.protein_id1, links.protein_id2, links.score
+                from {table} join links on links.protein_id1={table}.id
+                where links.protein_id2 in (select id from {table})
+                      and (? is null or links.score >= ?)
+                """.format(table=table), (min_score, min_score))
+            for edge in _stream(cur):
+                yield edge
+
     def all_edges_annotated(self, taxid=None):
-        res = []
-        for id in self.ids(taxid):
-            res.extend(self.edges_annotated(id))
-        return res
+        return list(self.edges_annotated_many(self.ids(taxid)))
 
     def edges_annotated(self, id):
         cur = self.db.execute("""\
@@ -704,6 +1110,38 @@ class STRING(PPIDatabase):
         """, (id,))
         return map(STRINGInteraction._make, cur.fetchall())
 
+    def edges_annotated_many(self, ids):
+        """
+        Return an iterator over annotated edges (see `edges_annotated`)
+        of all proteins in `ids`.
+        """
+        with _temp_table(self.db, ((id,) for id in ids)) as table:
+            cur = self.db.execute("""\
+                select links.protein_id1, links.protein_id2, links.score,
+                       actions.action, actions.mode, actions.score
+                from {table} join links on links.protein_id1={table}.id
+                     left join actions on
+                       links.protein_id1=actions.protein_id1 and
+                       links.protein_id2=actions.protein_id2
+                """.format(table=table))
+            for edge in _stream(cur):
+                yield STRINGInteraction._make(edge)
+
+    def synonyms_many(self, ids):
+        """
+        Return a dictionary mapping primary ids in `ids` to lists of
+        their synonyms (see `synonyms`).
+        """
+        res = dict((id, []) for id in ids)
+        with _temp_table(self.db, ((id,) for id in res)) as table:
+            cur = self.db.execute("""\
+                select aliases.protein_id, aliases.alias
+                from {table} join aliases on aliases.protein_id={table}.id
+                """.format(table=table))
+            for id, alias in _stream(cur):
+                res[id].append(alias)
+        return res
+
     def search_id(self, name, taxid=None):
         if taxid is None:
             cur = self.db.execute("""\
@@ -719,6 +1157,25 @@ class STRING(PPIDatabase):
             """, (name, taxid))
         return map(itemgetter(0), cur)
 
+    def search_ids(self, names, taxid=None):
+        """
+        Search the database for protein names. Return a dictionary
+        mapping names to lists of matching primary ids. Use `taxid` to
+        limit the results to a single organism.
+
+        """
+        res = dict((name, []) for name in names)
+        with _temp_table(self.db, ((name,) for name in res)) as table:
+            cur = self.db.execute("""\
+                select {table}.id, proteins.protein_id
+                from {table} join aliases on aliases.alias={table}.id
+                     join proteins on proteins.protein_id=aliases.protein_id
+                where ? is null or proteins.taxid=?
+                """.format(table=table), (taxid, taxid))
+            for name, id in _stream(cur):
+                res[name].append(id)
+        return res
+
     @classmethod
     def download_data(cls, version, taxids=None):
         """
@@ -994,25 +1451,26 @@ class STRINGDetailed(STRING):
         self.db_detailed.execute("ATTACH DATABASE ? as string", (db_file,))
 
     def edges_annotated(self, id):
-        edges = STRING.edges_annotated(self, id)
-        edges_nc = []
-        for edge in edges:
-            id1, id2 = edge.protein_id1, edge.protein_id2
-            cur = self.db_detailed.execute("""
-                SELECT neighborhood, fusion, cooccurence, coexpression,
-                       experimental, database, textmining
-                FROM evidence
-                WHERE protein_id1=? AND protein_id2=?
-                """, (id1, id2))
-            res = cur.fetchone()
-            if res:
-                evidence = res
-            else:
-                evidence = [0] * 7
-            edges_nc.append(
-                STRINGDetailedInteraction(*(tuple(edge) + tuple(evidence)))
-            )
-        return edges_nc
+        return list(self.edges_annotated_many([id]))
+
+    def edges_annotated_many(self, ids):
+        edges = STRING.edges_annotated_many(self, ids)
+        for chunk in _chunks(edges, 10000):
+            pairs = [(edge.protein_id1, edge.protein_id2) for edge in chunk]
+            with _temp_table(self.db_detailed, pairs,
+                             ("protein_id1", "protein_id2")) as table:
+                cur = self.db_detailed.execute("""
+                    SELECT evidence.protein_id1, evidence.protein_id2,
+                           neighborhood, fusion, cooccurence, coexpression,
+                           experimental, database, textmining
+                    FROM {table} JOIN evidence ON
+                         evidence.protein_id1={table}.protein_id1 AND
+                         evidence.protein_id2={table}.protein_id2
+                    """.format(table=table))
+                evidence = dict((tuple(r[:2]), tuple(r[2:])) for r in cur)
+            for edge, pair in zip(chunk, pairs):
+                edge_evidence = evidence.get(pair, (0,) * 7)
+                yield STRINGDetailedInteraction(*(tuple(edge) + edge_evidence))
 
     @classmethod
     def init_db(cls, version, taxid, cache_dir=None, dbfilename=None):
@@ -0,0 +1,271 @@
+import unittest
+import os
+import shutil
+import tempfile
+import pickle
+
+import numpy
+
+from orangecontrib.bio import gene
+
+
+ALIASES = [set(["BRCA1", "672", "RNF53"]), set(["brca2", "675", "FANCD1"]),
+           set(["TP53", "7157", "p53"]), set(["P53", "LFS1"]),
+           set(["Abc", "ABC", "x1"])]
+
+
+class MatcherAliasesTest(gene.MatcherAliasesPickled):
+    def __init__(self, filename, ignore_case=True, version="v1",
+                 aliases=ALIASES):
+        self.filename_ = filename
+        self.version = version
+        self.created = 0
+        self.source = aliases
+        gene.MatcherAliasesPickled.__init__(self, ignore_case=ignore_case)
+
+    def filename(self):
+        if os.path.isabs(self.filename_):
+            return (self.filename_,)
+        return self.filename_
+
+    def create_aliases_version(self):
+        return self.version
+
+    def create_aliases(self):
+        self.created += 1
+        return [set(a) for a in self.source]
+
+
+GENE_INFO = [
+    "#tax_id\tGeneID\tSymbol\t...",
+    "9606\t672\tBRCA1\t-\tBRCAI|RNF53\tMIM:113705\t17\t17q21\tBRCA1, DNA repair associated\tprotein-coding\tBRCA1\tbreast cancer 1\tO\t-\t20160101",
+    "9606\t7157\tTP53\t-\tp53|LFS1\tMIM:191170\t17\t17p13.1\ttumor protein p53\tprotein-coding\tTP53\ttumor protein p53\tO\tcellular tumor antigen p53\t20160102\tnew",
+    "9606\t675\tBRCA2\tLT2\t-\t-\t13\t13q13.1\tBRCA2, DNA repair associated\tprotein-coding\t-\t-\t-\t-\t20160103",
+]
+
+
+class TestNCBIGeneInfo(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "gene_info.9606.db")
+        with open(self.filename, "w") as f:
+            f.write("\n".join(GENE_INFO) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_table(self):
+        info = gene.NCBIGeneInfo.load(self.filename)
+        self.assertTrue(os.path.isdir(self.filename + ".table"))
+        self.assertEqual(info.keys(), ["672", "7157", "675"])
+        self.assertEqual(len(info), 3)
+        for line in GENE_INFO[1:]:
+            expected = gene.GeneInfo(line)
+            got = info[line.split("\t")[1]]
+            for tag in gene.GeneInfo.NCBI_GENEINFO_TAGS:
+                self.assertEqual(getattr(got, tag), getattr(expected, tag))
+        self.assertNotIn("1", info)
+        self.assertNotIn(672, info)
+        self.assertIsNone(info.get("1"))
+
+        # the saved table is memory mapped and columns are loaded lazily
+        info = gene.NCBIGeneInfo.load(self.filename)
+        self.assertEqual(info.table._columns, {})
+        self.assertEqual(info.table.column("symbol"), ["BRCA1", "TP53", "BRCA2"])
+        self.assertEqual(list(info.table._columns), ["symbol"])
+        self.assertIsInstance(info.table.column_arrays("symbol")[0],
+                              numpy.memmap)
+        self.assertEqual(info["7157"].synonyms, ["p53", "LFS1"])
+
+    def test_search_and_match(self):
+        with open(self.filename, "rb") as f:
+            info = gene.NCBIGeneInfo.load(f)
+        self.assertEqual(info.search("LFS1"), ["7157"])
+        self.assertEqual(info.search("LT2"), ["675"])
+        self.assertEqual(info.search("lfs1"), [])
+        self.assertEqual(info.get_info("675").symbol, "BRCA2")
+        self.assertIsNone(info.get_info("BRCA2"))
+
+        info = gene.NCBIGeneInfo.load(self.filename,
+                                      genematcher=gene.MatcherAliases(ALIASES))
+        self.assertFalse(info._matcher_targets)
+        self.assertEqual(info.get_info("FANCD1").symbol, "BRCA2")
+        self.assertEqual(info("RNF53").gene_id, "672")
+
+        info["1"] = info["672"]
+        self.assertEqual(len(info), 4)
+        self.assertEqual(info.keys()[-1], "1")
+
+
+class TestAliasIndex(unittest.TestCase):
+    GENES = ["BRCA1", "brca1", "Brca2", "p53", "P53", "lfs1", "abc", "ABC",
+             "x1", "unknown", "", "675"]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "aliases")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_from_groups(self):
+        for lower in [False, True]:
+            index = gene.AliasIndex.from_groups(ALIASES, lower=lower)
+            mapping = gene.create_mapping(ALIASES, lower=lower)
+            self.assertEqual(len(index), len(mapping))
+            for alias in list(mapping) + self.GENES:
+                self.assertEqual(index[alias], set(mapping.get(alias, ())))
+
+    def test_matcher(self):
+        targets = ["BRCA1", "FANCD1", "TP53", "lfs1", "abc", "other"]
+        for ignore_case in [False, True]:
+            matcher = MatcherAliasesTest(self.filename, ignore_case)
+            reference = gene.MatcherAliases(ALIASES, ignore_case)
+            match = matcher.set_targets(targets)
+            ref_match = reference.set_targets(targets)
+            for g in self.GENES:
+                self.assertEqual(matcher.to_ids(g), reference.to_ids(g))
+                self.assertEqual(sorted(match.match(g)),
+                                 sorted(ref_match.match(g)))
+                self.assertEqual(match.umatch(g), ref_match.umatch(g))
+
+    def test_saved_index(self):
+        matcher = MatcherAliasesTest(self.filename)
+        matcher.set_targets(["BRCA1"])
+        index_path = self.filename + ".ic.index"
+        self.assertTrue(os.path.isdir(index_path))
+        self.assertEqual(matcher.created, 1)
+
+        # the saved index is memory mapped; aliases are not loaded
+        matcher = MatcherAliasesTest(self.filename)
+        self.assertEqual(matcher.set_targets(["BRCA1"]).match("672"),
+                         ["BRCA1"])
+        self.assertIsInstance(matcher.alias_index().groups, numpy.memmap)
+        self.assertFalse(matcher.saved_aliases)
+
+        # a new version of aliases rebuilds the index
+        matcher = MatcherAliasesTest(self.filename, version="v2")
+        self.assertEqual(matcher.set_targets(["BRCA1"]).match("672"),
+                         ["BRCA1"])
+        self.assertEqual(matcher.created, 1)
+
+
+class TestJoin(unittest.TestCase):
+    SOURCES = [
+        [set(["a", "b"]), set(["c", "d"]), set(["d", "e"]), set(["x"])],
+        [set(["B", "f"]), set(["f", "g"]), set(["y"])],
+        [set(["g", "c"]), set(["z"])],
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = gene.gene_matcher_path
+        gene.gene_matcher_path = self.dir
+
+    def tearDown(self):
+        gene.gene_matcher_path = self.path
+        shutil.rmtree(self.dir)
+
+    def normalized(self, groups):
+        return sorted(sorted(g) for g in groups)
+
+    def test_join_components(self):
+        res = gene.join_components(self.SOURCES, lower=True)
+        # groups of the same source are only joined through other sources
+        self.assertEqual(self.normalized(res),
+                         [["B", "a", "b", "f"], ["c", "d", "f", "g"],
+                          ["d", "e"], ["x"], ["y"], ["z"]])
+        res = gene.join_components(self.SOURCES, lower=False)
+        self.assertEqual(self.normalized(res),
+                         [["B", "f"], ["a", "b"], ["c", "d", "f", "g"],
+                          ["d", "e"], ["x"], ["y"], ["z"]])
+
+    def test_incremental(self):
+        joiner = gene.AliasJoiner(lower=True)
+        joiner.add(self.SOURCES[0]).add(self.SOURCES[1])
+        self.assertNotIn("keys", joiner.__getstate__())
+        joiner = pickle.loads(pickle.dumps(joiner))
+        joiner.add(self.SOURCES[2])
+        self.assertEqual(
+            self.normalized(joiner.components()),
+            self.normalized(gene.join_components(self.SOURCES, lower=True)))
+
+    def test_joined_matcher(self):
+        matchers = [MatcherAliasesTest("src%d" % i, aliases=src)
+                    for i, src in enumerate(self.SOURCES)]
+        joined = gene.MatcherAliasesPickledJoined(matchers[:2])
+        self.assertEqual(joined.set_targets(["a", "g"]).match("B"), ["a"])
+        self.assertEqual(joined.set_targets(["a", "g"]).match("c"), [])
+        self.assertTrue(any(f.endswith(".joiner")
+                            for f in os.listdir(self.dir)))
+
+        joined.add_matcher(matchers[2])
+        self.assertEqual(joined.set_targets(["a", "g"]).match("c"), ["g"])
+        self.assertEqual(sorted(joined.set_targets(["z", "y"]).match("z")),
+                         ["z"])
+        self.assertEqual(
+            self.normalized(joined.aliases),
+            self.normalized(gene.join_components(self.SOURCES, lower=True)))
+
+        # joins of all prefixes are saved as union-find parents only
+        ok, parent = gene.load_pickled(*joined._joiner_pickle(matchers[:2]))
+        self.assertTrue(ok)
+        self.assertEqual(parent.shape, (7,))
+        self.assertTrue(gene.load_pickled(*joined._joiner_pickle(matchers))[0])
+
+        # the cached join of the first two sources is reused; their groups
+        # are loaded from their pickles
+        fresh = [MatcherAliasesTest("src0", aliases=self.SOURCES[0]),
+                 MatcherAliasesTest("src1", aliases=self.SOURCES[1]),
+                 MatcherAliasesTest("other", aliases=[set(["x", "w"])])]
+        joined = gene.MatcherAliasesPickledJoined(fresh)
+        self.assertEqual(joined.set_targets(["a", "w"]).match("x"), ["w"])
+        self.assertEqual(joined.set_targets(["a", "g"]).match("B"), ["a"])
+        self.assertEqual([m.created for m in fresh], [0, 0, 1])
+
+
+class TestMatchMany(unittest.TestCase):
+    GENES = ["BRCA1", "brca1", "672", "p53", "P53", "lfs1", "abc", "x1",
+             "unknown", "FANCD1", "672", "Other", "other"]
+    TARGETS = ["BRCA1", "rnf53", "TP53", "LFS1", "ABC", "Abc", "other",
+               "BRCA1"]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "aliases")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, matcher):
+        match = matcher.set_targets(iter(self.TARGETS))
+        targets = match.targets
+        self.assertEqual(targets, ["BRCA1", "rnf53", "TP53", "LFS1", "ABC",
+                                   "Abc", "other"])
+        matches = match.match_many(self.GENES)
+        self.assertEqual(len(matches), len(self.GENES))
+        for g, m in zip(self.GENES, matches):
+            self.assertEqual(sorted(targets[i] for i in m),
+                             sorted(match.match(g)))
+        umatches = match.umatch_many(self.GENES)
+        self.assertEqual([targets[i] if i >= 0 else None for i in umatches],
+                         [match.umatch(g) for g in self.GENES])
+        self.assertEqual(matcher.umatch_many(self.GENES).tolist(),
+                         umatches.tolist())
+        self.assertEqual(match.match_many([]), [])
+        self.assertEqual(len(match.umatch_many([])), 0)
+
+    def test_matchers(self):
+        for ignore_case in [False, True]:
+            self.check(gene.MatcherAliases(ALIASES, ignore_case))
+            self.check(MatcherAliasesTest(self.filename, ignore_case))
+            self.check(gene.MatcherDirect(ignore_case))
+            self.check(gene.MatcherSequence(
+                [gene.MatcherDirect(ignore_case),
+                 MatcherAliasesTest(self.filename, ignore_case)]))
+            self.check(gene.matcher([gene.MatcherAliases(ALIASES, ignore_case)],
+                                    ignore_case=ignore_case))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+import gzip
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from orangecontrib.bio import geo
+
+
+SOFT = """^DATABASE = Geo
+!Database_name = Gene Expression Omnibus (GEO)
+^DATASET = GDS1
+!dataset_title = Test data set
+!dataset_sample_organism = Homo sapiens
+!dataset_sample_count = 3
+!dataset_feature_count = 4
+^SUBSET = GDS1_1
+!subset_dataset_id = GDS1
+!subset_description = control
+!subset_sample_id = GSM1,GSM2
+!subset_type = agent
+^SUBSET = GDS1_2
+!subset_dataset_id = GDS1
+!subset_description = drug
+!subset_sample_id = GSM3
+!subset_type = agent
+^DATASET = GDS1
+#ID_REF = Platform reference identifier
+#IDENTIFIER = identifier
+!dataset_table_begin
+ID_REF\tIDENTIFIER\tGSM1\tGSM2\tGSM3
+s1\tA\t1.5\t2\tnull
+s2\tB\t3\t4\t5
+s3\tA\tnull\tnull\t0.25
+s4\tC\t-1\t0\t1
+!dataset_table_end
+"""
+
+
+class TestSoft(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "GDS1.soft.gz")
+        with gzip.open(self.filename, "wb") as f:
+            f.write(SOFT.encode("utf-8"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, info, spots, genes, values):
+        self.assertEqual(info["dataset_id"], "GDS1")
+        self.assertEqual(info["sample_organism"], "Homo sapiens")
+        self.assertEqual(info["sample_count"], 3)
+        self.assertEqual(info["samples"], ["GSM1", "GSM2", "GSM3"])
+        self.assertEqual(
+            info["subsets"],
+            [{"id": "GDS1_1", "description": "control", "type": "agent",
+              "sample_id": ["GSM1", "GSM2"]},
+             {"id": "GDS1_2", "description": "drug", "type": "agent",
+              "sample_id": ["GSM3"]}])
+        self.assertEqual(spots, ["s1", "s2", "s3", "s4"])
+        self.assertEqual(genes, ["A", "B", "A", "C"])
+        self.assertEqual(values.dtype, numpy.float32)
+        numpy.testing.assert_equal(
+            values, [[1.5, 2, numpy.nan], [3, 4, 5],
+                     [numpy.nan, numpy.nan, 0.25], [-1, 0, 1]])
+
+    def test_parse_soft(self):
+        self.check(*geo.parse_soft(self.filename))
+
+    def test_load_soft_cache(self):
+        self.check(*geo.load_soft(self.filename))
+        npypath, jsonpath = geo._soft_cache_paths(self.filename)
+        self.assertTrue(os.path.exists(npypath))
+        self.assertTrue(os.path.exists(jsonpath))
+
+        info, spots, genes, values = geo.load_soft(self.filename)
+        self.assertIsInstance(values, numpy.memmap)
+        self.check(info, spots, genes, values)
+
+        # a changed SOFT file invalidates the cache
+        with gzip.open(self.filename, "wb") as f:
+            f.write(SOFT.replace("s4\tC", "s5\tD").encode("utf-8"))
+        info, spots, genes, values = geo.load_soft(self.filename)
+        self.assertEqual(spots[-1], "s5")
+        self.assertEqual(genes[-1], "D")
+
+    def test_gds_data(self):
+        # GDS without its constructor, which needs the taxonomy
+        gds = geo.GDS.__new__(geo.GDS)
+        gds.info, gds._spots, gds._spot_genes, gds._values = \
+            geo.parse_soft(self.filename)
+        gds._parse_soft(remove_unknown=0.5)
+        self.assertEqual(sorted(gds.gdsdata), ["s1", "s2", "s4"])
+        data = gds.gdsdata["s2"].data
+        self.assertIsInstance(data, list)
+        self.assertEqual(data, [3.0, 4.0, 5.0])
+        self.assertTrue(all(type(v) is float for v in data))
+
+
+class TestMergeSpots(unittest.TestCase):
+    def test_merge_spots(self):
+        nan = numpy.nan
+        values = numpy.array([[1, nan, 3], [2, nan, nan], [5, 6, 7],
+                              [nan, nan, 1], [0, 4, 2], [8, nan, 2]])
+        sizes = [2, 1, 3]
+        custom = lambda x: len([v for v in x if not numpy.isnan(v)])
+        for merge in [geo.spots_mean, geo.spots_median, geo.spots_min,
+                      geo.spots_max, custom]:
+            expected = []
+            start = 0
+            for size in sizes:
+                group = values[start:start + size]
+                expected.append([merge(tuple(col)) for col in group.T])
+                start += size
+            numpy.testing.assert_equal(
+                geo.merge_spots(values, sizes, merge), expected)
+        self.assertEqual(geo.merge_spots(values[:0], []).shape, (0, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
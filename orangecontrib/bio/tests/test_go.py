@@ -0,0 +1,364 @@
+import unittest
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import warnings
+
+from six import StringIO
+
+from orangecontrib.bio import go
+from orangecontrib.bio.utils import stats
+
+
+ONTOLOGY = """format-version: 1.2
+
+[Term]
+id: GO:0000001
+name: root
+namespace: biological_process
+
+[Term]
+id: GO:0000002
+name: a
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000003
+name: b
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000004
+name: ab
+is_a: GO:0000002 ! a
+relationship: part_of GO:0000003 ! b
+
+[Term]
+id: GO:0000005
+name: c
+alt_id: GO:0000015
+is_a: GO:0000004 ! ab
+
+[Term]
+id: GO:0000006
+name: d
+is_a: GO:0000003 ! b
+
+"""
+
+ANNOTATIONS = [
+    ("g1", "GO:0000005", "IDA", "P"),
+    ("g1", "GO:0000002", "IEA", "P"),
+    ("g2", "GO:0000004", "IMP", "P"),
+    ("g3", "GO:0000006", "IEA", "P"),
+    ("g3", "GO:0000002", "IDA", "F"),
+    ("g4", "GO:0000015", "TAS", "P"),
+    ("g5", "GO:0000003", "IDA", "P"),
+    ("g6", "GO:0000006", "IDA", "C"),
+    ("g7", "GO:9999999", "IDA", "P"),
+]
+
+
+def gaf_line(gene, term, evidence, aspect):
+    fields = [""] * len(go.annotationFields)
+    fields[go.annotationFields.index("DB_Object_ID")] = gene.upper()
+    fields[go.annotationFields.index("DB_Object_Symbol")] = gene
+    fields[go.annotationFields.index("GO_ID")] = term
+    fields[go.annotationFields.index("Evidence_Code")] = evidence
+    fields[go.annotationFields.index("Aspect")] = aspect
+    fields[go.annotationFields.index("DB_Object_Synonym")] = gene + "_syn"
+    return "\t".join(fields)
+
+
+def enriched_terms_naive(annotations, genes, reference, evidence_codes,
+                         aspects, prob):
+    # A straightforward per term reimplementation used as a reference.
+    genes = set(genes)
+    reference = set(reference)
+    refannots = set(ann for gene in reference
+                    for ann in annotations.gene_annotations[gene]
+                    if ann.Evidence_Code in evidence_codes and
+                    ann.Aspect in aspects)
+    direct = set(ann.GO_ID for gene in genes
+                 for ann in annotations.gene_annotations[gene]
+                 if ann.Evidence_Code in evidence_codes and
+                 ann.Aspect in aspects and ann.GO_ID in annotations.ontology)
+    res = {}
+    for term in annotations.ontology.extract_super_graph(direct):
+        annots = annotations.get_all_annotations(term) & refannots
+        annotated = set(ann.geneName for ann in annots)
+        mapped = genes & annotated
+        refmapped = reference & annotated
+        res[term] = (sorted(mapped),
+                     prob.p_value(len(mapped), len(reference),
+                                  len(refmapped), len(genes)),
+                     len(refmapped))
+    return res
+
+
+class TestOntology(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+
+    def test_closure(self):
+        o = self.ontology
+        self.assertEqual(o.extract_super_graph("GO:0000005"),
+                         set(["GO:0000001", "GO:0000002", "GO:0000003",
+                              "GO:0000004", "GO:0000005"]))
+        self.assertEqual(o.extract_super_graph(["GO:0000015", "GO:0000006"]),
+                         set(["GO:0000001", "GO:0000002", "GO:0000003",
+                              "GO:0000004", "GO:0000015", "GO:0000006"]))
+        self.assertEqual(o.extract_sub_graph(["GO:0000003"]),
+                         set(["GO:0000003", "GO:0000004", "GO:0000005",
+                              "GO:0000006"]))
+        self.assertEqual(o.extract_sub_graph("GO:0000005"),
+                         set(["GO:0000005"]))
+        self.assertEqual(o.extract_super_graph([]), set())
+        self.assertRaises(KeyError, o.extract_super_graph, ["GO:9999999"])
+
+    def test_term_depth(self):
+        o = self.ontology
+        self.assertEqual([o.term_depth("GO:%07d" % i) for i in range(1, 7)],
+                         [1, 2, 2, 3, 4, 3])
+        self.assertEqual(o.term_depth("GO:0000015"), 4)
+        # depths are not shared between ontologies
+        other = go.Ontology(StringIO(ONTOLOGY.replace(
+            "is_a: GO:0000004 ! ab", "is_a: GO:0000001 ! root")))
+        self.assertEqual(other.term_depth("GO:0000005"), 2)
+        self.assertEqual(o.term_depth("GO:0000005"), 4)
+
+
+class TestOntologySnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "gene_ontology_edit.obo.tar.gz")
+        self.write(ONTOLOGY)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        with tarfile.open(self.filename, "w:gz") as tar:
+            info = tarfile.TarInfo("gene_ontology_edit.obo")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    def check(self, o):
+        self.assertEqual(sorted(o.terms),
+                         ["GO:%07d" % i for i in range(1, 7)])
+        self.assertEqual(o["GO:0000015"].name, "c")
+        self.assertEqual(o["GO:0000004"].related,
+                         set([("is_a", "GO:0000002"),
+                              ("part_of", "GO:0000003")]))
+        self.assertEqual(o["GO:0000003"].related_to,
+                         set([("part_of", "GO:0000004"),
+                              ("is_a", "GO:0000006")]))
+        self.assertEqual(o.reverse_alias_mapper["GO:0000005"],
+                         set(["GO:0000015"]))
+        self.assertIn("is_a", o.typedefs)
+        self.assertTrue(o.header.startswith("format-version: 1.2"))
+        self.assertEqual(o.term_depth("GO:0000005"), 4)
+
+    def test_snapshot(self):
+        progress = []
+        self.check(go.Ontology(self.filename,
+                               progress_callback=progress.append))
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 100)
+        self.assertTrue(os.path.exists(self.filename + ".snapshot"))
+
+        o = go.Ontology(self.filename)
+        # terms are constructed only when accessed
+        self.assertEqual(o.terms._terms, {})
+        self.assertEqual(o.extract_super_graph(["GO:0000006"]),
+                         set(["GO:0000001", "GO:0000003", "GO:0000006"]))
+        self.assertEqual(o.terms._terms, {})
+        # alternative ids are restored without scanning the stanzas
+        self.assertEqual(o.alias_mapper, {"GO:0000015": "GO:0000005"})
+        self.assertEqual(o["GO:0000015"].id, "GO:0000005")
+        self.check(o)
+
+        # a changed file is parsed again
+        self.write(ONTOLOGY.replace("name: d", "name: changed"))
+        o = go.Ontology(self.filename)
+        self.assertEqual(o["GO:0000006"].name, "changed")
+
+    def test_parse(self):
+        o = go.Ontology(StringIO(ONTOLOGY.rstrip("\n")))
+        self.check(o)
+        self.assertEqual(len(o), 6)
+
+
+class TestAnnotations(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+        self.annotations = go.Annotations(ontology=self.ontology)
+        self.lines = [gaf_line(*a) for a in ANNOTATIONS]
+        self.annotations.parse_file(StringIO(
+            "!gaf-version: 2.0\n" + "\n".join(self.lines) + "\n" +
+            gaf_line("g9", "", "IDA", "P")))
+
+    def test_records(self):
+        a = self.annotations
+        records = [go.AnnotationRecord.from_string(l) for l in self.lines]
+        self.assertEqual(len(a), len(records))
+        self.assertEqual(list(a), records)
+        self.assertEqual(a[1], records[1])
+        self.assertEqual(a[-1], records[-1])
+        self.assertEqual(a.annotations[2:4], records[2:4])
+        self.assertIn(records[3], a)
+        self.assertRaises(IndexError, lambda: a[len(records)])
+        self.assertEqual(a.header, "!gaf-version: 2.0\n")
+
+        self.assertEqual(a.gene_annotations["g3"], records[3:5])
+        self.assertEqual(a.gene_annotations["g9"], [])
+        self.assertNotIn("g9", a.gene_annotations)
+        self.assertEqual(sorted(a.gene_annotations),
+                         ["g%d" % i for i in range(1, 8)])
+        self.assertEqual(a.term_anotations["GO:0000006"],
+                         [records[3], records[7]])
+        self.assertEqual(a.gene_names, set("g%d" % i for i in range(1, 8)))
+        self.assertEqual(a.alias_mapper["G3"], "g3")
+        self.assertEqual(a.alias_mapper["g3_syn"], "g3")
+
+        a.add_annotation(records[0]._replace(DB_Object_Symbol="g8"))
+        self.assertEqual(len(a), len(records) + 1)
+        self.assertEqual(a.gene_annotations["g8"][0].GO_ID, "GO:0000005")
+
+    def test_parse_gzip(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "gene_association.gz")
+            with gzip.open(filename, "wb") as f:
+                f.write(("\r\n".join(self.lines * 3000) + "\r\n\r\n")
+                        .encode("utf-8"))
+            progress = []
+            a = go.Annotations(filename, ontology=self.ontology,
+                               progress_callback=progress.append)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(len(a), len(self.lines) * 3000)
+        self.assertEqual(a[-1], self.annotations[-1])
+        self.assertEqual(progress, sorted(progress))
+        self.assertGreater(len(progress), 2)
+        self.assertEqual(progress[-1], 100)
+
+    def test_all_annotations(self):
+        a = self.annotations
+        self.assertEqual(
+            a.get_all_annotations("GO:0000004"),
+            set(ann for ann in a if ann.GO_ID in
+                ["GO:0000004", "GO:0000005", "GO:0000015"]))
+        self.assertEqual(sorted(a.get_all_genes("GO:0000003")),
+                         ["g1", "g2", "g3", "g4", "g5", "g6"])
+        self.assertEqual(sorted(a.get_all_genes("GO:0000003", ["IDA"])),
+                         ["g1", "g5", "g6"])
+
+
+class TestEnrichment(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+        self.annotations = go.Annotations(ontology=self.ontology)
+        self.annotations.parse_file(
+            StringIO("\n".join(gaf_line(*a) for a in ANNOTATIONS)))
+
+    def assertResultsEqual(self, res, expected):
+        for term in expected:
+            self.assertIn(term, res)
+            genes, p, ref = res[term]
+            egenes, ep, eref = expected[term]
+            self.assertEqual(sorted(genes), egenes)
+            self.assertAlmostEqual(p, ep)
+            self.assertEqual(ref, eref)
+
+    def test_enriched_terms(self):
+        a = self.annotations
+        prob = stats.Binomial()
+        codes = set(go.evidenceDict.keys())
+        for genes in [["g1"], ["g1", "g2"], ["g2", "g3", "g6"],
+                      ["g4", "g5"], list(a.gene_names)]:
+            res = a.get_enriched_terms(genes, use_fdr=False, prob=prob)
+            expected = enriched_terms_naive(
+                a, genes, a.gene_names, codes, set("PFC"), prob)
+            self.assertResultsEqual(res, expected)
+            self.assertTrue(set(res) - set(expected) <=
+                            set(["GO:0000005", "GO:0000015"]))
+
+    def test_enriched_terms_filters(self):
+        a = self.annotations
+        prob = stats.Hypergeometric()
+        genes = ["g1", "g3", "g4"]
+        reference = ["g1", "g2", "g3", "g4", "g6"]
+        res = a.get_enriched_terms(genes, reference, evidence_codes=["IDA"],
+                                   aspect="P", use_fdr=False, prob=prob)
+        expected = enriched_terms_naive(
+            a, genes, reference, set(["IDA"]), set(["P"]), prob)
+        self.assertEqual(set(res), set(expected))
+        self.assertResultsEqual(res, expected)
+
+        res = a.get_enriched_terms(genes, reference, aspect=["P", "F"],
+                                   use_fdr=False, prob=prob)
+        self.assertEqual(res["GO:0000002"][2], 4)
+
+    def test_enriched_terms_aliases(self):
+        res = self.annotations.get_enriched_terms(
+            ["g1_syn", "G2"], use_fdr=False)
+        self.assertEqual(sorted(res["GO:0000004"][0]), ["G2", "g1_syn"])
+        self.assertEqual(res["GO:0000004"][2], 3)
+
+    def test_enriched_terms_fdr(self):
+        a = self.annotations
+        raw = a.get_enriched_terms(["g1", "g3"], use_fdr=False)
+        res = a.get_enriched_terms(["g1", "g3"])
+        self.assertEqual(set(raw), set(res))
+        terms = sorted(raw, key=lambda t: raw[t][1])
+        fdr = stats.FDR([raw[t][1] for t in terms])
+        for term, p in zip(terms, fdr):
+            self.assertAlmostEqual(res[term][1], p)
+
+    def test_index_invalidation(self):
+        a = self.annotations
+        res = a.get_enriched_terms(["g5"], use_fdr=False)
+        self.assertEqual(res["GO:0000003"][2], 6)
+        a.add_annotation(gaf_line("g8", "GO:0000006", "IDA", "P"))
+        res = a.get_enriched_terms(["g5"], use_fdr=False)
+        self.assertEqual(res["GO:0000003"][2], 7)
+
+    def test_enriched_terms_many(self):
+        a = self.annotations
+        gene_lists = [["g1"], ["g1", "g2"], ["g2_syn", "g3", "g6"], [],
+                      ["g4", "g5"]]
+        reference = ["g1", "g2", "g3", "g4", "g5"]
+        for processes in [1, 2]:
+            progress = []
+            results = dict(a.get_enriched_terms_many(
+                gene_lists, reference, aspect="P", processes=processes,
+                progress_callback=progress.append))
+            self.assertEqual(progress[-1], 100)
+            self.assertEqual(sorted(results), list(range(len(gene_lists))))
+            for i, genes in enumerate(gene_lists):
+                expected = a.get_enriched_terms(genes, reference, aspect="P")
+                self.assertEqual(set(results[i]), set(expected))
+                self.assertResultsEqual(
+                    results[i],
+                    dict((term, (sorted(g), p, r))
+                         for term, (g, p, r) in expected.items()))
+
+    def test_unknown_terms_warning(self):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            self.annotations.get_enriched_terms(["g7"])
+        self.assertTrue(any("GO:9999999" in str(m.message) for m in w))
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            list(self.annotations.get_enriched_terms_many([["g1"], ["g7"]]))
+        self.assertEqual(
+            len([m for m in w if "GO:9999999" in str(m.message)]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
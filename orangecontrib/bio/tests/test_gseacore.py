@@ -0,0 +1,129 @@
+import unittest
+import random
+import multiprocessing
+
+import numpy
+
+from orangecontrib.bio.utils import gseacore
+
+
+class TestEnrichmentScores(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        self.n = 200
+        # ties in correlations test the order of equally ranked genes
+        self.lcor = numpy.array([round(rnd.gauss(0, 1), 1)
+                                 for _ in range(self.n)])
+        self.subsets = [rnd.sample(range(self.n), size)
+                        for size in [1, 2, 5, 15, 15, 40, 100, 199]]
+        self.subsets.append([3, 3, 7])  # repeated members
+
+    def ranked(self, lcor, rev2=None):
+        ordered = numpy.argsort(-lcor, kind="mergesort")
+        if rev2 is not None:
+            rev2 = numpy.argsort(ordered)
+        return [gseacore.enrichmentScoreRanked(subset, lcor, ordered,
+                                               rev2=rev2)[0]
+                for subset in self.subsets]
+
+    def test_batch(self):
+        membership = gseacore.genesetsMembership(self.subsets, self.n)
+        rankings = [self.lcor, -self.lcor, self.lcor[::-1]]
+        batch = gseacore.enrichmentScoresBatch(membership, rankings)
+        self.assertEqual(batch.shape, (len(rankings), len(self.subsets)))
+        for scores, lcor in zip(batch, rankings):
+            numpy.testing.assert_allclose(scores, self.ranked(lcor))
+            numpy.testing.assert_allclose(scores,
+                                          self.ranked(lcor, rev2=True))
+
+    def test_small_blocks(self):
+        membership = gseacore.genesetsMembership(self.subsets, self.n)
+        blocks = list(gseacore._membershipBlocks(membership, maxcells=100))
+        self.assertGreater(len(blocks), 1)
+        rows = numpy.sort(numpy.concatenate([b[0] for b in blocks]))
+        numpy.testing.assert_equal(rows, numpy.arange(len(self.subsets)))
+        for rows, index, mask in blocks:
+            for row, ind, m in zip(rows, index, mask):
+                self.assertEqual(sorted(ind[m]),
+                                 sorted(set(self.subsets[row])))
+
+    def test_zero_weights(self):
+        lcor = numpy.zeros(10)
+        lcor[:3] = [2.0, -1.0, 0.5]
+        membership = gseacore.genesetsMembership([[5, 6], [], [0, 6]], 10)
+        batch = gseacore.enrichmentScoresBatch(membership, lcor)
+        ordered = numpy.argsort(-lcor, kind="mergesort")
+        numpy.testing.assert_allclose(
+            batch[0],
+            [gseacore.enrichmentScoreRanked(s, lcor, ordered)[0]
+             for s in [[5, 6], [], [0, 6]]])
+
+
+def _shuffle(data, seed):
+    perm = list(range(len(data)))
+    random.Random(seed).shuffle(perm)
+    return data[perm]
+
+
+def _ranking(data):
+    # correlations of columns with the class in the last column
+    return [numpy.corrcoef(col, data[:, -1])[0, 1] for col in data[:, :-1].T]
+
+
+class Cancel(Exception):
+    pass
+
+
+class TestNulls(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        self.n = 100
+        self.lcor = numpy.array([rnd.gauss(0, 1) for _ in range(self.n)])
+        self.membership = gseacore.genesetsMembership(
+            [rnd.sample(range(self.n), size) for size in [3, 10, 30]],
+            self.n)
+
+    def test_workers(self):
+        nulls = gseacore.gseaNulls(self.membership, self.lcor, 120,
+                                   permutation="gene")
+        self.assertEqual(nulls.shape, (120, 3))
+        perms = gseacore.permutationIndices(self.n, range(2000, 2120))
+        numpy.testing.assert_allclose(
+            nulls,
+            gseacore.enrichmentScoresBatch(self.membership, self.lcor[perms]))
+        for workers in [2, 3]:
+            numpy.testing.assert_equal(
+                gseacore.gseaNulls(self.membership, self.lcor, 120,
+                                   permutation="gene", workers=workers),
+                nulls)
+
+    def test_workers_class(self):
+        rnd = numpy.random.RandomState(0)
+        data = rnd.normal(size=(20, self.n + 1))
+        data[:, -1] = numpy.arange(20) % 2
+        nulls = [gseacore.gseaNulls(self.membership, None, 12, data=data,
+                                    rankingf=_ranking, shuffle=_shuffle,
+                                    workers=workers)
+                 for workers in [1, 2]]
+        numpy.testing.assert_equal(nulls[0], nulls[1])
+        self.assertRaises(ValueError, gseacore.gseaNulls, self.membership,
+                          None, 12, data=data, rankingf=_ranking)
+
+    def test_cancel(self):
+        for workers in [1, 2]:
+            calls = []
+
+            def callback():
+                calls.append(1)
+                if len(calls) == 5:
+                    raise Cancel()
+
+            self.assertRaises(Cancel, gseacore.gseaNulls, self.membership,
+                              self.lcor, 10000, permutation="gene",
+                              callback=callback, workers=workers)
+            self.assertEqual(len(calls), 5)
+            self.assertEqual(multiprocessing.active_children(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
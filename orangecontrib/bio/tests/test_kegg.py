@@ -0,0 +1,426 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import warnings
+from contextlib import closing
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import unquote
+
+import numpy
+
+from orangecontrib.bio import kegg
+from orangecontrib.bio.kegg import caching, conf, databases, pathway, service
+from orangecontrib.bio.utils import stats
+
+
+class TestSqlite3Store(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "cache.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def store(self, **kwargs):
+        kwargs.setdefault("max_size", 0)
+        kwargs.setdefault("max_age", 0)
+        return caching.Sqlite3Store(self.filename, **kwargs)
+
+    def test_mapping(self):
+        with closing(self.store()) as store:
+            self.assertEqual(len(store), 0)
+            store["a"] = caching.cache_entry("x" * 1000)
+            store.update([("b", [1, 2]), ("c", None)])
+            self.assertEqual(len(store), 3)
+            self.assertEqual(sorted(store), ["a", "b", "c"])
+            self.assertEqual(store["a"].value, "x" * 1000)
+            self.assertEqual(store["b"], [1, 2])
+            self.assertIn("c", store)
+            del store["c"]
+            self.assertNotIn("c", store)
+            self.assertRaises(KeyError, lambda: store["c"])
+            # values are compressed
+            size = store.con.execute(
+                "SELECT size FROM cache WHERE key='a'").fetchone()[0]
+            self.assertLess(size, 1000)
+        with closing(self.store()) as store:
+            self.assertEqual(store["b"], [1, 2])
+
+    def test_batch(self):
+        with closing(self.store()) as store:
+            with store:
+                for i in range(10):
+                    store[str(i)] = i
+                with store:
+                    store["x"] = "x"
+                # not committed until the outer block ends
+                other = sqlite3.connect(self.filename)
+                self.assertEqual(
+                    other.execute("SELECT count(*) FROM cache").fetchone(),
+                    (0,))
+            self.assertEqual(
+                other.execute("SELECT count(*) FROM cache").fetchone(), (11,))
+            other.close()
+
+    def test_old_schema(self):
+        con = sqlite3.connect(self.filename)
+        con.execute("CREATE TABLE cache (key TEXT UNIQUE, value TEXT)")
+        con.execute("INSERT INTO cache VALUES (?, ?)",
+                    ("old", caching.pickle.dumps("value")))
+        con.commit()
+        con.close()
+        with closing(self.store()) as store:
+            self.assertEqual(store["old"], "value")
+            store["new"] = "new"
+            self.assertEqual(sorted(store), ["new", "old"])
+
+    def test_evict(self):
+        with closing(self.store()) as store:
+            for i in range(20):
+                store[str(i)] = os.urandom(100 * 1024)
+            store.con.execute("UPDATE cache SET mtime=? WHERE key='0'",
+                              (time.time() - 10 * 24 * 3600,))
+            self.assertEqual(store.evict(max_age=7), 1)
+            self.assertEqual(len(store), 19)
+            # keep the newest 1 MB
+            store.evict(max_size=1)
+            self.assertEqual(len(store), 10)
+            self.assertEqual(sorted(store, key=int),
+                             [str(i) for i in range(10, 20)])
+
+        # limits are applied on close
+        with closing(self.store(max_size=0.5)) as store:
+            store["new"] = "new"
+        with closing(self.store()) as store:
+            self.assertEqual(len(store), 6)
+            self.assertIn("new", store)
+
+    def test_total_size(self):
+        def total(store):
+            return store.con.execute(
+                "SELECT coalesce(sum(size), 0) FROM cache").fetchone()[0]
+
+        with closing(self.store()) as store:
+            store["a"] = os.urandom(1000)
+            store.update([("b", os.urandom(2000)), ("c", "c")])
+            store["a"] = os.urandom(3000)  # replaced
+            del store["c"]
+            self.assertEqual(store.total_size(), total(store))
+            self.assertGreater(store.total_size(), 5000)
+            plan = store.con.execute(
+                "EXPLAIN QUERY PLAN SELECT rowid FROM cache ORDER BY mtime"
+            ).fetchall()
+            self.assertIn("cache_mtime_index", str(plan))
+
+        # the total is recounted if it is out of date
+        con = sqlite3.connect(self.filename)
+        con.execute("UPDATE cache_meta SET value=1000000000")
+        con.commit()
+        con.close()
+        with closing(self.store(max_size=1)) as store:
+            self.assertEqual(store.evict(), 0)
+            self.assertEqual(store.total_size(), total(store))
+
+
+COMPOUNDS = ["C%05d" % i for i in range(1, 36)]
+
+PATHWAY_LINKS = [("hsa:1", "path:hsa00010"), ("hsa:1", "path:hsa00020"),
+                 ("hsa:2", "path:hsa00010"), ("hsa:3", "path:hsa00030"),
+                 ("hsa:4", "path:hsa00010"), ("hsa:4", "path:hsa00030"),
+                 ("hsa:5", "path:hsa00020")]
+
+
+class KeggHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ A stand-in for the KEGG REST service (list and get). """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        parts = unquote(self.path).strip("/").split("/")
+        if parts == ["list", "cpd"]:
+            body = "".join("cpd:%s\tcompound %s\n" % (c, c)
+                           for c in COMPOUNDS)
+        elif parts == ["info", "hsa"]:
+            server.requests.append(parts)
+            body = ("T01001           Homo sapiens (human) KEGG Genes\n"
+                    "hsa              Release %s\n"
+                    "                 Kanehisa Laboratories\n"
+                    % server.release)
+        elif parts == ["link", "pathway", "hsa"]:
+            server.requests.append(parts)
+            body = "".join("%s\t%s\n" % link for link in server.links)
+        elif parts[0] == "get":
+            ids = parts[1].split("+")
+            with server.lock:
+                server.requests.append(ids)
+                server.active += 1
+                server.max_active = max(server.max_active, server.active)
+            time.sleep(0.02)
+            with server.lock:
+                server.active -= 1
+            body = "".join(
+                "ENTRY       %s                      Compound\n"
+                "NAME        compound %s\n///\n" % (id[4:], id[4:])
+                for id in ids if id[4:] in COMPOUNDS)
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = body.encode("ascii")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class KeggServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class KeggServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = KeggServer(("127.0.0.1", 0), KeggHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.active = self.server.max_active = 0
+        self.server.release = "80.0"
+        self.server.links = list(PATHWAY_LINKS)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.dir = tempfile.mkdtemp()
+        self.cache_path = conf.params["cache.path"]
+        self.rest_api = service.REST_API
+        conf.params["cache.path"] = self.dir
+        service.REST_API = "http://127.0.0.1:%d/" % self.server.server_port
+
+    def tearDown(self):
+        conf.params["cache.path"] = self.cache_path
+        service.REST_API = self.rest_api
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+
+class OrganismTest(kegg.Organism):
+    @classmethod
+    def organism_name_search(cls, name):
+        return name
+
+
+class TestBatchGet(KeggServiceTestCase):
+    def test_pre_cache(self):
+        compound = databases.Compound()
+        self.assertEqual(len(compound.keys()), len(COMPOUNDS))
+        progress = []
+        compound.pre_cache(batch_size=5, workers=3,
+                           progress_callback=progress.append)
+        requests = self.server.requests
+        self.assertEqual(len(requests), 7)
+        self.assertEqual(sorted(id for ids in requests for id in ids),
+                         ["cpd:" + c for c in COMPOUNDS])
+        self.assertTrue(1 < self.server.max_active <= 3)
+        self.assertEqual(progress[-1], 100)
+
+        # everything is served from the cache
+        entries = compound.batch_get(["C00003", "C00001"])
+        self.assertEqual([e.entry_key for e in entries], ["C00003", "C00001"])
+        self.assertEqual(entries[0].name, "compound C00003")
+        self.assertEqual(len(requests), 7)
+
+    def test_batch_get(self):
+        compound = databases.Compound()
+        keys = ["C00002", "C99999", "C00001", "C00002"]
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            entries = compound.batch_get(keys)
+        self.assertEqual([e.entry_key for e in entries],
+                         ["C00002", "C00001", "C00002"])
+        self.assertEqual(self.server.requests,
+                         [["cpd:C00002", "cpd:C99999", "cpd:C00001"]])
+        # entries that were not found are not cached
+        compound.batch_get(["C99999"])
+        self.assertEqual(self.server.requests[-1], ["cpd:C99999"])
+        self.assertEqual(compound["C00001"].entry_key, "C00001")
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class TestPathwayIndex(KeggServiceTestCase):
+    def test_from_links(self):
+        index = kegg.PathwayGeneIndex.from_links(PATHWAY_LINKS)
+        self.assertEqual(index.genes, ["hsa:%d" % i for i in range(1, 6)])
+        self.assertEqual(index.pathways_of("hsa:4"),
+                         ["path:hsa00010", "path:hsa00030"])
+        self.assertEqual(index.pathways_of("hsa:9"), [])
+        self.assertEqual(index.counts(["hsa:1", "hsa:2", "hsa:2"]).tolist(),
+                         [2, 1, 0])
+
+        reference = ["hsa:%d" % i for i in range(1, 9)]
+        genes = ["hsa:4", "hsa:1", "hsa:9", "hsa:2"]
+        prob = stats.Binomial()
+        res = index.enrichment(genes, index.counts(reference), 8, prob)
+        pathway_genes = {}
+        for gene, pathway in PATHWAY_LINKS:
+            pathway_genes.setdefault(pathway, []).append(gene)
+        self.assertEqual(sorted(res), ["path:hsa00010", "path:hsa00020",
+                                       "path:hsa00030"])
+        for pid, (mapped, p, count) in res.items():
+            self.assertEqual(mapped,
+                             [g for g in genes if g in pathway_genes[pid]])
+            self.assertEqual(count, len(pathway_genes[pid]))
+            self.assertAlmostEqual(
+                p, prob.p_value(len(mapped), 8, count, len(genes)))
+
+    def test_stored_index(self):
+        index = kegg.pathway_index("hsa")
+        self.assertEqual(index.release, "80.0")
+        self.assertEqual(len(self.server.requests), 2)
+        index = kegg.pathway_index("hsa")
+        self.assertIsInstance(index.indptr, numpy.memmap)
+        self.assertEqual(index.pathways_of("hsa:1"),
+                         ["path:hsa00010", "path:hsa00020"])
+        self.assertEqual(self.server.requests[-1], ["info", "hsa"])
+
+        # a new release rebuilds the index
+        self.server.release = "81.0"
+        self.server.links.append(("hsa:6", "path:hsa00030"))
+        index = kegg.pathway_index("hsa", kegg.api.CachedKeggApi())
+        self.assertEqual(index.release, "81.0")
+        self.assertEqual(index.pathways_of("hsa:6"), ["path:hsa00030"])
+
+        # the stored index is used when the service is not available
+        service.REST_API = "http://127.0.0.1:1/"
+        index = kegg.pathway_index("hsa", kegg.api.CachedKeggApi())
+        self.assertEqual(index.release, "81.0")
+
+        # other errors are not hidden
+        class BrokenApi(kegg.api.CachedKeggApi):
+            def info(self, db):
+                raise ValueError(db)
+
+        self.assertRaises(ValueError, kegg.pathway_index, "hsa", BrokenApi())
+
+    def test_enriched_pathways_many(self):
+        org = OrganismTest("hsa")
+        reference = ["hsa:%d" % i for i in range(1, 9)]
+        gene_lists = [["hsa:1"], ["hsa:4", "hsa:1", "hsa:9"], [],
+                      ["hsa:2", "hsa:5", "hsa:3"]]
+        for processes in [1, 2]:
+            progress = []
+            results = dict(org.get_enriched_pathways_many(
+                gene_lists, reference, processes=processes,
+                callback=progress.append))
+            self.assertEqual(sorted(results), list(range(len(gene_lists))))
+            for i, genes in enumerate(gene_lists):
+                single = []
+                self.assertEqual(results[i], org.get_enriched_pathways(
+                    genes, reference, callback=single.append))
+                self.assertEqual(single, [100])
+            self.assertEqual(progress[-1], 100)
+
+
+KGML = """<?xml version="1.0"?>
+<!DOCTYPE pathway SYSTEM "http://www.kegg.jp/kegg/xml/KGML_v0.7.1_.dtd">
+<pathway name="path:hsa00010" org="hsa" number="00010"
+         title="Glycolysis / Gluconeogenesis"
+         image="http://www.kegg.jp/kegg/pathway/hsa/hsa00010.png"
+         link="http://www.kegg.jp/kegg-bin/show_pathway?hsa00010">
+    <entry id="1" name="hsa:3101 hsa:3098" type="gene" reaction="rn:R01786"
+        link="http://www.kegg.jp/dbget-bin/www_bget?hsa:3101">
+        <graphics name="HK3" fgcolor="#000000" bgcolor="#BFFFBF"
+             type="rectangle" x="483" y="407" width="46" height="17"/>
+    </entry>
+    <entry id="2" name="cpd:C00031" type="compound">
+        <graphics name="C00031" type="circle" x="483" y="370" width="8"
+             height="8"/>
+    </entry>
+    <entry id="3" name="hsa:3098" type="gene">
+        <graphics name="HK1" type="rectangle" x="1" y="2" width="3"
+             height="4"/>
+    </entry>
+    <entry id="4" name="undefined" type="group">
+        <graphics type="rectangle" x="1" y="2" width="3" height="4"/>
+        <component id="1"/>
+        <component id="3"/>
+    </entry>
+    <relation entry1="1" entry2="3" type="ECrel">
+        <subtype name="compound" value="2"/>
+    </relation>
+    <reaction id="1" name="rn:R01786" type="irreversible">
+        <substrate id="2" name="cpd:C00031"/>
+        <product id="5" name="cpd:C00668"/>
+    </reaction>
+</pathway>
+"""
+
+
+class TestPathway(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "hsa00010.xml")
+        with open(self.filename, "w") as f:
+            f.write(KGML)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse(self):
+        p = pathway.Pathway("path:hsa00010", local_cache=self.dir)
+        self.assertEqual(p.title, "Glycolysis / Gluconeogenesis")
+        self.assertEqual((p.org, p.number), ("hsa", "00010"))
+        self.assertEqual(p.genes(), ["hsa:3098", "hsa:3101"])
+        self.assertEqual(p.compounds(), ["cpd:C00031"])
+        self.assertEqual(p.enzymes(), [])
+
+        entries = p.entries()
+        self.assertEqual([e.id for e in entries], ["1", "2", "3", "4"])
+        self.assertEqual(entries[0].graphics["name"], "HK3")
+        self.assertEqual(entries[0].link,
+                         "http://www.kegg.jp/dbget-bin/www_bget?hsa:3101")
+        self.assertFalse(hasattr(entries[1], "link"))
+        self.assertEqual(entries[3].components, ["1", "3"])
+        relation, = p.relations()
+        self.assertEqual((relation.entry1, relation.entry2), ("1", "3"))
+        self.assertEqual(relation.subtypes,
+                         [[("name", "compound"), ("value", "2")]])
+        reaction, = p.reactions()
+        self.assertEqual(reaction.substrates, ["cpd:C00031"])
+        self.assertEqual(reaction.products, ["cpd:C00668"])
+
+    def test_cache(self):
+        p = pathway.Pathway("hsa00010", local_cache=self.dir)
+        genes = p.genes()
+        self.assertTrue(os.path.exists(p._parsed_kgml_filename()))
+
+        parse_kgml = pathway.parse_kgml
+        pathway.parse_kgml = None
+        try:
+            p = pathway.Pathway("hsa00010", local_cache=self.dir)
+            self.assertEqual(p.genes(), genes)
+        finally:
+            pathway.parse_kgml = parse_kgml
+
+        # a modified kgml file is parsed again
+        with open(self.filename, "w") as f:
+            f.write(KGML.replace("hsa:3101 ", ""))
+        p = pathway.Pathway("hsa00010", local_cache=self.dir)
+        self.assertEqual(p.genes(), ["hsa:3098"])
+
+        with open(self.filename, "w") as f:
+            f.write("<pathway")
+        p = pathway.Pathway("hsa00010", local_cache=self.dir)
+        self.assertEqual(p.entries(), [])
+        self.assertIsNone(p.pathway_attributes())
+
+
+if __name__ == "__main__":
+    unittest.main()
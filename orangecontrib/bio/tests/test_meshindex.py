@@ -0,0 +1,127 @@
+import unittest
+import random
+
+import numpy
+
+from orangecontrib.bio.utils import meshindex, stats
+
+
+def tree_data_pairwise(ids):
+    # successors as computed by obiMeSH before the prefix index
+    succesors = {"tops": []}
+    for i in ids:
+        succesors[i] = [j for j in ids if i != j and j.count(i) > 0]
+    for i in ids:
+        second_level = [m for k in succesors[i] for m in succesors[k]]
+        for m in second_level:
+            if succesors[i].count(m) > 0:
+                succesors[i].remove(m)
+    tops = list(ids)
+    for i in ids:
+        for j in succesors[i]:
+            tops.remove(j)
+    succesors["tops"] = tops
+    return succesors
+
+
+class TestMeSHIndex(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        ids = ["C%02d" % i for i in range(3)]
+        for _ in range(60):
+            ids.append(rnd.choice(ids) + ".%03d" % rnd.randrange(1000))
+        self.ids = sorted(set(ids))
+        self.toID = {}
+        for i, id in enumerate(self.ids):
+            self.toID.setdefault("term%d" % (i % 40), []).append(id)
+        self.index = meshindex.MeSHIndex(self.toID)
+
+        names = sorted(self.toID)
+
+        def rows(count):
+            return [repr(rnd.sample(names, rnd.randrange(1, 4)) +
+                         (["unknown"] if rnd.random() < 0.1 else []))
+                    for _ in range(count)] + ["[bad", "['unknown']"]
+        self.reference = rows(200)
+        self.cluster = rows(40)
+        self.rnd = rnd
+
+    def encode(self, values):
+        memo = {}
+        rows = [self.index.encode(v, memo)[0] for v in values]
+        return [r for r in rows if r is not None and len(r)]
+
+    def test_tree_data(self):
+        for _ in range(5):
+            ids = self.rnd.sample(self.ids, 30)
+            self.assertEqual(meshindex.tree_data(ids),
+                             tree_data_pairwise(ids))
+        self.assertEqual(meshindex.tree_data([]), {"tops": []})
+
+    def test_encode(self):
+        index = self.index
+        codes, unknown = index.encode("['term1', 'unknown', 'term1']")
+        self.assertEqual([index.ids[c] for c in codes],
+                         sorted(self.toID["term1"]))
+        self.assertEqual(unknown, ["unknown"])
+        self.assertEqual(index.encode("[bad"), (None, []))
+        self.assertEqual(index.encode("42"), (None, []))
+
+        memo = {}
+        first = index.encode("['term2']", memo)
+        self.assertIs(index.encode("['term2']", memo), first)
+        self.assertEqual(list(memo), ["['term2']"])
+
+    def test_counts(self):
+        rows = self.encode(self.reference)
+        counts = self.index.counts(rows)
+        for id, count in zip(self.index.ids, counts):
+            code = self.index.id_index[id]
+            self.assertEqual(count, sum(code in r for r in rows))
+        weights = numpy.linspace(0.1, 1, len(rows))
+        numpy.testing.assert_allclose(
+            self.index.counts(rows, weights),
+            [sum(w for r, w in zip(rows, weights) if c in r)
+             for c in range(len(self.index.ids))])
+        self.assertEqual(self.index.counts([]).tolist(),
+                         [0] * len(self.index.ids))
+
+    def test_enrichment(self):
+        hyperg = stats.Hypergeometric()
+        ref, clu = self.encode(self.reference), self.encode(self.cluster)
+        ref_weights = numpy.ones(len(ref), dtype=int)
+        clu_weights = numpy.ones(len(clu), dtype=int)
+        res, ratio = self.index.enrichment(ref, ref_weights, clu, clu_weights)
+        n, cln = len(ref), len(clu)
+        self.assertEqual(ratio, float(cln) / n)
+        # unparsable rows and rows without known terms are not counted
+        self.assertEqual((n, cln), (200, 40))
+        ref_ids = [set(self.index.ids[c] for c in r) for r in ref]
+        clu_ids = [set(self.index.ids[c] for c in r) for r in clu]
+        self.assertEqual(sorted(res), sorted(set.union(*ref_ids)))
+        for id, (r, c, p, fold) in res.items():
+            self.assertEqual(r, sum(id in ids for ids in ref_ids))
+            self.assertEqual(c, sum(id in ids for ids in clu_ids))
+            self.assertAlmostEqual(p, hyperg.p_value(c, n, cln, r))
+            self.assertAlmostEqual(fold, float(c) / r / ratio)
+
+        # fuzzy memberships
+        ref_weights = numpy.array([self.rnd.random() for _ in ref]) + 0.5
+        clu_weights = numpy.array([self.rnd.random() for _ in clu]) + 0.5
+        res, ratio = self.index.enrichment(ref, ref_weights, clu,
+                                           clu_weights, fuzzy=True)
+        n, cln = ref_weights.sum(), clu_weights.sum()
+        self.assertAlmostEqual(ratio, cln / n)
+        for id, (r, c, p, fold) in res.items():
+            self.assertAlmostEqual(
+                r, sum(w for ids, w in zip(ref_ids, ref_weights) if id in ids))
+            self.assertAlmostEqual(
+                c, sum(w for ids, w in zip(clu_ids, clu_weights) if id in ids))
+            self.assertAlmostEqual(
+                p, hyperg.p_value(int(c), int(n), int(cln), int(r)))
+            if r:
+                self.assertAlmostEqual(fold, c / r / ratio)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,40 @@
 import doctest
+import io
 import unittest
 
 from six import StringIO
 
 from orangecontrib.bio import ontology
 
+
+FAMILY = """format-version: 1.2
+date: 01:01:2016 00:00
+
+[Typedef]
+id: parent
+
+[Term]
+id: 001
+name: George
+
+[Term]
+id: 002
+name: Estelle
+relationship: parent 001 ! George
+
+[Term]
+id: 003
+name: Frank
+is_a: 002
+
+
+[Term]
+id: 004
+name: Jerry
+relationship: parent 003
+relationship: parent 999
+"""
+
 class TestOntology(unittest.TestCase):
     def test_oboobject(self):
         stanza = '''[Term]
@@ -51,6 +81,48 @@ name: bar
         seinfeld = ontology.OBOOntology(seinfeld)
 #        print(seinfeld.child_edges("001"))
 
+class TestOBOOntology(unittest.TestCase):
+    def test_parser_is_incremental(self):
+        def lines():
+            yield b"header: value\n"
+            yield b"[Term]\n"
+            yield b"id: FOO:001\n"
+            raise RuntimeError("read too far")
+
+        events = ontology.OBOParser(lines()).parse()
+        self.assertEqual(next(events), ("HEADER_TAG", ["header", "value"]))
+        self.assertEqual(next(events), ("START_STANZA", "Term"))
+        self.assertEqual(next(events),
+                         ("TAG_VALUE", ("id", "FOO:001", None, None)))
+
+    def test_relations(self):
+        o = ontology.OBOOntology(io.BytesIO(FAMILY.encode("utf-8")))
+        self.assertEqual(o.header_tags[0], ("format-version", "1.2"))
+        self.assertEqual([t.id for t in o.terms()],
+                         ["001", "002", "003", "004"])
+        self.assertEqual(o.term_by_name("Frank").id, "003")
+        self.assertRaises(ValueError, o.term_by_name, "Kramer")
+        self.assertIn("parent", o.edge_types())
+        self.assertEqual([t.id for t in o.root_terms()], ["001"])
+
+        ids = lambda terms: sorted(t.id for t in terms)
+        self.assertEqual(ids(o.super_terms("003")), ["001", "002"])
+        self.assertEqual(ids(o.sub_terms("001")), ["002", "003", "004"])
+        self.assertEqual(ids(o.child_terms("002")), ["003"])
+        self.assertEqual([(r, t.id) for r, t in o.parent_edges("003")],
+                         [("is_a", "002")])
+        # unknown parents are only an error for the terms referring to them
+        self.assertRaises(ValueError, o.parent_terms, "004")
+        self.assertEqual(
+            sorted((a.id, rel, b.id) for a, rel, b in o.relations()),
+            [("002", "parent", "001"), ("003", "is_a", "002"),
+             ("004", "parent", "003")])
+
+        o.add_object(ontology.Term(id="005", name="Kramer", is_a="001"))
+        self.assertEqual(o.term_by_name("Kramer").id, "005")
+        self.assertEqual(ids(o.child_terms("001")), ["002", "005"])
+
+
 def load_tests(loader, tests, ignore):
     stanza = '''[Term]
 id: FOO:001
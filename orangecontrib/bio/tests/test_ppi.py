@@ -0,0 +1,175 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import numpy
+
+from orangecontrib.bio import ppi
+
+
+LINKS = [("9606.A", "9606.B", 900), ("9606.B", "9606.A", 900),
+         ("9606.A", "9606.C", 400), ("9606.C", "9606.A", 400),
+         ("9606.C", "9606.D", 700), ("9606.D", "9606.C", 700),
+         ("10090.E", "10090.F", 500), ("10090.F", "10090.E", 500)]
+
+ACTIONS = [("9606.A", "9606.B", "binding", "", 800)]
+
+ALIASES = [("9606.A", "GA", "Ensembl"), ("9606.A", "ga1", "BLAST"),
+           ("9606.B", "GB", "Ensembl"), ("9606.C", "GC", "Ensembl"),
+           ("9606.D", "GD", "Ensembl"), ("10090.E", "GA", "Ensembl"),
+           ("10090.F", "GF", "Ensembl")]
+
+
+def create_db(con):
+    ppi.STRING.clear_db(con)
+    con.executemany("INSERT INTO links VALUES (?, ?, ?)", LINKS)
+    con.executemany("INSERT INTO actions VALUES (?, ?, ?, ?, ?)", ACTIONS)
+    con.executemany("INSERT INTO aliases VALUES (?, ?, ?)", ALIASES)
+    con.execute("""
+        INSERT INTO proteins
+        SELECT DISTINCT protein_id1, substr(protein_id1, 1,
+                                            instr(protein_id1, '.') - 1)
+        FROM links
+    """)
+    ppi.STRING.create_db_index(con)
+    con.commit()
+
+
+class TestSTRING(unittest.TestCase):
+    def setUp(self):
+        con = sqlite3.connect(":memory:")
+        create_db(con)
+        self.string = ppi.STRING(database=con)
+
+    def test_all_edges(self):
+        self.assertEqual(sorted(self.string.all_edges()), sorted(LINKS))
+        self.assertEqual(sorted(self.string.all_edges("10090")),
+                         sorted(LINKS[-2:]))
+
+    def test_edges_many(self):
+        s = self.string
+        ids = ["9606.A", "9606.C", "9606.A", "10090.X"]
+        expected = sorted(s.edges("9606.A") + s.edges("9606.C"))
+        self.assertEqual(sorted(s.edges_many(ids)), expected)
+        self.assertEqual(list(s.edges_many([])), [])
+
+    def test_subnetwork(self):
+        s = self.string
+        ids = ["9606.A", "9606.B", "9606.C"]
+        self.assertEqual(sorted(s.subnetwork(ids)), sorted(LINKS[:4]))
+        self.assertEqual(sorted(s.subnetwork(ids, min_score=500)),
+                         sorted(LINKS[:2]))
+
+    def test_stop_iteration_early(self):
+        s = self.string
+        edges = s.edges_many(["9606.A", "9606.C"])
+        next(edges)
+        edges.close()
+        # the temporary table is dropped
+        self.assertEqual(
+            s.db.execute("SELECT count(*) FROM sqlite_temp_master").fetchone(),
+            (0,))
+
+    def test_synonyms_many(self):
+        s = self.string
+        ids = ["9606.A", "9606.D", "9606.X"]
+        res = s.synonyms_many(ids)
+        self.assertEqual(set(res), set(ids))
+        for id in ids:
+            self.assertEqual(sorted(res[id]), sorted(s.synonyms(id)))
+
+    def test_search_ids(self):
+        s = self.string
+        names = ["GA", "GF", "unknown"]
+        for taxid in [None, "9606"]:
+            res = s.search_ids(names, taxid)
+            self.assertEqual(set(res), set(names))
+            for name in names:
+                self.assertEqual(sorted(res[name]),
+                                 sorted(s.search_id(name, taxid)))
+
+    def test_all_edges_annotated(self):
+        s = self.string
+        res = s.all_edges_annotated("9606")
+        expected = [e for id in s.ids("9606") for e in s.edges_annotated(id)]
+        self.assertEqual(sorted(res), sorted(expected))
+        self.assertEqual(len(res), 6)
+
+
+class TestPPIGraph(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "string.sqlite")
+        con = sqlite3.connect(self.filename)
+        create_db(con)
+        con.close()
+        self.string = ppi.STRING(database=self.filename)
+
+    def tearDown(self):
+        self.string.db.close()
+        shutil.rmtree(self.dir)
+
+    def test_from_edges(self):
+        graph = ppi.PPIGraph.from_edges(
+            [("a", "b", 1), ("b", "a", 3), ("b", "c", 2), ("c", "c", 5)])
+        self.assertEqual(graph.ids, ["a", "b", "c"])
+        self.assertEqual(sorted(graph.edges()),
+                         [("a", "b", 3), ("b", "c", 2)])
+        self.assertEqual(sorted(graph.neighbors("b")), [("a", 3), ("c", 2)])
+        self.assertEqual(graph.degrees().tolist(), [1, 2, 1])
+
+    def test_snapshot(self):
+        graph = self.string.graph()
+        path = self.filename + ".graph.all"
+        self.assertTrue(os.path.isdir(path))
+        loaded = ppi.STRING(database=self.filename).graph()
+        self.assertIsInstance(loaded.indices, numpy.memmap)
+        self.assertEqual(loaded.ids, graph.ids)
+        self.assertEqual(sorted(loaded.edges()), sorted(graph.edges()))
+        self.assertEqual(
+            sorted((min(a, b), max(a, b), score) for a, b, score in graph.edges()),
+            sorted((a, b, s) for a, b, s in LINKS if a < b))
+
+        human = self.string.graph("9606")
+        self.assertEqual(sorted(human.ids),
+                         ["9606.A", "9606.B", "9606.C", "9606.D"])
+
+    def test_neighborhood(self):
+        s = self.string
+        self.assertEqual(sorted(s.neighborhood(["9606.B"])),
+                         ["9606.A", "9606.B"])
+        self.assertEqual(sorted(s.neighborhood(["9606.B"], k=2)),
+                         ["9606.A", "9606.B", "9606.C"])
+        self.assertEqual(sorted(s.neighborhood(["9606.B", "x"], k=3)),
+                         ["9606.A", "9606.B", "9606.C", "9606.D"])
+        self.assertEqual(
+            sorted(s.neighborhood(["9606.B"], k=3, min_score=500)),
+            ["9606.A", "9606.B"])
+
+    def test_threshold_subgraph(self):
+        s = self.string
+        sub = s.threshold_subgraph(500)
+        self.assertEqual(
+            sorted((min(a, b), max(a, b), score) for a, b, score in sub.edges()),
+            sorted(e for e in LINKS if e[0] < e[1] and e[2] >= 500))
+        sub = s.threshold_subgraph(None, ids=["9606.A", "9606.C", "9606.D"])
+        self.assertEqual(sorted(sub.ids), ["9606.A", "9606.C", "9606.D"])
+        self.assertEqual(
+            sorted((min(a, b), max(a, b), score) for a, b, score in sub.edges()),
+            [("9606.A", "9606.C", 400), ("9606.C", "9606.D", 700)])
+
+    def test_degree_statistics(self):
+        stats = self.string.degree_statistics()
+        self.assertEqual(stats["nodes"], 6)
+        self.assertEqual(stats["edges"], 4)
+        self.assertEqual(stats["max"], 2)
+        self.assertEqual(stats["min"], 1)
+        stats = self.string.degree_statistics(min_score=600)
+        self.assertEqual(stats["edges"], 2)
+        self.assertEqual(stats["min"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,263 @@
+import unittest
+import bz2
+import gzip
+import hashlib
+import io
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves.urllib.parse import parse_qs
+
+from orangecontrib.bio.utils import serverfiles
+
+
+DATA = b"".join(b"line %d of the test file\n" % i for i in range(5000))
+_random = random.Random(0)
+RANDOM = bytes(bytearray(_random.randrange(256) for _ in range(300000)))
+
+
+def gzipped(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ A stand-in for the repository server with support for Range. """
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length", 0))
+        form = parse_qs(self.rfile.read(length).decode("ascii"))
+        domain = form["domain"][0]
+        filename = form.get("filename", [None])[0]
+        command = self.path.rsplit("/", 1)[-1]
+        self.server.requests.append(
+            (command, self.headers.get("If-None-Match")))
+        if command == "allinfo":
+            body = "".join("[[[[[" + name + "=====" + self.info(name)
+                           for dom, name in sorted(self.server.files)
+                           if dom == domain)
+            return self.reply(200, body.encode("ascii"), etag=True)
+        content, tags = self.server.files[(domain, filename)]
+        if command == "info":
+            return self.reply(200, self.info(filename).encode("ascii"),
+                              etag=True)
+        self.server.ranges.append(self.headers.get("Range"))
+        if self.server.fail_after is not None:
+            # send only a part of the content
+            body = content[:self.server.fail_after]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(body)
+            self.server.fail_after = None
+            self.close_connection = True
+            return
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (
+                start, len(content) - 1, len(content)))
+            body = content[start:]
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.reply(200, content)
+
+    def info(self, filename):
+        content, tags = self.server.files[("test", filename)]
+        return "|||||".join([str(len(content)), self.server.datetime,
+                             filename, ";".join(tags)])
+
+    def reply(self, code, body, etag=False):
+        if etag:
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+        self.send_response(code)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+        self.server.files = {
+            ("test", "plain.txt"): (DATA, ["a"]),
+            ("test", "data.txt"): (gzipped(DATA), ["#compression:gz"]),
+            ("test", "data.bz2.txt"): (bz2.compress(DATA),
+                                       ["#compression:bz2"]),
+            ("test", "checked.txt"): (DATA, ["#md5:" + "0" * 32]),
+            ("test", "checked.gz.txt"): (gzipped(DATA),
+                                         ["#compression:gz",
+                                          "#md5:" + "0" * 32]),
+            ("test", "random.txt"): (gzipped(RANDOM), ["#compression:gz"]),
+        }
+        self.server.ranges = []
+        self.server.requests = []
+        self.server.fail_after = None
+        self.server.datetime = "2016-01-01 00:00:00.0"
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.sf = serverfiles.ServerFiles(
+            server="127.0.0.1:%d/" % self.server.server_port)
+
+        self.dir = tempfile.mkdtemp()
+        self.buffer_dir = serverfiles.environ.buffer_dir
+        serverfiles.environ.buffer_dir = self.dir
+
+    def tearDown(self):
+        serverfiles.environ.buffer_dir = self.buffer_dir
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+
+
+class TestDownload(ServerTestCase):
+    def read(self, filename):
+        with open(serverfiles.localpath("test", filename), "rb") as f:
+            return f.read()
+
+    def test_download(self):
+        serverfiles.download("test", "plain.txt", self.sf, verbose=False)
+        self.assertEqual(self.read("plain.txt"), DATA)
+        self.assertEqual(serverfiles.info("test", "plain.txt")["tags"], ["a"])
+        self.assertFalse(os.path.exists(
+            serverfiles.localpath("test", "plain.txt.partial")))
+
+    def test_decompress(self):
+        for filename in ["data.txt", "data.bz2.txt"]:
+            serverfiles.download("test", filename, self.sf, verbose=False)
+            self.assertEqual(self.read(filename), DATA)
+        self.assertEqual(
+            sorted(os.listdir(serverfiles.localpath("test"))),
+            ["data.bz2.txt", "data.bz2.txt.info", "data.txt", "data.txt.info"])
+
+    def test_resume(self):
+        self.server.fail_after = 200000
+        self.assertRaises(Exception, serverfiles.download, "test",
+                          "random.txt", self.sf, verbose=False)
+        partial = serverfiles.localpath("test", "random.txt.partial")
+        size = os.path.getsize(partial)
+        self.assertTrue(0 < size <= 200000)
+        self.assertEqual(sorted(os.listdir(serverfiles.localpath("test"))),
+                         ["random.txt.partial"])
+
+        serverfiles.download("test", "random.txt", self.sf, verbose=False)
+        self.assertEqual(self.server.ranges, [None, "bytes=%d-" % size])
+        self.assertEqual(self.read("random.txt"), RANDOM)
+        self.assertFalse(os.path.exists(partial))
+
+    def test_checksum(self):
+        self.assertRaises(IOError, serverfiles.download, "test",
+                          "checked.txt", self.sf, verbose=False)
+        self.assertRaises(IOError, serverfiles.download, "test",
+                          "checked.gz.txt", self.sf, verbose=False)
+        self.assertEqual(os.listdir(serverfiles.localpath("test")), [])
+        md5 = hashlib.md5(DATA).hexdigest()
+        self.server.files[("test", "checked.txt")] = (DATA, ["#md5:" + md5])
+        serverfiles.download("test", "checked.txt", self.sf, verbose=False)
+        self.assertEqual(self.read("checked.txt"), DATA)
+
+    def test_download_many(self):
+        files = [("test", "plain.txt"), ("test", "data.txt"),
+                 ("test", "data.bz2.txt")]
+        done = []
+        res = serverfiles.download_many(
+            files, self.sf, workers=3,
+            callback=lambda *file: done.append(file))
+        self.assertEqual(sorted(res), sorted(files))
+        self.assertEqual(sorted(done), sorted(files))
+        for _, filename in files:
+            self.assertEqual(self.read(filename), DATA)
+        self.assertEqual(sorted(serverfiles.listfiles("test")),
+                         sorted(f for _, f in files))
+
+
+class TestMetadata(ServerTestCase):
+    def test_shared_session(self):
+        other = serverfiles.ServerFiles(server=self.sf.server)
+        self.assertIs(self.sf._requests_session(), other._requests_session())
+
+    def test_conditional_requests(self):
+        info = self.sf.info("test", "plain.txt")
+        self.assertEqual(info["size"], str(len(DATA)))
+        self.assertEqual(self.sf.info("test", "plain.txt"), info)
+        self.assertEqual(self.server.requests[0], ("info", None))
+        # the cached info is revalidated
+        self.assertEqual(self.server.requests[1][0], "info")
+        self.assertIsNotNone(self.server.requests[1][1])
+
+        self.server.datetime = "2016-02-01 00:00:00.0"
+        info = serverfiles.ServerFiles(server=self.sf.server).info(
+            "test", "plain.txt")
+        self.assertEqual(info["datetime"], "2016-02-01 00:00:00.0")
+
+    def test_max_age(self):
+        age = serverfiles.metadata_max_age
+        serverfiles.metadata_max_age = 3600
+        try:
+            self.sf.allinfo("test")
+            allinfo = self.sf.allinfo("test")
+        finally:
+            serverfiles.metadata_max_age = age
+        self.assertEqual(self.server.requests, [("allinfo", None)])
+        self.assertEqual(sorted(allinfo), sorted(f for _, f in self.server.files))
+
+    def test_allinfo_many(self):
+        infos = self.sf.allinfo_many(["test"] * 3, workers=3)
+        self.assertEqual(list(infos), ["test"])
+        self.assertEqual(infos["test"]["plain.txt"]["tags"], ["a"])
+
+    def test_needs_update(self):
+        serverfiles.download("test", "plain.txt", self.sf, verbose=False)
+        self.server.requests = []
+        for _ in range(3):
+            self.assertFalse(
+                serverfiles.needs_update("test", "plain.txt", self.sf))
+        # only the file info is requested
+        self.assertEqual([command for command, _ in self.server.requests],
+                         ["info"] * 3)
+        self.server.datetime = "2016-02-01 00:00:00.0"
+        self.assertTrue(serverfiles.needs_update("test", "plain.txt", self.sf))
+
+        # a given or fresh cached domain info is used without requests
+        allinfo = self.sf.allinfo("test")
+        self.server.requests = []
+        self.assertFalse(serverfiles.needs_update(
+            "test", "plain.txt", self.sf,
+            allinfo={"plain.txt": dict(allinfo["plain.txt"],
+                                       datetime="2015-01-01 00:00:00.0")}))
+        age = serverfiles.metadata_max_age
+        serverfiles.metadata_max_age = 3600
+        try:
+            self.sf.allinfo("test")
+            self.server.requests = []
+            self.assertTrue(
+                serverfiles.needs_update("test", "plain.txt", self.sf))
+        finally:
+            serverfiles.metadata_max_age = age
+        self.assertEqual(self.server.requests, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from orangecontrib.bio.utils import stats
+
+
+class TestPValues(unittest.TestCase):
+    def check_p_values(self, prob):
+        rng = numpy.random.RandomState(42)
+        N = rng.randint(1, 2000, 300)
+        m = (rng.rand(300) * (N + 1)).astype(int)
+        n = (rng.rand(300) * (N + 1)).astype(int)
+        k = (rng.rand(300) * (numpy.minimum(n, m) + 2)).astype(int)
+        # degenerate cases (m == 0, m == N, k == 0, k > n)
+        N = numpy.r_[N, 10, 10, 10, 10, 5]
+        m = numpy.r_[m, 0, 10, 0, 10, 5]
+        n = numpy.r_[n, 5, 5, 5, 5, 5]
+        k = numpy.r_[k, 0, 5, 1, 6, 0]
+
+        p_values = prob.p_values(k, N, m, n)
+        self.assertEqual(p_values.shape, k.shape)
+        for p, args in zip(p_values, zip(k, N, m, n)):
+            expected = prob.p_value(*map(int, args))
+            self.assertAlmostEqual(p, expected, places=10)
+            self.assertLessEqual(abs(p - expected), 1e-9 * expected + 1e-15)
+
+    def test_binomial(self):
+        self.check_p_values(stats.Binomial())
+
+    def test_hypergeometric(self):
+        self.check_p_values(stats.Hypergeometric())
+
+    def test_broadcast(self):
+        prob = stats.Hypergeometric()
+        p = prob.p_values([[1, 2], [3, 4]], 100, 10, 20)
+        self.assertEqual(p.shape, (2, 2))
+        self.assertAlmostEqual(p[1, 0], prob.p_value(3, 100, 10, 20))
+        self.assertEqual(prob.p_values([], 10, 2, 3).shape, (0,))
+
+    def test_memo(self):
+        self.assertNotEqual(stats.Binomial(), stats.Binomial())
+        stats.Binomial().p_value(3, 100, 10, 20)
+        hits = stats._p_value_memo.cache_info().hits
+        stats.Binomial().p_value(3, 100, 10, 20)
+        self.assertEqual(stats._p_value_memo.cache_info().hits, hits + 1)
+        self.assertAlmostEqual(stats.Binomial().p_value(3, 100, 10, 20),
+                               stats.Binomial().p_value(3, 100, 10, 20))
+        self.assertNotAlmostEqual(stats.Binomial().p_value(3, 100, 10, 20),
+                                  stats.Hypergeometric().p_value(3, 100, 10, 20))
+
+
+def fdr_naive(p_values, dependent=False, m=None):
+    m = m or len(p_values)
+    if dependent:
+        m = m * sum(1.0 / i for i in range(1, m + 1))
+    order = sorted(range(len(p_values)), key=lambda i: p_values[i])
+    fdrs = [0.0] * len(p_values)
+    cmin = float("inf")
+    for rank in reversed(range(len(order))):
+        cmin = min(cmin, p_values[order[rank]] * m / (rank + 1.0))
+        fdrs[order[rank]] = cmin
+    return fdrs
+
+
+class TestCorrections(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.p_values = numpy.r_[rng.rand(500) ** 3, [0.5] * 10, 0.0, 1.0]
+        rng.shuffle(self.p_values)
+
+    def test_fdr(self):
+        p = list(self.p_values)
+        for dependent in [False, True]:
+            for m in [None, 1000]:
+                fdr = stats.FDR(p, dependent=dependent, m=m)
+                self.assertIsInstance(fdr, list)
+                numpy.testing.assert_allclose(
+                    fdr, fdr_naive(p, dependent, m), rtol=1e-12)
+
+        fdr = stats.FDR(self.p_values)
+        self.assertIsInstance(fdr, numpy.ndarray)
+        numpy.testing.assert_allclose(fdr, fdr_naive(p), rtol=1e-12)
+        ordered = sorted(p)
+        self.assertEqual(stats.FDR(ordered, ordered=True), stats.FDR(ordered))
+        self.assertEqual(stats.FDR([]), [])
+
+    def test_fdr_chunked(self):
+        chunks = numpy.array_split(self.p_values, 7)
+        for dependent in [False, True]:
+            result = list(stats.FDR_chunked(iter(chunks), dependent=dependent))
+            self.assertEqual([len(c) for c in result],
+                             [len(c) for c in chunks])
+            numpy.testing.assert_allclose(
+                numpy.concatenate(result),
+                stats.FDR(self.p_values, dependent=dependent), rtol=1e-12)
+
+        # uneven and empty chunks, merged in many small blocks
+        p = self.p_values
+        chunks = [p[:300], p[300:300], p[300:302], p[302:]]
+        for m in [None, 1000]:
+            result = list(stats.FDR_chunked(chunks, m=m, block_size=16))
+            self.assertEqual([len(c) for c in result],
+                             [len(c) for c in chunks])
+            numpy.testing.assert_allclose(
+                numpy.concatenate(result), stats.FDR(p, m=m), rtol=1e-12)
+
+    def test_fdr_chunked_close(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            chunks = numpy.array_split(self.p_values, 3)
+            fdrs = stats.FDR_chunked(chunks, tmpdir=tmpdir)
+            next(fdrs)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            fdrs.close()
+            self.assertEqual(os.listdir(tmpdir), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_q_values(self):
+        q = stats.q_values(self.p_values)
+        self.assertTrue(numpy.all(q <= stats.FDR(self.p_values) + 1e-15))
+        numpy.testing.assert_allclose(
+            stats.q_values(self.p_values, pi0=1.0),
+            numpy.minimum(stats.FDR(self.p_values), 1.0))
+
+    def test_bonferroni(self):
+        self.assertEqual(stats.Bonferroni([0.1, 0.2]), [0.05, 0.1])
+        self.assertEqual(stats.Bonferroni([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
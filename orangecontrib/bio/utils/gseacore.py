@@ -0,0 +1,295 @@
+"""
+Enrichment scores of many gene sets on batches of rankings and their
+null distributions, used by :mod:`..gsea`.
+"""
+from __future__ import absolute_import
+
+import multiprocessing
+import random
+
+import numpy
+import scipy.sparse
+
+from . import parallel
+
+def enrichmentScoreRanked(subset, lcor, ordered, p=1.0, rev2=None):
+    """
+    Input data and subset. 
+    
+    subset: list of attribute indices of the input data belonging
+        to the same set.
+    lcor: correlations with class for each attribute in a list. 
+
+    Returns enrichment score on given data.
+
+    This implementation efficiently handles "sparse" genesets (that
+    cover only a small subset of all genes in the dataset).
+    """
+
+    #print lcor
+
+    subset = set(subset)
+
+    if rev2 is None:
+        def rev(l):
+            return numpy.argsort(l)
+        rev2 = rev(ordered)
+
+    #add if gene is not in the subset
+    notInA = -(1. / (len(lcor)-len(subset)))
+    #base for addition if gene is in the subset
+
+    cors = [ abs(lcor[i])**p for i in subset ] #belowe in numpy
+    sumcors = sum(cors)
+
+    #this should not happen
+    if sumcors == 0.0:
+        return (0.0, None)
+    
+    inAb = 1./sumcors
+
+    ess = [0.0]
+    
+    map = {}
+    for i in subset:
+        orderedpos = rev2[i]
+        map[orderedpos] = inAb*abs(lcor[i]**p)
+        
+    last = 0
+
+    maxSum = minSum = csum = 0.0
+
+    for a,b in sorted(map.items()):
+        diff = a-last
+        csum += notInA*diff
+        last = a+1
+        
+        if csum < minSum:
+            minSum = csum
+        
+        csum += b
+
+        if csum > maxSum:
+            maxSum = csum
+
+    #finish it
+    diff = (len(ordered))-last
+    csum += notInA*diff
+
+    if csum < minSum:
+        minSum = csum
+
+    #print "MY", (maxSum if abs(maxSum) > abs(minSum) else minSum)
+
+    """
+    #BY DEFINITION
+    print "subset", subset
+
+    for i in ordered:
+        ess.append(ess[-1] + \
+            (inAb*abs(lcor[i]**p) if i in subset else notInA)
+        )
+        if i in subset:
+            print ess[-2], ess[-1]
+            print i, (inAb*abs(lcor[i]**p))
+
+    maxEs = max(ess)
+    minEs = min(ess)
+    
+    print "REAL", (maxEs if abs(maxEs) > abs(minEs) else minEs, ess[1:])
+
+    """
+    return (maxSum if abs(maxSum) > abs(minSum) else minSum, [])
+
+def genesetsMembership(subsets, n):
+    """
+    Return a sparse (len(subsets) x n) gene set membership matrix.
+
+    subsets: list of lists of attribute indices (as in gseaR).
+
+    Column indices of each row are kept in the iteration order of
+    set(subset) so that enrichmentScoresBatch sums the weights in the
+    same order as enrichmentScoreRanked.
+    """
+    indices = [ list(set(subset)) for subset in subsets ]
+    indptr = numpy.cumsum([0] + [ len(ind) for ind in indices ])
+    indices = numpy.array([ i for ind in indices for i in ind ], dtype=int)
+    return scipy.sparse.csr_matrix(
+        (numpy.ones(len(indices)), indices, indptr), shape=(len(subsets), n))
+
+def _membershipBlocks(membership, maxcells=2**21):
+    """
+    Split gene sets into blocks of similar sizes. Yield (rows, index,
+    mask) tuples where index is a padded (len(rows) x size) array of
+    attribute indices and mask marks the valid elements.
+    """
+    sizes = numpy.diff(membership.indptr)
+    bysize = numpy.argsort(sizes, kind="mergesort")
+    start = 0
+    while start < len(bysize):
+        stop = start + 1
+        while stop < len(bysize) and \
+                (stop - start + 1) * max(sizes[bysize[stop]], 1) <= maxcells:
+            stop += 1
+        rows = bysize[start:stop]
+        width = max(sizes[rows[-1]], 1)
+        mask = numpy.arange(width)[None, :] < sizes[rows][:, None]
+        offsets = membership.indptr[rows][:, None] + numpy.arange(width)
+        index = numpy.zeros(mask.shape, dtype=int)
+        index[mask] = membership.indices[offsets[mask]]
+        yield rows, index, mask
+        start = stop
+
+def enrichmentScoresBatch(membership, rankings, p=1.0):
+    """
+    Compute enrichment scores of all gene sets for a batch of rankings.
+
+    membership: a gene set membership matrix (see genesetsMembership).
+    rankings: a (number of rankings x n) array of correlations with class
+        (for example the original ranking and its permutations).
+
+    Returns an (number of rankings x number of sets) array with the same
+    values as enrichmentScoreRanked. The running sums for all gene sets
+    are computed at once, but only at positions of gene set members.
+    """
+    rankings = numpy.atleast_2d(numpy.asarray(rankings, dtype=float))
+    nsets, n = membership.shape
+    res = numpy.zeros((len(rankings), nsets))
+    blocks = list(_membershipBlocks(membership))
+
+    for r, lcor in enumerate(rankings):
+        #position in the ordered list (descending correlation, stable)
+        ordered = numpy.argsort(-lcor, kind="mergesort")
+        rev2 = numpy.empty(n, dtype=int)
+        rev2[ordered] = numpy.arange(n)
+        cors = numpy.abs(lcor)**p
+        weights = numpy.abs(lcor**p)
+
+        for rows, index, mask in blocks:
+            size = mask.sum(axis=1)
+            #sequential sums (as sum() in enrichmentScoreRanked)
+            sumcors = numpy.cumsum(numpy.where(mask, cors[index], 0.0),
+                                   axis=1)[:, -1]
+            #empty sets and sets with zero weights are zeroed below
+            with numpy.errstate(divide="ignore"):
+                notInA = -(1. / (n - size))
+                inAb = 1. / sumcors
+            inAb[sumcors == 0.0] = 0.0
+
+            #members in ranking order, padding last
+            pos = numpy.where(mask, rev2[index], n)
+            order = numpy.argsort(pos, axis=1, kind="mergesort")
+            pos = pos[numpy.arange(len(rows))[:, None], order]
+            index = index[numpy.arange(len(rows))[:, None], order]
+
+            last = numpy.hstack([numpy.zeros((len(rows), 1), dtype=int),
+                                 pos[:, :-1] + 1])
+            misses = numpy.where(mask, notInA[:, None] * (pos - last), 0.0)
+            hits = numpy.where(mask, inAb[:, None] * weights[index], 0.0)
+
+            #interleaved increments: miss, hit, ..., miss, hit, final misses
+            width = mask.shape[1]
+            steps = numpy.zeros((len(rows), 2 * width + 1))
+            steps[:, 0:2 * width:2] = misses
+            steps[:, 1:2 * width:2] = hits
+            lastpos = numpy.where(size > 0,
+                                  pos[numpy.arange(len(rows)),
+                                      numpy.maximum(size - 1, 0)] + 1, 0)
+            steps[numpy.arange(len(rows)), 2 * size] = notInA * (n - lastpos)
+
+            csum = numpy.cumsum(steps, axis=1)
+            maxSum = numpy.max(numpy.where(mask, csum[:, 1:2 * width:2],
+                                           -numpy.inf), axis=1)
+            maxSum = numpy.maximum(maxSum, 0.0)
+            minSum = numpy.min(numpy.where(mask, csum[:, 0:2 * width:2],
+                                           numpy.inf), axis=1)
+            minSum = numpy.minimum(minSum,
+                                   csum[numpy.arange(len(rows)), 2 * size])
+            minSum = numpy.minimum(minSum, 0.0)
+
+            es = numpy.where(numpy.abs(maxSum) > numpy.abs(minSum),
+                             maxSum, minSum)
+            res[r, rows] = numpy.where(sumcors == 0.0, 0.0, es)
+
+    return res
+
+def permutationIndices(n, seeds):
+    """
+    Return a (len(seeds) x n) array of permutations of range(n). They
+    match gsea.shuffleList(l, random.Random(seed)) for each seed.
+    """
+    perms = numpy.empty((len(seeds), n), dtype=int)
+    for i, seed in enumerate(seeds):
+        perm = list(range(n))
+        random.Random(seed).shuffle(perm)
+        perms[i] = perm
+    return perms
+
+
+def runOptCallbacks(callback):
+    if callback is not None:
+        try:
+            [ a() for a in callback ]
+        except:
+            callback()            
+
+def permutationBlocks(n, workers=1, blockSize=50):
+    """
+    Split permutations range(n) into blocks of at most blockSize
+    permutations. With multiple workers blocks are made smaller, so that
+    the work is evenly distributed and progress is reported often.
+    """
+    if workers != 1:
+        workers = workers or multiprocessing.cpu_count()
+        blockSize = max(1, min(blockSize, n // (4 * workers)))
+    return [ (start, min(start+blockSize, n)) for start in range(0, n, blockSize) ]
+
+def _gseaNullsBlock(shared, block):
+    """
+    Null enrichment scores for permutations in range(*block). Permutation
+    i is always seeded with 2000+i, regardless of the block.
+    """
+    membership, lcor, data, rankingf, shuffle, permutation = shared
+    start, stop = block
+    if permutation == "class":
+        rankings = [ rankingf(shuffle(data, 2000+i)) #fixed permutation
+                     for i in range(start, stop) ]
+    else:
+        lcor = numpy.asarray(lcor, dtype=float)
+        rankings = lcor[permutationIndices(len(lcor),
+                                           range(2000+start, 2000+stop))]
+    return start, enrichmentScoresBatch(membership, rankings)
+
+def gseaNulls(membership, lcor, n, data=None, rankingf=None, shuffle=None,
+        permutation="class", callback=None, workers=1):
+    """
+    Return a (n x number of gene sets) array of enrichment scores on
+    permuted data (permutation="class") or permuted rankings lcor.
+    Data is permuted with shuffle(data, seed), a module level function.
+
+    Blocks of permutations are distributed over workers processes (None
+    for all CPUs). Each permutation has its own fixed seed, so the nulls
+    do not depend on the number of workers. The callback is called after
+    each permutation; if it raises an exception, the computation (and the
+    worker processes) are stopped.
+    """
+    if permutation == "class" and \
+            (data is None or rankingf is None or shuffle is None):
+        raise ValueError("class permutation needs data, rankingf and shuffle")
+
+    enrichmentNulls = numpy.zeros((n, membership.shape[0]))
+    blocks = permutationBlocks(n, workers,
+                               blockSize=1 if permutation == "class" else 50)
+    results = parallel.imap_unordered(
+        _gseaNullsBlock, blocks,
+        shared=(membership, lcor, data, rankingf, shuffle, permutation),
+        processes=workers)
+    try:
+        for start, nulls in results:
+            enrichmentNulls[start:start+len(nulls)] = nulls
+            for _ in range(len(nulls)):
+                runOptCallbacks(callback)
+    finally:
+        results.close()
+
+    return enrichmentNulls
@@ -0,0 +1,125 @@
+"""
+MeSH tree numbers coded with integers, used by :mod:`..mesh` to count
+annotated examples and compute enrichment of all terms at once.
+"""
+from __future__ import absolute_import
+
+from ast import literal_eval
+
+import six
+import numpy
+
+from . import stats
+
+HYPERG = stats.Hypergeometric()
+
+
+class MeSHIndex(object):
+    """
+    Integer codes of MeSH tree numbers.
+
+    :param dict toID: A mapping of MeSH term names to lists of their
+        tree numbers.
+    """
+
+    def __init__(self, toID):
+        self.ids = sorted(set(id for ids in six.itervalues(toID)
+                              for id in ids))
+        self.id_index = dict((id, i) for i, id in enumerate(self.ids))
+        # term name -> codes of its tree numbers
+        self.codes = dict((name, [self.id_index[id] for id in ids])
+                          for name, ids in six.iteritems(toID))
+
+    def encode(self, value, memo=None):
+        """
+        Return sorted unique codes of MeSH terms listed in `value` (a
+        string with a list of term names) and a list of terms missing
+        from the ontology. Codes are None if `value` can not be parsed.
+
+        Parsed values are stored in (and reused from) the `memo`
+        dictionary if it is given.
+        """
+        if memo is not None and value in memo:
+            return memo[value]
+        try:
+            terms = set(literal_eval(value))
+        except (SyntaxError, ValueError, TypeError):
+            encoded = None, []
+        else:
+            codes = [c for t in terms for c in self.codes.get(t, ())]
+            encoded = (numpy.unique(numpy.array(codes, dtype=int)),
+                       [t for t in terms if t not in self.codes])
+        if memo is not None:
+            memo[value] = encoded
+        return encoded
+
+    def counts(self, rows, weights=None):
+        """
+        Return (weighted) numbers of `rows` (arrays of codes) annotated
+        with each tree number.
+        """
+        if not rows:
+            return numpy.zeros(len(self.ids), dtype=int if weights is None
+                               else float)
+        indices = numpy.concatenate(rows)
+        if weights is not None:
+            weights = numpy.repeat(weights, [len(r) for r in rows])
+        return numpy.bincount(indices, weights=weights,
+                              minlength=len(self.ids))
+
+    def mask(self, ids):
+        """ Return a boolean mask of tree numbers in `ids`. """
+        mask = numpy.zeros(len(self.ids), dtype=bool)
+        mask[[self.id_index[id] for id in ids if id in self.id_index]] = True
+        return mask
+
+    def enrichment(self, ref_rows, ref_weights, clu_rows, clu_weights,
+                   fuzzy=False):
+        """
+        Return the enrichment of tree numbers annotating the reference
+        in the cluster, and the ratio of cluster and reference sizes.
+
+        Rows are arrays of codes of annotated examples and weights their
+        (fuzzy) memberships. The enrichment is a dictionary of lists
+        [reference count, cluster count, p value, fold enrichment]
+        with tree numbers as keys.
+        """
+        n = numpy.sum(ref_weights)    # reference size
+        cln = numpy.sum(clu_weights)  # cluster size
+        ratio = float(cln) / float(n)
+
+        terms = numpy.flatnonzero(self.counts(ref_rows))
+        ref = self.counts(ref_rows, ref_weights if fuzzy else None)[terms]
+        clu = self.counts(clu_rows, clu_weights if fuzzy else None)[terms]
+        p_values = HYPERG.p_values(clu.astype(int), int(n), int(cln),
+                                   ref.astype(int))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            fold = clu.astype(float) / ref / ratio
+        statistics = dict(
+            (self.ids[t], [r, c, p, f])
+            for t, r, c, p, f in zip(terms, ref.tolist(), clu.tolist(),
+                                     p_values.tolist(), fold.tolist()))
+        return statistics, ratio
+
+
+def tree_data(ids):
+    """
+    Return a dictionary with direct successors (among `ids`) of each tree
+    number in `ids` and a list of tree numbers without predecessors under
+    key "tops".
+    """
+    present = set(ids)
+    succesors = dict((i, []) for i in ids)
+    tops = []
+    for i in ids:
+        # the closest predecessor is the longest prefix from ids
+        parent = i
+        while "." in parent:
+            parent = parent.rsplit(".", 1)[0]
+            if parent in present:
+                succesors[parent].append(i)
+                break
+        else:
+            tops.append(i)
+    succesors["tops"] = tops
+    return succesors
@@ -0,0 +1,48 @@
+"""
+Helpers for running many independent queries in a process pool.
+"""
+from __future__ import absolute_import
+
+import multiprocessing
+
+#: The state shared by all tasks in a worker process.
+_shared = None
+
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+
+
+def _run_task(args):
+    func, task = args
+    return func(_shared, task)
+
+
+def imap_unordered(func, tasks, shared=None, processes=1):
+    """
+    Return an iterator over ``func(shared, task)`` for all `tasks` in
+    the order they are completed.
+
+    If `processes` is ``1`` the tasks are run in the calling process,
+    otherwise they are distributed over a pool of `processes` worker
+    processes (``None`` uses all available CPUs). The (possibly large)
+    `shared` state is sent to each worker only once and `func` must be
+    a module level (picklable) function.
+
+    """
+    if processes == 1:
+        for task in tasks:
+            yield func(shared, task)
+        return
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(shared,))
+    try:
+        for result in pool.imap_unordered(_run_task,
+                                          ((func, task) for task in tasks)):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
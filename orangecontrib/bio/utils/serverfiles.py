@@ -42,6 +42,8 @@ contain title, tags, size and date and time of the file.
 
 .. autofunction:: download
 
+.. autofunction:: download_many
+
 .. autofunction:: info
 
 .. autofunction:: listdomains
@@ -139,12 +141,24 @@ import bz2
 import glob
 import datetime
 import tempfile
+import hashlib
+import zlib
+import json
 
 import six
 
 #defserver = "localhost:9999/"
 defserver = "asterix.fri.uni-lj.si/orngServerFiles/"
 
+# the number of concurrent requests (file downloads by download_many and
+# domain infos by ServerFiles.allinfo_many)
+download_workers = 4
+
+# the time in seconds for which cached repository metadata is used without
+# asking the server, if the server does not specify it with max-age; with 0,
+# the cached metadata is revalidated with a conditional request every time
+metadata_max_age = 0
+
 def _parseFileInfo(fir, separ="|||||"):
     """
     Parses file info from server.
@@ -195,6 +209,99 @@ def _create_path(target):
     except OSError:
         pass
 
+def _replace(src, dst):
+    if os.name == "nt" and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _session(server):
+    """
+    Return a requests.Session for the server. Sessions are shared by all
+    ServerFiles objects, so connections are kept alive and reused.
+    """
+    with _sessions_lock:
+        if server not in _sessions:
+            import requests
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                max_retries=2, pool_maxsize=max(download_workers, 1))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[server] = session
+        return _sessions[server]
+
+def _metadata_path(key):
+    return os.path.join(environ.buffer_dir, "bigfiles-metadata", key + ".json")
+
+def _load_metadata(key):
+    try:
+        with open(_metadata_path(key)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _save_metadata(key, entry):
+    path = _metadata_path(key)
+    try:
+        _create_path_for_file(path)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path),
+                                         delete=False) as f:
+            json.dump(entry, f)
+        _replace(f.name, path)
+    except (IOError, OSError):
+        pass # the cache is optional
+
+def _max_age(headers):
+    cache_control = headers.get("Cache-Control", "")
+    for directive in cache_control.split(","):
+        directive = directive.strip().lower()
+        if directive in ["no-cache", "no-store"]:
+            return 0
+        if directive.startswith("max-age="):
+            try:
+                return int(directive[len("max-age="):])
+            except ValueError:
+                return 0
+    return metadata_max_age
+
+def _special_tags(info):
+    return dict([tag.split(":", 1) for tag in info["tags"] if tag.startswith("#") and ":" in tag])
+
+class _Decompress(object):
+    """
+    A file-like object that decompresses gz or bz2 data chunk by chunk
+    and writes it into fileobj.
+    """
+
+    def __init__(self, compression, fileobj):
+        if compression not in ["gz", "bz2"]:
+            raise ValueError("Unsupported compression: %s" % compression)
+        self.compression = compression
+        self.fileobj = fileobj
+        self.decompressor = self._decompressor()
+
+    def _decompressor(self):
+        if self.compression == "gz":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            return bz2.BZ2Decompressor()
+
+    def write(self, data):
+        while data:
+            self.fileobj.write(self.decompressor.decompress(data))
+            # a new stream (gzip member) begins after the end of the last one
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = self._decompressor()
+
+    def close(self):
+        if self.compression == "gz":
+            self.fileobj.write(self.decompressor.flush())
+        self.fileobj.close()
+
 def localpath(domain=None, filename=None):
     """Return a path for the domain in the local repository. If 
     filename is given, return a path to corresponding file."""
@@ -286,50 +393,106 @@ class ServerFiles(object):
         """List all domains on repository."""
         return _parseList(self._open('listdomains', {}))
 
-    def download(self, domain, filename, target, callback=None):
+    def download(self, domain, filename, target, callback=None, info=None,
+                 decompress=None):
         """
         Downloads file from the repository to a given target name. Callback
         can be a function without arguments. It will be called once for each
         downloaded percent of file: 100 times for the whole file.
+
+        The file is streamed into target + ".partial", which is renamed to
+        target when complete. If a partial file from an interrupted download
+        exists, the download is resumed with a HTTP Range request. If
+        decompress is "gz" or "bz2", the data is decompressed into target
+        while downloading. If repository info of the file is given, the size
+        and, if the file has a "#md5" tag, the checksum are verified.
         """
         _create_path_for_file(target)
+        partial = target + ".partial"
+        tmp = target + ".tmp"
+
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        response = self._download_response(domain, filename, offset)
+        if offset and response.status_code != 206:
+            # range was not satisfied; download the whole file
+            response.close()
+            offset = 0
+            response = self._download_response(domain, filename, 0)
+        out = None
+        try:
+            response.raise_for_status()
+            size = offset + int(response.headers.get("content-length", 0))
+            if info is not None:
+                size = int(info["size"])
+
+            md5 = hashlib.md5()
+            if decompress:
+                out = _Decompress(decompress, open(tmp, "wb"))
+            with open(partial, "ab" if offset else "wb") as f:
+                if offset:
+                    # replay the downloaded part
+                    with open(partial, "rb") as old:
+                        for buf in iter(lambda: old.read(1024*64), b""):
+                            md5.update(buf)
+                            if out:
+                                out.write(buf)
+
+                lastchunkreport = float(offset) / size if size else 0.0001
+                readb = offset
+                for buf in response.iter_content(1024*64):
+                    readb += len(buf)
+                    while size and float(readb) / size > lastchunkreport+0.01:
+                        lastchunkreport += 0.01
+                        if callback:
+                            callback()
+                    f.write(buf)
+                    md5.update(buf)
+                    if out:
+                        out.write(buf)
+            if out:
+                out.close()
+
+            expected_md5 = _special_tags(info).get("#md5") if info else None
+            if readb != size or \
+                    (expected_md5 and md5.hexdigest() != expected_md5):
+                if readb > size or expected_md5:
+                    os.remove(partial)
+                raise IOError("Download of %s/%s failed: got %d of %d bytes%s"
+                              % (domain, filename, readb, size,
+                                 ", checksum mismatch" if readb == size
+                                 else ""))
+        except BaseException:
+            # only the partial file is kept for resuming
+            if out:
+                out.fileobj.close()
+                os.remove(tmp)
+            raise
+        finally:
+            response.close()
 
-        fdown = self.downloadFH(domain, filename)
-        size = int(fdown.getheader('content-length'))
-
-        f = tempfile.TemporaryFile()
- 
-        chunksize = 1024*8
-        lastchunkreport= 0.0001
-
-        readb = 0
-        # in case size == 0 skip the loop
-        while size > 0:
-            buf = fdown.read(chunksize)
-            readb += len(buf)
-
-            while float(readb) / size > lastchunkreport+0.01:
-                #print float(readb)/size, lastchunkreport + 0.01, float(readb)/size - lastchunkreport 
-                lastchunkreport += 0.01
-                if callback:
-                    callback()
-            if not buf:
-                break
-            f.write(buf)
-
-        fdown.close()
-        f.seek(0)
-
-        shutil.copyfileobj(f, open(target, "wb"))
+        if decompress:
+            _replace(tmp, target)
+            os.remove(partial)
+        else:
+            _replace(partial, target)
 
         if callback:
             callback()
 
+    def _requests_session(self):
+        return _session(self.server)
+
+    def _download_response(self, domain, filename, offset=0):
+        data = self._addAccessCode({ 'domain': domain, 'filename': filename })
+        root = self.secureroot if self._authen() else self.publicroot
+        headers = { "Range": "bytes=%d-" % offset } if offset else {}
+        return self._server_response(root, 'download', data, None,
+                                     headers=headers)
+
     def _searchinfo(self):
         domains = self.listdomains()
         infos = {}
-        for dom in domains:
-            dominfo = self.allinfo(dom)
+        for dom, dominfo in self.allinfo_many(domains).items():
             for a,b in dominfo.items():
                 infos[(dom, a)] = b
         return infos
@@ -369,6 +532,26 @@ class ServerFiles(object):
         """
         return _parseAllFileInfo(self._open('allinfo', { 'domain': domain }))
 
+    def allinfo_many(self, domains, workers=None):
+        """Return a dictionary, where keys are domains and values their
+        :obj:`allinfo`. Up to `workers` (default: `download_workers`)
+        domains are fetched concurrently.
+        """
+        domains = list(domains)
+        if workers is None:
+            workers = download_workers
+        if workers <= 1 or len(domains) <= 1:
+            return dict((domain, self.allinfo(domain)) for domain in domains)
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(domains)))
+        try:
+            infos = pool.map(self.allinfo, domains)
+        finally:
+            pool.terminate()
+            pool.join()
+        return dict(zip(domains, infos))
+
     def index(self):
         return self._open('index', {})
 
@@ -381,22 +564,20 @@ class ServerFiles(object):
         else:
             return False
 
-    def _server_request(self, root, command, data, files, repeat=2, raw=False):
-        import requests
-        req = requests.Session()
-        a = requests.adapters.HTTPAdapter(max_retries=repeat)
-        req.mount('https://', a)
-        req.mount('http://', a)
+    def _server_response(self, root, command, data, files, headers=None):
+        req = self._requests_session()
 
         auth = None
         if self._authen():
             auth = (self.username, self.password)
 
         if data:
-            ans = req.post(root+command, data=data, files=files, auth=auth, verify=False, timeout=timeout, stream=True)
+            return req.post(root+command, data=data, files=files, auth=auth, headers=headers, verify=False, timeout=timeout, stream=True)
         else:
-            ans = req.get(root+command, auth=auth, verify=False, timeout=timeout, stream=True)
+            return req.get(root+command, auth=auth, headers=headers, verify=False, timeout=timeout, stream=True)
 
+    def _server_request(self, root, command, data, files, raw=False):
+        ans = self._server_response(root, command, data, files)
         return str(ans.text) if not raw else ans.raw
     
     def _handle(self, command, data, files=None, raw=False):
@@ -406,9 +587,71 @@ class ServerFiles(object):
             addr = self.secureroot
         return self._server_request(addr, command, data, files, raw=raw)
 
+    #: Commands with public metadata, which is cached on disk.
+    CACHED_COMMANDS = ("info", "allinfo", "list", "listdomains")
+
     def _open(self, command, data, files=None):
+        if command in self.CACHED_COMMANDS and not files and not self._authen():
+            return self._open_cached(command, data)
         return self._handle(command, data, files)
 
+    def _open_cached(self, command, data):
+        """
+        Return the answer to a command from the on-disk metadata cache.
+        A cached answer is used without a request while it is fresh (see
+        max-age of Cache-Control and metadata_max_age), and revalidated
+        with a conditional request (ETag or Last-Modified) otherwise.
+        """
+        key = self._metadata_key(command, data)
+        entry = _load_metadata(key)
+        if entry is not None and entry["expires"] > time.time():
+            return str(entry["body"])
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        ans = self._server_response(self.publicroot, command, data, None,
+                                    headers=headers)
+        if ans.status_code == 304 and entry is not None:
+            body = entry["body"]
+        elif ans.status_code == 200:
+            body = ans.text
+            entry = {}
+        else:
+            return str(ans.text)
+
+        entry = {
+            "body": body,
+            "etag": ans.headers.get("ETag", entry.get("etag")),
+            "last_modified": ans.headers.get("Last-Modified",
+                                             entry.get("last_modified")),
+            "expires": time.time() + _max_age(ans.headers)}
+        if entry["etag"] or entry["last_modified"] or \
+                entry["expires"] > time.time():
+            _save_metadata(key, entry)
+        return str(body)
+
+    def _metadata_key(self, command, data):
+        key = json.dumps([self.publicroot, command, sorted(data.items()),
+                          self.access_code])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _fresh_allinfo(self, domain):
+        """
+        Return :obj:`allinfo` of the domain if it is fresh in the metadata
+        cache (it can be used without a request), and None otherwise.
+        """
+        if self._authen():
+            return None
+        entry = _load_metadata(self._metadata_key('allinfo',
+                                                  { 'domain': domain }))
+        if entry is None or entry["expires"] <= time.time():
+            return None
+        return _parseAllFileInfo(str(entry["body"]))
+
     def _addAccessCode(self, data):
         if self.access_code != None:
             data = data.copy()
@@ -507,12 +750,23 @@ def download(domain, filename, serverfiles=None, callback=None,
         serverfiles = ServerFiles()
 
     info = serverfiles.info(domain, filename)
-    specialtags = dict([tag.split(":") for tag in info["tags"] if tag.startswith("#") and ":" in tag])
+    specialtags = _special_tags(info)
     extract = extract and ("#uncompressed" in specialtags or "#compression" in specialtags)
     target = localpath(domain, filename)
     if ConsoleProgressBar:
         callback = DownloadProgress(filename, int(info["size"])) if verbose and not callback else callback    
-    serverfiles.download(domain, filename, target + ".tmp" if extract else target, callback=callback)
+
+    archive = (specialtags.get("#compression") in ["tar.gz", "tar.bz2"] and \
+               specialtags.get("#files")) or filename.endswith(".tar.gz")
+    if extract and not archive and \
+            specialtags.get("#compression") in ["gz", "bz2"]:
+        # decompress while downloading
+        serverfiles.download(domain, filename, target, callback=callback,
+                             info=info, decompress=specialtags["#compression"])
+        extract = False
+    else:
+        serverfiles.download(domain, filename, target + ".tmp" if extract else target,
+                             callback=callback, info=info)
     
     #file saved, now save info file
 
@@ -524,6 +778,7 @@ def download(domain, filename, serverfiles=None, callback=None,
             f = tarfile.open(target + ".tmp")
             f.extractall(localpath(domain))
             shutil.copyfile(target + ".tmp", target)
+            f.close()
         elif filename.endswith(".tar.gz"):
             f = tarfile.open(target + ".tmp")
             try:
@@ -531,19 +786,56 @@ def download(domain, filename, serverfiles=None, callback=None,
             except Exception:
                 pass
             f.extractall(target)
-        elif specialtags.get("#compression") == "gz":
-            f = gzip.open(target + ".tmp")
-            shutil.copyfileobj(f, open(target, "wb"))
-        elif specialtags.get("#compression") == "bz2":
-            f = bz2.BZ2File(target + ".tmp", "r")
-            shutil.copyfileobj(f, open(target, "wb"))
-        f.close()
+            f.close()
+        else:
+            shutil.copyfile(target + ".tmp", target)
         os.remove(target + ".tmp")
 
     if ConsoleProgressBar and type(callback) == DownloadProgress:
         callback.finish()
 
 
+def download_many(files, serverfiles=None, workers=None, callback=None,
+                  extract=True):
+    """
+    Download a list of files, given as (domain, filename) tuples, to the
+    local repository. Up to `workers` (default: `download_workers`) files
+    are downloaded concurrently over a shared connection pool. Callback, if
+    given, is called with (domain, filename) after each finished download.
+    Return the list of downloaded files.
+    """
+    if not serverfiles:
+        serverfiles = ServerFiles()
+    if workers is None:
+        workers = download_workers
+    files = list(files)
+
+    def download_one(file):
+        domain, filename = file
+        download(domain, filename, serverfiles, extract=extract, verbose=False)
+        return file
+
+    if workers <= 1 or len(files) <= 1:
+        results = six.moves.map(download_one, files)
+        pool = None
+    else:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(files)))
+        results = pool.imap_unordered(download_one, files)
+
+    done = []
+    try:
+        for file in results:
+            done.append(file)
+            if callback:
+                callback(*file)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return done
+
+
 @_locked
 def localpath_download(domain, filename, **kwargs):
     """ 
@@ -634,17 +926,27 @@ def allinfo(domain):
         dic[filename] = info(domain, target)
     return dic
 
-def needs_update(domain, filename, serverfiles=None):
+def needs_update(domain, filename, serverfiles=None, allinfo=None):
     """True if a file does not exist in the local repository
-    or if there is a newer version on the server."""
+    or if there is a newer version on the server.
+
+    `allinfo` is an optional (already retrieved) :obj:`ServerFiles.allinfo`
+    of the domain. If it is not given, the info of the whole domain is
+    used only if it is fresh in the metadata cache.
+    """
     if serverfiles == None: serverfiles = ServerFiles()
     if filename not in listfiles(domain):
         return True
     dt_fmt = "%Y-%m-%d %H:%M:%S"
     dt_local = datetime.datetime.strptime(
         info(domain, filename)["datetime"][:19], dt_fmt)
+    if allinfo is None:
+        allinfo = serverfiles._fresh_allinfo(domain) or {}
+    server_info = allinfo.get(filename)
+    if server_info is None:
+        server_info = serverfiles.info(domain, filename)
     dt_server = datetime.datetime.strptime(
-        serverfiles.info(domain, filename)["datetime"][:19], dt_fmt)
+        server_info["datetime"][:19], dt_fmt)
     return dt_server > dt_local
 
 def update(domain, filename, serverfiles=None, **kwargs):
@@ -782,7 +1084,7 @@ if ConsoleProgressBar:
 def consoleupdate(domains=None, searchstr="essential"):
     domains = domains or listdomains()
     sf = ServerFiles()
-    info = dict((d, sf.allinfo(d)) for d in domains)
+    info = sf.allinfo_many(domains)
     def searchmenu():
         def printmenu():
             print("\tSearch tags:", search)
@@ -856,30 +1158,38 @@ def consoleupdate(domains=None, searchstr="essential"):
 
 def update_local_files(verbose=True):
     sf = ServerFiles()
-    for domain, filename in search(""):
+    local = search("")
+    serverinfo = sf.allinfo_many(set(domain for domain, _ in local))
+    status = []
+    for domain, filename in local:
         try:
-            dateserver = sf.info(domain, filename)["datetime"]
+            dateserver = serverinfo[domain][filename]["datetime"]
         except:
             dateserver = None
         uptodate = dateserver <= info(domain, filename)["datetime"]
-        if dateserver and not uptodate:
-            download(domain, filename, sf)
-        if verbose:
-            print(filename, "Ok" if uptodate else "Updated")
+        status.append((domain, filename, dateserver and not uptodate))
+    download_many([(domain, filename) for domain, filename, outdated in status
+                   if outdated], sf)
+    if verbose:
+        for domain, filename, outdated in status:
+            print(filename, "Updated" if outdated else "Ok")
 
 def update_by_tags(tags=["essential"], domains=[], verbose=True):
     sf = ServerFiles()
+    status = []
     for domain, filename in sf.search(tags + domains, inTitle=False, inName=False):
         if domains and domain not in domain:
             continue
         if os.path.exists(localpath(domain, filename)+".info"):
-            uptodate = sf.info(domain, filename)["datetime"] <= info(domain, filename)["datetime"]
+            uptodate = sf.searchinfo[(domain, filename)]["datetime"] <= info(domain, filename)["datetime"]
         else:
             uptodate = False
-        if not uptodate:
-            download(domain, filename, sf)
-        if verbose:
-            print(filename, "Ok" if uptodate else "Updated")
+        status.append((domain, filename, not uptodate))
+    download_many([(domain, filename) for domain, filename, outdated in status
+                   if outdated], sf)
+    if verbose:
+        for domain, filename, outdated in status:
+            print(filename, "Updated" if outdated else "Ok")
             
 def _example(myusername, mypassword):
 
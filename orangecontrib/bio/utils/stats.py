@@ -2,6 +2,14 @@ import math
 import threading
 import six
 
+import numpy
+import scipy.special
+
+try:
+    from functools import lru_cache
+except ImportError:
+    from Orange.utils import lru_cache
+
 
 def _lngamma(z):
     x = 0
@@ -18,10 +26,17 @@ def _lngamma(z):
     return math.log(x) - 5.58106146679532777 - z + (z - 0.5) * math.log(z + 6.5)
         
 
+@lru_cache(maxsize=2 ** 16)
+def _p_value_memo(cls, k, N, m, n):
+    # The distributions are stateless: the memo is shared by all instances
+    # of a distribution class.
+    return cls()._p_value(k, N, m, n)
+
+
 class LogBin(object):
     _max = 2
-    _lookup = [0.0, 0.0]
-    _max_factorial = 1
+    #: log(i!) for i in range(_max)
+    _lookup = numpy.zeros(2)
     _lock = threading.Lock()
 
     def __init__(self, max=1000):
@@ -32,22 +47,30 @@ class LogBin(object):
         with LogBin._lock:
             if max <= LogBin._max:
                 return
-            for i in range(LogBin._max, max):
-                if i > 1000: ## an arbitrary cuttof
-                    LogBin._lookup.append(LogBin._logfactorial(i))
-                else:
-                    LogBin._max_factorial *= i
-                    LogBin._lookup.append(math.log(LogBin._max_factorial))
+            max = int(max if max > 2 * LogBin._max else 2 * LogBin._max)
+            # Replace the table before updating _max (readers do not lock)
+            LogBin._lookup = scipy.special.gammaln(numpy.arange(max) + 1.0)
             LogBin._max = max
 
     def _logbin(self, n, k):
         if n >= self._max:
             self._extend(n + 100)
         if k < n and k >= 0:
-            return self._lookup[n] - self._lookup[n - k] - self._lookup[k]
+            lookup = self._lookup
+            return float(lookup[n] - lookup[n - k] - lookup[k])
         else:
             return 0.0
 
+    def _logbin_array(self, n, k):
+        """ Vectorized :func:`_logbin`. """
+        n, k = numpy.broadcast_arrays(n, k)
+        if n.size and n.max() >= self._max:
+            self._extend(n.max() + 100)
+        lookup = self._lookup
+        valid = (k < n) & (k >= 0)
+        n, k = numpy.where(valid, n, 0), numpy.where(valid, k, 0)
+        return lookup[n] - lookup[n - k] - lookup[k]
+
     @staticmethod
     def _logfactorial(n):
         if (n <= 1):
@@ -55,6 +78,77 @@ class LogBin(object):
         else:
             return _lngamma(n + 1)
 
+    def _support_max(self, N, m, n):
+        raise NotImplementedError
+
+    def _log_pmf(self, k, N, m, n):
+        raise NotImplementedError
+
+    def _sum_pmf(self, start, stop, N, m, n):
+        """
+        Return the sums of probabilities for k in range(start[i], stop[i])
+        for all i (computed with log-sum-exp over the concatenated ranges).
+        """
+        lengths = numpy.maximum(stop - start, 0)
+        total = numpy.zeros(len(lengths))
+        nonempty = lengths > 0
+        if not nonempty.any():
+            return total
+        offsets = numpy.cumsum(lengths) - lengths
+        seg = numpy.repeat(numpy.arange(len(lengths)), lengths)
+        k = start[seg] + numpy.arange(lengths.sum()) - offsets[seg]
+        # min(..., 1.0) as in __call__
+        logp = numpy.minimum(self._log_pmf(k, N[seg], m[seg], n[seg]), 0.0)
+
+        heads = offsets[nonempty]
+        peak = numpy.full(len(lengths), -numpy.inf)
+        peak[nonempty] = numpy.maximum.reduceat(logp, heads)
+        finite = numpy.isfinite(peak)
+        shift = numpy.where(finite, peak, 0.0)
+        total[nonempty] = numpy.add.reduceat(numpy.exp(logp - shift[seg]),
+                                             heads)
+        return numpy.where(finite, total * numpy.exp(shift), 0.0)
+
+    def p_value(self, k, N, m, n):
+        """ The probability that k or more tests are positive. """
+        return _p_value_memo(type(self), k, N, m, n)
+
+    def _p_value(self, k, N, m, n):
+        raise NotImplementedError
+
+    def p_values(self, k, N, m, n):
+        """
+        Vectorized :func:`p_value`. The arguments are broadcast against
+        each other; return an array of probabilities that `k` or more tests
+        are positive.
+
+        Repeated (`k`, `N`, `m`, `n`) combinations are computed only once.
+        """
+        args = numpy.broadcast_arrays(
+            *[numpy.asarray(a, dtype=numpy.int64) for a in (k, N, m, n)])
+        shape = args[0].shape
+        rows = numpy.column_stack([a.ravel() for a in args])
+        if not len(rows):
+            return numpy.zeros(shape)
+        rows, inverse = numpy.unique(rows, axis=0, return_inverse=True)
+        k, N, m, n = rows.T
+        top = self._support_max(N, m, n)
+
+        # Sum over the shorter tail (see p_value)
+        res = numpy.empty(len(k))
+        upper = top - k + 1 <= k
+        res[upper] = self._sum_pmf(k[upper], top[upper] + 1, N[upper],
+                                   m[upper], n[upper])
+        lower = numpy.flatnonzero(~upper)
+        value = 1.0 - self._sum_pmf(numpy.zeros_like(lower), k[lower],
+                                    N[lower], m[lower], n[lower])
+        # Small values are inexact due to the limited precision of floats
+        inexact = value < 1e-3
+        li = lower[inexact]
+        value[inexact] = self._sum_pmf(k[li], top[li] + 1, N[li], m[li], n[li])
+        res[lower] = value
+        return res[inverse.ravel()].reshape(shape)
+
 class Binomial(LogBin):
     """ `Binomial distribution 
     <http://en.wikipedia.org/wiki/Binomial_distribution>`_ is a discrete
@@ -86,8 +180,21 @@ class Binomial(LogBin):
             raise
 ##        return math.exp(self._logbin(n, k) + math.log((p**k) * (1.0 - p)**(n - k)))
 
-    def p_value(self, k, N, m, n):
-        """ The probability that k or more tests are positive. """
+    def _support_max(self, N, m, n):
+        return n
+
+    def _log_pmf(self, k, N, m, n):
+        p = m / N.astype(float)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            logp = (self._logbin_array(n, k) + k * numpy.log(p) +
+                    (n - k) * numpy.log(1.0 - p))
+        logp = numpy.where(p == 0.0, numpy.where(k == 0, 0.0, -numpy.inf),
+                           logp)
+        logp = numpy.where(p == 1.0, numpy.where(k == n, 0.0, -numpy.inf),
+                           logp)
+        return logp
+
+    def _p_value(self, k, N, m, n):
         if n - k + 1 <= k:
             #starting from k gives the shorter list of values
             return sum(self.__call__(i, N, m, n) for i in range(k, n+1))
@@ -125,11 +232,16 @@ class Hypergeometric(LogBin):
             print(k, N, m, n)
             raise
 
-    def p_value(self, k, N, m, n):
-        """ 
-        The probability that k or more tests are positive.
-        """
+    def _support_max(self, N, m, n):
+        return numpy.minimum(n, m)
+
+    def _log_pmf(self, k, N, m, n):
+        outside = (k < numpy.maximum(0, n + m - N)) | (k > numpy.minimum(n, m))
+        logp = (self._logbin_array(m, k) + self._logbin_array(N - m, n - k) -
+                self._logbin_array(N, n))
+        return numpy.where(outside, -numpy.inf, logp)
 
+    def _p_value(self, k, N, m, n):
         if min(n,m) - k + 1 <= k:
             #starting from k gives the shorter list of values
             return sum(self.__call__(i, N, m, n) for i in range(k, min(n,m)+1))
@@ -144,68 +256,177 @@ class Hypergeometric(LogBin):
             else:
                 return value
 
-## to speed-up FDR, calculate ahead sum([1/i for i in range(1, m+1)]), for m in [1,100000]. For higher values of m use an approximation, with error less or equal to 4.99999157277e-006. (sum([1/i for i in range(1, m+1)])  ~ log(m) + 0.5772..., 0.5572 is an Euler-Mascheroni constant) 
-c = [1.0]
-for m in range(2, 100000):
-    c.append( c[-1] + 1.0/m)
+def _harmonic_number(m):
+    """ Return sum(1.0 / i for i in range(1, m + 1)). """
+    return float(scipy.special.digamma(m + 1.0) + numpy.euler_gamma)
 
 def is_sorted(l):
     return all(l[i] <= l[i+1] for i in range(len(l)-1))
 
+def _fdr_factor(m, dependent):
+    return m * _harmonic_number(m) if dependent else m
+
 def FDR(p_values, dependent=False, m=None, ordered=False):
     """
     `False Discovery Rate <http://en.wikipedia.org/wiki/False_discovery_rate>`_ correction on a list of p-values.
 
-    :param p_values: a list of p-values.
-    :param dependent: use correction for dependent hypotheses (default False).
+    :param p_values: a list (or a NumPy array) of p-values.
+    :param dependent: use correction for dependent hypotheses
+        (Benjamini-Yekutieli; default False).
     :param m: number of hypotheses tested (default ``len(p_values)``).
     :param ordered: prevent sorting of p-values if they are already sorted (default False).
-    """
-
-    if not ordered:
-        ordered = is_sorted(p_values)
 
-    if not ordered:
-        joined = [ (v,i) for i,v in enumerate(p_values) ]
-        joined.sort()
-        p_values = [ p[0] for p in joined ]
-        indices = [ p[1] for p in joined ]
+    Return a list of adjusted p-values (an array if `p_values` is an array).
+    """
+    is_array = isinstance(p_values, numpy.ndarray)
+    p_values = numpy.asarray(p_values, dtype=float)
 
     if not m:
         m = len(p_values)
-    if m <= 0 or not p_values:
-        return []
+    if m <= 0 or not len(p_values):
+        return p_values[:0].copy() if is_array else []
+
+    m = _fdr_factor(m, dependent)
+
+    if ordered:
+        order = None
+    else:
+        order = numpy.argsort(p_values, kind="mergesort")
+        p_values = p_values[order]
+
+    fdrs = p_values * m / numpy.arange(1, len(p_values) + 1)
+    fdrs = numpy.minimum.accumulate(fdrs[::-1])[::-1]
+
+    if order is not None:
+        unsorted = numpy.empty_like(fdrs)
+        unsorted[order] = fdrs
+        fdrs = unsorted
+
+    return fdrs if is_array else fdrs.tolist()
+
+def FDR_chunked(chunks, dependent=False, m=None, tmpdir=None,
+                block_size=2 ** 20):
+    """
+    :func:`FDR` correction for p-values that do not fit in memory.
+
+    `chunks` is an iterable of p-value arrays (e.g. slices of a
+    memory mapped file); the adjusted p-values are yielded in the same
+    order and with the same chunk sizes. The result is the same as
+    ``FDR(numpy.concatenate(chunks), ...)``, but only a few chunks (and
+    about `block_size` merged p-values) are kept in memory at a time;
+    the rest are stored in a temporary directory in `tmpdir`.
+
+    The sorted chunks are merged (from the largest p-value down) in
+    blocks, which gives the global ranks and the running minimum of the
+    adjusted values in a single pass.
+
+    The temporary directory is created when the generator is first
+    advanced and removed when it is exhausted or closed. Callers that
+    may stop iterating early should close the generator (e.g. with
+    :func:`contextlib.closing`).
+
+    """
+    import tempfile
+    import shutil
+    import os
 
-    if dependent: # correct q for dependent tests
-        k = c[m-1] if m <= len(c) else math.log(m) + 0.57721566490153286060651209008240243104215933593992
-        m = m * k
+    tmpdir = tempfile.mkdtemp(dir=tmpdir)
+    path = lambda i, kind: os.path.join(tmpdir, "%i.%s.npy" % (i, kind))
+    load = lambda i, kind: numpy.load(path(i, kind), mmap_mode="r")
+    try:
+        sizes = []
+        for chunk in chunks:
+            chunk = numpy.asarray(chunk, dtype=float).ravel()
+            order = numpy.argsort(chunk, kind="mergesort")
+            numpy.save(path(len(sizes), "order"), order)
+            numpy.save(path(len(sizes), "sorted"), chunk[order])
+            sizes.append(len(chunk))
+        total = sum(sizes)
 
-    tmp_fdrs = [p*m/(i+1.0) for (i, p) in enumerate(p_values)]
-    fdrs = []
-    cmin = tmp_fdrs[-1]
-    for f in reversed(tmp_fdrs):
-        cmin = min(f, cmin)
-        fdrs.append( cmin)
-    fdrs.reverse()
+        if not m:
+            m = total
+        m = _fdr_factor(m, dependent)
 
-    if not ordered:
-        new = [ None ] * len(fdrs)
-        for v,i in zip(fdrs, indices):
-            new[i] = v
-        fdrs = new
+        # Merge the sorted chunks in descending order. The values of a
+        # round are those not smaller than the smallest value in the
+        # window of any chunk that is not exhausted by its window: all
+        # larger values are then known. The order of equal p-values
+        # does not matter, they all get the same adjusted value.
+        sorted_p = [load(i, "sorted") for i in range(len(sizes))]
+        fdrs = [numpy.lib.format.open_memmap(
+                    path(i, "fdr"), mode="w+", dtype=float, shape=(size,))
+                for i, size in enumerate(sizes)]
+        ends = list(sizes)  # values above ends[i] are merged
+        window = max(1, block_size // max(1, len(sizes)))
+        merged, running_min = 0, numpy.inf
+        while merged < total:
+            active = [i for i in range(len(sizes)) if ends[i]]
+            starts = dict((i, max(0, ends[i] - window)) for i in active)
+            bounds = [sorted_p[i][starts[i]] for i in active if starts[i]]
+            cutoff = max(bounds) if bounds else -numpy.inf
+            parts, owners = [], []
+            for i in active:
+                values = numpy.asarray(sorted_p[i][starts[i]:ends[i]])
+                start = starts[i] + numpy.searchsorted(values, cutoff)
+                parts.append(values[start - starts[i]:])
+                owners.append((i, start))
+            values = numpy.concatenate(parts)
+            order = numpy.argsort(-values, kind="mergesort")
+            ranks = total - merged - numpy.arange(len(values))
+            adjusted = numpy.minimum.accumulate(
+                numpy.minimum(values[order] * m / ranks, running_min))
+            running_min = adjusted[-1]
+            unmerged = numpy.empty_like(adjusted)
+            unmerged[order] = adjusted
+            offset = 0
+            for (i, start), part in zip(owners, parts):
+                fdrs[i][start:ends[i]] = unmerged[offset:offset + len(part)]
+                offset += len(part)
+                ends[i] = start
+            merged += len(values)
+        for fdr in fdrs:
+            fdr.flush()
+        del fdrs, sorted_p
 
-    return fdrs
+        for i in range(len(sizes)):
+            fdrs = numpy.empty(sizes[i])
+            fdrs[load(i, "order")] = load(i, "fdr")
+            yield fdrs
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def q_values(p_values, pi0=None, lambda_=0.5, m=None):
+    """
+    `Storey's q-values <http://en.wikipedia.org/wiki/False_discovery_rate#q-value>`_
+    for a list of p-values.
+
+    :param p_values: a list (or a NumPy array) of p-values.
+    :param pi0: the proportion of true null hypotheses (estimated from
+        the p-values greater than `lambda_` if not given).
+    :param m: number of hypotheses tested (default ``len(p_values)``).
+
+    """
+    is_array = isinstance(p_values, numpy.ndarray)
+    p = numpy.asarray(p_values, dtype=float)
+    if not len(p):
+        return p[:0].copy() if is_array else []
+    if pi0 is None:
+        pi0 = numpy.count_nonzero(p > lambda_) / ((1.0 - lambda_) * len(p))
+        pi0 = min(max(pi0, 1.0 / len(p)), 1.0)
+    q = numpy.minimum(pi0 * FDR(p, m=m), 1.0)
+    return q if is_array else q.tolist()
 
 def Bonferroni(p_values, m=None):
     """
     `Bonferroni correction <http://en.wikipedia.org/wiki/Bonferroni_correction>`_ correction on a list of p-values.
 
-    :param p_values: a list of p-values.
+    :param p_values: a list (or a NumPy array) of p-values.
     :param m: number of hypotheses tested (default ``len(p_values)``).
     """
+    is_array = isinstance(p_values, numpy.ndarray)
     if not m:
         m = len(p_values)
     if m == 0:
-        return []
-    m = float(m)
-    return [p/m for p in p_values]
+        return numpy.asarray(p_values, dtype=float)[:0] if is_array else []
+    corrected = numpy.asarray(p_values, dtype=float) / float(m)
+    return corrected if is_array else corrected.tolist()